@@ -1,6 +1,6 @@
 import streamlit as st
-import importlib
-import os
+import time
+from agent_discovery import discover_agents, discovery_fingerprint, load_agent
 
 # Fix annoying UI issues
 st.markdown(
@@ -18,22 +18,14 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-# Function to get available agent modules and their names
-def get_available_agents():
-    agents = {}
-    for file in os.listdir('.'):
-        if file.endswith('_agent.py'):
-            module_name = file[:-3]  # Remove .py
-            try:
-                module = importlib.import_module(module_name)
-                temp_agent = module.Agent()
-                agents[module_name] = temp_agent.name
-            except Exception as e:
-                print(f"Error loading {module_name}: {str(e)}")
-    return agents
+# Agent names are read from the modules' source, so listing them imports no framework.
+# The result is cached across reruns and only recomputed when an agent module changes.
+@st.cache_data
+def get_available_agents(fingerprint):
+    return discover_agents('.')
 
 # Add agent selector to sidebar
-available_agents = get_available_agents()
+available_agents = get_available_agents(discovery_fingerprint('.'))
 selected_agent = st.sidebar.selectbox(
     "Select Agent Type",
     options=list(available_agents.keys()),
@@ -41,25 +33,30 @@ selected_agent = st.sidebar.selectbox(
     key="agent_selector"
 )
 
-# Dynamic import of selected agent
+# Agents built in this session, by module name. Only the selected agent is ever imported and built,
+# and it is kept across reruns, so switching back to it does not build it again.
+if "agents" not in st.session_state:
+    st.session_state.agents = {}
+
 if "current_agent_type" not in st.session_state:
     st.session_state.current_agent_type = selected_agent
 
 # If agent type changed, reset the session
 if st.session_state.current_agent_type != selected_agent:
     st.session_state.current_agent_type = selected_agent
-    if "agent" in st.session_state:
-        del st.session_state.agent
+    if selected_agent in st.session_state.agents:
+        st.session_state.agents[selected_agent].clear_chat()
     if "messages" in st.session_state:
         st.session_state.messages = []
 
 # Initialize agent
-if "agent" not in st.session_state:
+if selected_agent not in st.session_state.agents:
     try:
-        module = importlib.import_module(selected_agent)
-        st.session_state.agent = module.Agent()
+        st.session_state.agents[selected_agent] = load_agent(selected_agent)
     except Exception as e:
         st.error(f"Error loading agent: {str(e)}")
+        st.stop()
+st.session_state.agent = st.session_state.agents[selected_agent]
 
 # Store chat history
 if "messages" not in st.session_state:
@@ -72,6 +69,8 @@ st.title(f"Chat with {st.session_state.agent.name}")
 for msg in st.session_state.messages:
     with st.chat_message(msg["role"]):
         st.markdown(msg["content"])
+        if msg.get("timing"):
+            st.caption(msg["timing"])
 
 # User input
 if user_input := st.chat_input("Type your message..."):
@@ -83,15 +82,32 @@ if user_input := st.chat_input("Type your message..."):
     with st.chat_message("assistant"):
         response_container = st.empty()
         response_text = ""
+        start = time.perf_counter()
+        first_token = None
 
         try:
-            response = st.session_state.agent.chat(user_input)
-            response_text = str(response)
+            agent = st.session_state.agent
+            if hasattr(agent, "stream_chat"):
+                # Render the answer as it arrives, with a cursor while the agent is still writing
+                for chunk in agent.stream_chat(user_input):
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    response_text += chunk
+                    response_container.markdown(response_text + "▌")
+            else:
+                response = agent.chat(user_input)
+                response_text = str(response)
         except Exception as e:
             response_text = f"Error: {e}"
 
+        total = time.perf_counter() - start
         response_container.markdown(response_text)
-        st.session_state.messages.append({"role": "assistant", "content": response_text})
+        if first_token is not None:
+            timing = f"First token after {first_token:.2f}s, done after {total:.2f}s"
+        else:
+            timing = f"Done after {total:.2f}s"
+        st.caption(timing)
+        st.session_state.messages.append({"role": "assistant", "content": response_text, "timing": timing})
 
 # Clear chat button
 if st.sidebar.button("Clear Chat"):
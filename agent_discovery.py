@@ -0,0 +1,87 @@
+import os
+import ast
+import importlib
+
+# Agent discovery without importing the agent modules.
+#
+# Importing an agent module pulls in its whole framework (crewai, langchain, llama_index, ...) and building
+# its Agent can touch the network (a new OpenAI assistant). The UI only needs the display
+# names to fill its selector, so each *_agent.py declares a module-level AGENT_NAME string literal which is
+# read here from the source with ast. Modules without the constant are still listed, by module name.
+
+
+def read_agent_name(path):
+    """
+    Read the AGENT_NAME constant of an agent module from its source, without executing it.
+
+    Args:
+        path (str): Path of the *_agent.py file
+
+    Returns:
+        str: The value of AGENT_NAME, or None if the module does not define it as a string literal
+    """
+    with open(path, encoding="utf-8") as source:
+        tree = ast.parse(source.read(), filename=path)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            if any(isinstance(target, ast.Name) and target.id == "AGENT_NAME" for target in node.targets):
+                return node.value.value
+    return None
+
+
+def discover_agents(directory="."):
+    """
+    Find the agent modules in a directory and their display names.
+
+    Args:
+        directory (str): Directory holding the *_agent.py modules
+
+    Returns:
+        dict: Module name -> display name, sorted by module name
+    """
+    agents = {}
+    for file in sorted(os.listdir(directory)):
+        if file.endswith('_agent.py'):
+            module_name = file[:-3]  # Remove .py
+            try:
+                agents[module_name] = read_agent_name(os.path.join(directory, file)) or module_name
+            except (OSError, SyntaxError) as e:
+                print(f"Error reading {module_name}: {str(e)}")
+    return agents
+
+
+def discovery_fingerprint(directory="."):
+    """
+    Describe the agent modules by name, modification time and size, so callers can tell when to rediscover.
+
+    Args:
+        directory (str): Directory holding the *_agent.py modules
+
+    Returns:
+        tuple: (file name, mtime, size) for each agent module
+    """
+    fingerprint = []
+    for file in sorted(os.listdir(directory)):
+        if file.endswith('_agent.py'):
+            stat = os.stat(os.path.join(directory, file))
+            fingerprint.append((file, stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+
+def load_agent(module_name):
+    """
+    Import an agent module and build its Agent.
+
+    Args:
+        module_name (str): Name of the agent module, e.g. 'anthropic_agent'
+
+    Returns:
+        Agent: A new agent instance, wrapped in a response_cache.CachedAgent when RESPONSE_CACHE=1
+    """
+    module = importlib.import_module(module_name)
+    agent = module.Agent()
+    if os.getenv("RESPONSE_CACHE", "0") == "1":
+        # Opt-in, and only imported then: repeated conversations are answered from the response cache
+        from response_cache import CachedAgent
+        agent = CachedAgent(agent, module_name)
+    return agent
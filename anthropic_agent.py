@@ -1,37 +1,91 @@
 import os
-import anthropic
-import json
-from tavily import TavilyClient
-from dotenv import load_dotenv
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from datetime import date
-from prompts import role, goal, instructions, knowledge
+from history import TokenBudgetHistory
+from prompts import goal, stage_knowledge, StageTracker, prompt_date, dated_role, dated_instructions
+from tracing import traced_turn, traced_tool
 
-# Load environment variables
-load_dotenv()
+# The Anthropic SDK, the HTTP layer and the search modules are imported on first use, so importing this
+# module and creating an Agent stay cheap (see benchmarks/cold_start.py). http_clients loads the .env file
+# when it is first imported, before any API key is read.
 
-tavily_api_key = os.getenv("TAVILY_API_KEY")
-anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
-tavily_client = TavilyClient(api_key=tavily_api_key)
+# Display name of this agent. agent-ui.py reads it without importing the module (see agent_discovery.py)
+AGENT_NAME = "Anthropic Agent"
 
 
 class Agent:
-    def __init__(self, model="claude-3-5-haiku-latest"):
+    def __init__(self, model="claude-3-5-haiku-latest", max_tool_workers=4, tool_timeout=30, history_tokens=4000):
         """
         Initialize the Anthropic agent.
 
         Args:
-            max_messages (int): Maximum number of messages to keep in context
             model (str): Anthropic model to use
+            max_tool_workers (int): Maximum number of tool calls of one turn that run at the same time
+            tool_timeout (float): Seconds a tool call may take before it is reported to the model as timed out
+            history_tokens (int): Token budget for the conversation history resent with every call
         """
-        self.name = "Anthropic Agent"
-        self.client = anthropic.Anthropic(api_key=anthropic_api_key)
+        self.name = AGENT_NAME
+        # Created on first use, see the client properties
+        self._client = None
+        self._async_client = None
         self.model = model
-        self.messages = []
+        # Older turns are folded into a running summary once the history goes over its budget
+        self.history = TokenBudgetHistory(max_tokens=history_tokens)
 
-        # Define system prompt and tools
-        self.system_prompt = "\n".join([role, goal, instructions, knowledge])
+        # The system prompt is built on first use and again when the date or the decision stage changes,
+        # see system_prompt
+        self._system_prompt = None
+        self._prompt_date = None
+        self._prompt_stage = None
+        self.stage_tracker = StageTracker()
+        self.last_turn_failed = False
+        self.tools = self._prepare_tools()
+
+        # Token usage of each turn, including prompt cache reads and writes
+        self.turn_usage = []
+
+        # Tool calls requested in the same response run concurrently, see _call_tools
+        self.tool_timeout = tool_timeout
+        self.max_tool_workers = max_tool_workers
+
+    @property
+    def system_prompt(self):
+        """
+        The system prompt with today's date written in (see prompts.prompt_date) and the knowledge of the
+        current decision stage (see prompts.stage_knowledge), rebuilt when either changes.
+        """
+        day, stage = prompt_date(), self.stage_tracker.stage
+        if self._system_prompt is None or day != self._prompt_date or stage != self._prompt_stage:
+            self._system_prompt = "\n".join([dated_role(day), goal, dated_instructions(day), stage_knowledge(stage)])
+            self._prompt_date = day
+            self._prompt_stage = stage
+        return self._system_prompt
+
+    @property
+    def client(self):
+        """
+        The Anthropic client, created on first use on the process-wide Anthropic connection pool.
+        """
+        if self._client is None:
+            from http_clients import anthropic_client
+            self._client = anthropic_client(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        return self._client
+
+    @property
+    def async_client(self):
+        """
+        The async Anthropic client, created on first use on the same connection pool.
+        """
+        if self._async_client is None:
+            from http_clients import async_anthropic_client
+            self._async_client = async_anthropic_client(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        return self._async_client
 
     @staticmethod
+    @traced_tool("date")
     def date_tool():
         """
         Function to get the current date.
@@ -40,22 +94,31 @@ class Agent:
         return today.strftime("%B %d, %Y")
 
     @staticmethod
+    @traced_tool("web_search")
     def web_search(query):
         """
         This function searches the web for the given query and returns the results.
         """
-        # Call Tavily's search and dump the results as a JSON string
-        search_response = tavily_client.search(query)
-        results = json.dumps(search_response.get('results', []))
-        print(f"Web Search Results for '{query}':")
-        print(results)
-        return results
+        from search_compaction import search
+
+        return search(query)
+
+    @staticmethod
+    @traced_tool("web_search")
+    async def aweb_search(query):
+        """
+        Async version of web_search.
+        """
+        from search_compaction import asearch
+
+        return await asearch(query)
 
     def _prepare_tools(self):
         """
         Prepare tool definitions for the Anthropic API.
+        The last definition carries a cache breakpoint, so the tool block is cached on its own.
         """
-        return [
+        tools = [
             {
                 "name": "date",
                 "description": "Get the current date",
@@ -80,6 +143,113 @@ class Agent:
                 }
             }
         ]
+        tools[-1]["cache_control"] = {"type": "ephemeral"}
+        return tools
+
+    def _system_blocks(self):
+        """
+        The system prompt as a content block with a cache breakpoint.
+        The prefix up to here (tools + system prompt) only changes with the date, so every call after the
+        first of the day reads it from the prompt cache. The summary of older turns, if any, follows as a second block.
+        """
+        blocks = [{"type": "text", "text": self.system_prompt, "cache_control": {"type": "ephemeral"}}]
+        if self.history.summary:
+            # After the breakpoint, so a new summary does not invalidate the cached system prompt
+            blocks.append({"type": "text", "text": f"Summary of the earlier conversation:\n{self.history.summary}"})
+        return blocks
+
+    @property
+    def messages(self):
+        """
+        The conversation as it is sent to the API: the turns the history budget has kept.
+        """
+        return self.history.messages
+
+    @staticmethod
+    def _with_cache_breakpoint(messages):
+        """
+        Return a copy of the messages with a cache breakpoint on the last content block.
+        The breakpoint rolls forward with the conversation, so each call reads the prefix written by the
+        previous one. The stored history itself is left untouched.
+
+        Args:
+            messages (list): Messages to send
+
+        Returns:
+            list: Messages to pass to the API
+        """
+        if not messages:
+            return messages
+        last = messages[-1]
+        content = last["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        else:
+            content = [block if isinstance(block, dict) else block.model_dump(exclude_none=True)
+                       for block in content]
+        content[-1] = dict(content[-1], cache_control={"type": "ephemeral"})
+        return messages[:-1] + [{"role": last["role"], "content": content}]
+
+    def _create_message(self, messages, usage):
+        """
+        Call the Messages API with cached system prompt, tools and conversation prefix.
+
+        Args:
+            messages (list): Messages to send
+            usage (dict): Running token counts for the current turn, updated in place
+
+        Returns:
+            The API response
+        """
+        response = self.client.messages.create(
+            model=self.model,
+            max_tokens=4096,
+            system=self._system_blocks(),
+            messages=self._with_cache_breakpoint(messages),
+            tools=self.tools
+        )
+        self._record_usage(response, usage)
+        return response
+
+    async def _acreate_message(self, messages, usage):
+        """
+        Async version of _create_message.
+        """
+        response = await self.async_client.messages.create(
+            model=self.model,
+            max_tokens=4096,
+            system=self._system_blocks(),
+            messages=self._with_cache_breakpoint(messages),
+            tools=self.tools
+        )
+        self._record_usage(response, usage)
+        return response
+
+    def _stream_message(self, messages, usage):
+        """
+        Streaming version of _create_message.
+        Yields text as it arrives and returns the complete response once the stream ends.
+        """
+        with self.client.messages.stream(
+            model=self.model,
+            max_tokens=4096,
+            system=self._system_blocks(),
+            messages=self._with_cache_breakpoint(messages),
+            tools=self.tools
+        ) as stream:
+            for text in stream.text_stream:
+                yield text
+            response = stream.get_final_message()
+        self._record_usage(response, usage)
+        return response
+
+    @staticmethod
+    def _record_usage(response, usage):
+        usage["llm_calls"] += 1
+        usage["input_tokens"] += response.usage.input_tokens
+        usage["output_tokens"] += response.usage.output_tokens
+        usage["cache_creation_input_tokens"] += response.usage.cache_creation_input_tokens or 0
+        usage["cache_read_input_tokens"] += response.usage.cache_read_input_tokens or 0
 
     def _call_tool(self, tool_name, tool_input):
         """
@@ -99,6 +269,95 @@ class Agent:
         else:
             return "Unsupported tool."
 
+    def _call_tools(self, tool_uses, usage):
+        """
+        Run the tool calls of one response concurrently, on a pool of max_tool_workers threads of their own.
+        Each call gets tool_timeout seconds from the moment the batch is submitted; a call that fails or
+        times out is reported to the model as an error instead of failing the whole turn. A running call
+        cannot be stopped, so one that times out is abandoned: it finishes on its own thread, without
+        holding a worker the following calls need, and is counted in the turn's tool_calls_abandoned.
+
+        Args:
+            tool_uses (list): The tool_use blocks of the response
+            usage (dict): The turn's usage, see _start_turn
+
+        Returns:
+            list: tool_result blocks, in the same order as tool_uses
+        """
+        executor = ThreadPoolExecutor(max_workers=self.max_tool_workers, thread_name_prefix="anthropic-tool")
+        try:
+            # Each call runs in a copy of this context, so its trace span is nested under the turn
+            futures = [executor.submit(contextvars.copy_context().run, self._call_tool, tool_use.name,
+                                       tool_use.input)
+                       for tool_use in tool_uses]
+            deadline = time.monotonic() + self.tool_timeout
+            tool_outputs = []
+            for tool_use, future in zip(tool_uses, futures):
+                tool_output = {"type": "tool_result", "tool_use_id": tool_use.id}
+                try:
+                    tool_output["content"] = future.result(timeout=max(0, deadline - time.monotonic()))
+                except TimeoutError:
+                    usage["tool_calls_abandoned"] += 1
+                    tool_output["content"] = f"The {tool_use.name} tool timed out after {self.tool_timeout} seconds."
+                    tool_output["is_error"] = True
+                except Exception as e:
+                    tool_output["content"] = f"The {tool_use.name} tool failed: {e}"
+                    tool_output["is_error"] = True
+                tool_outputs.append(tool_output)
+            return tool_outputs
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _acall_tool(self, tool_name, tool_input):
+        """
+        Async version of _call_tool.
+        """
+        if tool_name == "web_search":
+            return await self.aweb_search(tool_input.get("query", ""))
+        return self._call_tool(tool_name, tool_input)
+
+    async def _acall_tools(self, tool_uses, usage):
+        """
+        Async version of _call_tools: the tool calls of one response run concurrently on the event loop,
+        with the same shared deadline and error reporting. A call that times out is cancelled, and counted
+        in tool_calls_abandoned as well.
+        """
+        deadline = time.monotonic() + self.tool_timeout
+
+        async def run(tool_use):
+            tool_output = {"type": "tool_result", "tool_use_id": tool_use.id}
+            try:
+                tool_output["content"] = await asyncio.wait_for(
+                    self._acall_tool(tool_use.name, tool_use.input),
+                    timeout=max(0, deadline - time.monotonic())
+                )
+            except asyncio.TimeoutError:
+                usage["tool_calls_abandoned"] += 1
+                tool_output["content"] = f"The {tool_use.name} tool timed out after {self.tool_timeout} seconds."
+                tool_output["is_error"] = True
+            except Exception as e:
+                tool_output["content"] = f"The {tool_use.name} tool failed: {e}"
+                tool_output["is_error"] = True
+            return tool_output
+
+        return list(await asyncio.gather(*(run(tool_use) for tool_use in tool_uses)))
+
+    def _start_turn(self, message):
+        """
+        Add the user's message to the history, update the decision stage, keep the history within its budget
+        and start counting this turn's token usage.
+        """
+        self.history.add("user", message)
+        self.last_turn_failed = False
+        self.stage_tracker.observe(message)
+        history = self.history.compact()
+        usage = {"llm_calls": 0, "input_tokens": 0, "output_tokens": 0,
+                 "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0, "tool_calls_abandoned": 0,
+                 "history_tokens": history["sent_tokens"], "history_tokens_saved": history["tokens_saved"]}
+        self.turn_usage.append(usage)
+        return usage
+
+    @traced_turn
     def chat(self, message):
         """
         Send a message and get a response.
@@ -110,54 +369,139 @@ class Agent:
             str: Assistant's response
         """
         # Add user message
-        self.messages.append({"role": "user", "content": message})
+        usage = self._start_turn(message)
 
         # Prepare the API call
         try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=4096,
-                system=self.system_prompt,
-                messages=self.messages,
-                tools=self._prepare_tools()
-            )
-
-            # Process tool calls if any
+            response = self._create_message(self.messages, usage)
+
+            # Process tool calls if any, keeping every round of this turn in the follow-up calls
+            turn_messages = list(self.messages)
             while response.stop_reason == "tool_use":
-                tool_outputs = []
-                for tool_use in response.content:
-                    if tool_use.type == "tool_use":
-                        tool_output = self._call_tool(
-                            tool_use.name,
-                            tool_use.input
-                        )
-                        tool_outputs.append({
-                            "type": "tool_result",
-                            "tool_use_id": tool_use.id,
-                            "content": tool_output
-                        })
+                tool_outputs = self._call_tools(
+                    [block for block in response.content if block.type == "tool_use"], usage
+                )
 
                 # Make a follow-up call with tool results
-                response = self.client.messages.create(
-                    model=self.model,
-                    max_tokens=4096,
-                    system=self.system_prompt,
-                    messages=self.messages + [
-                        {"role": "assistant", "content": response.content},
-                        {"role": "user", "content": tool_outputs}
-                    ],
-                    tools=self._prepare_tools()
-                )
+                turn_messages += [
+                    {"role": "assistant", "content": response.content},
+                    {"role": "user", "content": tool_outputs}
+                ]
+                response = self._create_message(turn_messages, usage)
 
             # Extract and return the response
             assistant_response = response.content[0].text
-            self.messages.append({"role": "assistant", "content": assistant_response})
+            self.history.add("assistant", assistant_response)
             return assistant_response
 
         except Exception as e:
             print(f"Error in chat: {e}")
+            self.last_turn_failed = True
+            # Take the unanswered message back, so the history keeps alternating user and assistant
+            self.history.pop()
             return "Sorry, I encountered an error processing your request."
 
+    @traced_turn
+    async def achat(self, message):
+        """
+        Send a message and get a response, without blocking the event loop.
+
+        Args:
+            message (str): User's input message
+
+        Returns:
+            str: Assistant's response
+        """
+        usage = self._start_turn(message)
+        try:
+            response = await self._acreate_message(self.messages, usage)
+
+            turn_messages = list(self.messages)
+            while response.stop_reason == "tool_use":
+                tool_outputs = await self._acall_tools(
+                    [block for block in response.content if block.type == "tool_use"], usage
+                )
+                turn_messages += [
+                    {"role": "assistant", "content": response.content},
+                    {"role": "user", "content": tool_outputs}
+                ]
+                response = await self._acreate_message(turn_messages, usage)
+
+            assistant_response = response.content[0].text
+            self.history.add("assistant", assistant_response)
+            return assistant_response
+
+        except Exception as e:
+            print(f"Error in chat: {e}")
+            self.last_turn_failed = True
+            # Take the unanswered message back, so the history keeps alternating user and assistant
+            self.history.pop()
+            return "Sorry, I encountered an error processing your request."
+
+    @traced_turn
+    def stream_chat(self, message):
+        """
+        Send a message and stream the response as it is generated.
+
+        Args:
+            message (str): User's input message
+
+        Yields:
+            str: Chunks of the assistant's response
+        """
+        usage = self._start_turn(message)
+        try:
+            turn_messages = list(self.messages)
+            response = yield from self._stream_message(turn_messages, usage)
+            while response.stop_reason == "tool_use":
+                tool_outputs = self._call_tools(
+                    [block for block in response.content if block.type == "tool_use"], usage
+                )
+                turn_messages += [
+                    {"role": "assistant", "content": response.content},
+                    {"role": "user", "content": tool_outputs}
+                ]
+                response = yield from self._stream_message(turn_messages, usage)
+
+            assistant_response = "".join(block.text for block in response.content if block.type == "text")
+            self.history.add("assistant", assistant_response)
+
+        except Exception as e:
+            print(f"Error in chat: {e}")
+            self.last_turn_failed = True
+            # Take the unanswered message back, so the history keeps alternating user and assistant
+            self.history.pop()
+            yield "Sorry, I encountered an error processing your request."
+
+    @property
+    def last_usage(self):
+        """
+        Token usage of the most recent turn, with its prompt cache hit rate.
+
+        Returns:
+            dict: Token counts, or None before the first turn
+        """
+        if not self.turn_usage:
+            return None
+        usage = dict(self.turn_usage[-1])
+        prompt_tokens = (usage["input_tokens"] + usage["cache_creation_input_tokens"]
+                         + usage["cache_read_input_tokens"])
+        usage["cache_hit_rate"] = usage["cache_read_input_tokens"] / prompt_tokens if prompt_tokens else 0.0
+        return usage
+
+    def remember_turn(self, message, response):
+        """
+        Add a turn answered without the model (see response_cache.py) to the conversation, as if chat had
+        answered it.
+
+        Args:
+            message (str): User's input message
+            response (str): Assistant's response
+        """
+        self.history.add("user", message)
+        self.stage_tracker.observe(message)
+        self.history.add("assistant", response)
+
     def clear_chat(self):
         """
         Reset the conversation context.
@@ -166,7 +510,8 @@ class Agent:
             bool: True if reset was successful
         """
         try:
-            self.messages = []
+            self.history.clear()
+            self.stage_tracker.reset()
             return True
         except Exception as e:
             print(f"Error clearing chat: {e}")
@@ -178,8 +523,15 @@ def main():
 
     query = input("You: ")
     while query != "exit":
-        response = agent.chat(query)
-        print(f"Assistant: {response}")
+        print("Assistant: ", end="", flush=True)
+        start = time.perf_counter()
+        first_token = None
+        for chunk in agent.stream_chat(query):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            print(chunk, end="", flush=True)
+        print(f"\n(time to first token: {first_token or 0:.2f}s, total: {time.perf_counter() - start:.2f}s)")
+        print(f"Usage: {agent.last_usage}")
         query = input("You: ")
 
 
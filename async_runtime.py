@@ -0,0 +1,121 @@
+import asyncio
+import atexit
+import threading
+import contextvars
+
+# A single long-lived event loop for synchronous callers of async code.
+#
+# Every agent has an async interface (achat). Code that is not async itself, such as the Streamlit UI or the
+# command-line mains, runs those coroutines on the loop defined here instead of creating and closing an event
+# loop for every message. The loop runs on one daemon thread that is started on first use, so any number of
+# conversations share it, and async clients keep their connection pools between calls.
+#
+# Async callers (e.g. a web server) should simply await achat on their own loop. Each agent's async clients
+# are bound to the loop that first uses them, so a given agent should be driven either through this loop or
+# through the caller's, not both.
+#
+# Coroutines run here see the caller's context variables (such as the current trace span, see tracing.py),
+# as they would if the caller had awaited them itself.
+
+
+async def _in_context(coro, context):
+    """
+    Await a coroutine with the variables of another context set, e.g. a synchronous caller's.
+    """
+    for variable, value in context.items():
+        variable.set(value)
+    return await coro
+
+
+class BackgroundLoop:
+    def __init__(self, name="agents-event-loop"):
+        """
+        Initialize the background loop. The thread is only started when the loop is first needed.
+
+        Args:
+            name (str): Name of the thread running the loop
+        """
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        """
+        The running event loop, started on first access.
+        """
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name=self.name, daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def run(self, coro, timeout=None):
+        """
+        Run a coroutine on the background loop and wait for its result.
+
+        Args:
+            coro: The coroutine to run
+            timeout (float): Seconds to wait for the result, or None to wait indefinitely
+
+        Returns:
+            The coroutine's result
+        """
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("run() called from the background loop itself; await the coroutine instead")
+        context = contextvars.copy_context()
+        return asyncio.run_coroutine_threadsafe(_in_context(coro, context), self.loop).result(timeout)
+
+    def iterate(self, agen):
+        """
+        Consume an async generator from synchronous code, one item at a time.
+
+        Args:
+            agen: The async generator
+
+        Yields:
+            The generator's items
+        """
+        try:
+            while True:
+                try:
+                    yield self.run(agen.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            # Also runs when the consumer stops early, so the generator can release what it holds
+            self.run(agen.aclose())
+
+    def stop(self):
+        """
+        Stop the loop and wait for its thread to finish.
+        """
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+
+# The loop shared by every agent module
+background_loop = BackgroundLoop()
+atexit.register(background_loop.stop)
+
+
+def run_sync(coro, timeout=None):
+    """
+    Run a coroutine on the shared background loop and return its result.
+    """
+    return background_loop.run(coro, timeout)
+
+
+def iterate_sync(agen):
+    """
+    Iterate over an async generator on the shared background loop.
+    """
+    return background_loop.iterate(agen)
@@ -1,79 +1,200 @@
 import os
-import json
+import asyncio
+import functools
+import contextvars
 from datetime import date
-from dotenv import load_dotenv
-import openai
-import instructor
-from pydantic import Field
-from prompts import role, goal, instructions, knowledge
-
-# Atomic Agents imports
-from atomic_agents.agents.base_agent import BaseAgent, BaseAgentConfig
-from atomic_agents.lib.base.base_io_schema import BaseIOSchema
-from atomic_agents.lib.components.agent_memory import AgentMemory
-from atomic_agents.lib.components.system_prompt_generator import SystemPromptGenerator
-from atomic_agents.lib.base.base_tool import BaseTool
-
-# Tavily client for web search
-from tavily import TavilyClient
-
-# Load environment variables and initialize Tavily client
-load_dotenv()
-tavily_api_key = os.getenv("TAVILY_API_KEY")
-tavily_client = TavilyClient(api_key=tavily_api_key)
-
-# Schemas with required docstrings
-class OrchestratorInputSchema(BaseIOSchema):
-    """Input schema for the Orchestrator Agent. Contains the user's message to be processed."""
-    chat_message: str = Field(..., description="The user's input message to be analyzed and responded to.")
-
-class OrchestratorOutputSchema(BaseIOSchema):
-    """Combined output schema for the Orchestrator Agent. Contains the tool to use and its parameters."""
-    tool: str = Field(..., description="The tool to use.")
-    tool_parameters: dict = Field(default_factory=dict)
-
-class FinalAnswerSchema(BaseIOSchema):
-    """Schema for the final answer generated by the Orchestrator Agent.
-    A response that addresses the user's query, giving high precedence to tool outputs.
+from types import SimpleNamespace
+from typing import List, Literal, Optional
+from concurrent.futures import ThreadPoolExecutor
+from prompts import goal, stage_knowledge, StageTracker, prompt_date, dated_role, dated_instructions
+from tracing import traced_turn, traced_tool, annotate
+
+# Atomic Agents, instructor, the HTTP layer and the search modules are imported on first use, and the
+# orchestrator is built with the first message, so importing this module and creating an Agent stay cheap
+# (see benchmarks/cold_start.py). http_clients loads the .env file when it is first imported, before any API
+# key is read.
+#
+# Each response of the orchestrator is either the final answer or a list of tool calls
+# (OrchestratorOutputSchema). A turn that needs no tool costs a single LLM call. Otherwise the tool calls of a
+# response run concurrently, their outputs are added to the memory and the orchestrator is asked again, until
+# it answers or max_rounds tool rounds have been made (then a FinalAnswerSchema is requested). instructor
+# re-asks the model when a response does not validate against the schema; these retries are counted per turn
+# (turn_stats, and the turn's trace).
+
+# Display name of this agent. agent-ui.py reads it without importing the module (see agent_discovery.py)
+AGENT_NAME = "Atomic Agent"
+
+
+@functools.lru_cache(maxsize=None)
+def schemas():
+    """
+    Define the schemas on first use, since they derive from Atomic Agents' BaseIOSchema.
+    They are also available as module attributes, e.g. atomic_agent.FinalAnswerSchema.
+
+    Returns:
+        SimpleNamespace: The schema classes by name
     """
-    final_answer: str = Field(..., description="A response that addresses the user's query, giving high precedence to tool outputs.")
+    from pydantic import Field, model_validator
+    from atomic_agents.lib.base.base_io_schema import BaseIOSchema
+
+    # Schemas with required docstrings
+    class OrchestratorInputSchema(BaseIOSchema):
+        """Input schema for the Orchestrator Agent. Contains the user's message to be processed."""
+        chat_message: str = Field(..., description="The user's input message to be analyzed and responded to.")
 
-class DateToolOutputSchema(BaseIOSchema):
-    """Output schema for the date tool. A string representation of the date."""
-    result: str = Field(..., description="Today's date as a well formatted string.")
+    class ToolCallSchema(BaseIOSchema):
+        """A call to one of the tools: 'date' (no parameters) or 'web_search' (parameters: {"query": ...})."""
+        tool: Literal["date", "web_search"] = Field(..., description="The tool to call.")
+        parameters: dict = Field(default_factory=dict, description="The tool's parameters, e.g. {\"query\": \"...\"}.")
 
-class WebSearchToolInputSchema(BaseIOSchema):
-    """Schema for the web search tool. Contains the query to use for the web search."""
-    query: str = Field(..., description="The query to be used for the search.")
+    class OrchestratorOutputSchema(BaseIOSchema):
+        """Output schema for the Orchestrator Agent. Either the tools to call before answering, all at once,
+        or the final answer to the user once no more tools are needed.
+        """
+        tool_calls: List[ToolCallSchema] = Field(default_factory=list, description="Tools to call before answering; leave empty to answer.")
+        final_answer: Optional[str] = Field(None, description="A response that addresses the user's query, giving high precedence to tool outputs.")
 
-class WebSearchToolOutputSchema(BaseIOSchema):
-    """Output Schema for the web search tool. A string containing the search results."""
-    results: str = Field(..., description="The search results.")
+        @model_validator(mode="after")
+        def check_tool_calls_or_answer(self):
+            if not self.tool_calls and not self.final_answer:
+                raise ValueError("Either call at least one tool or give the final answer.")
+            return self
+
+    class FinalAnswerSchema(BaseIOSchema):
+        """Schema for the final answer generated by the Orchestrator Agent.
+        A response that addresses the user's query, giving high precedence to tool outputs.
+        """
+        final_answer: str = Field(..., description="A response that addresses the user's query, giving high precedence to tool outputs.")
+
+    class ToolErrorSchema(BaseIOSchema):
+        """Output of a tool call that failed. Contains the error."""
+        error: str = Field(..., description="What went wrong.")
+
+    class DateToolOutputSchema(BaseIOSchema):
+        """Output schema for the date tool. A string representation of the date."""
+        result: str = Field(..., description="Today's date as a well formatted string.")
+
+    class WebSearchToolInputSchema(BaseIOSchema):
+        """Schema for the web search tool. Contains the query to use for the web search."""
+        query: str = Field(..., description="The query to be used for the search.")
+
+    class WebSearchToolOutputSchema(BaseIOSchema):
+        """Output Schema for the web search tool. A string containing the search results."""
+        results: str = Field(..., description="The search results.")
+
+    return SimpleNamespace(
+        BaseIOSchema=BaseIOSchema,
+        OrchestratorInputSchema=OrchestratorInputSchema,
+        ToolCallSchema=ToolCallSchema,
+        OrchestratorOutputSchema=OrchestratorOutputSchema,
+        FinalAnswerSchema=FinalAnswerSchema,
+        ToolErrorSchema=ToolErrorSchema,
+        DateToolOutputSchema=DateToolOutputSchema,
+        WebSearchToolInputSchema=WebSearchToolInputSchema,
+        WebSearchToolOutputSchema=WebSearchToolOutputSchema,
+    )
+
+
+def __getattr__(name):
+    # Module attribute access to the lazily defined schemas
+    if name.endswith("Schema"):
+        return getattr(schemas(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 class Agent:
-    def __init__(self, model: str = "gpt-4o-mini"):
+    def __init__(self, model: str = "gpt-4o-mini", max_rounds: int = 4, max_tool_workers: int = 4):
         """
         Initialize the Atomic Agents-based agent.
+
+        Args:
+            model (str): The language model to use
+            max_rounds (int): Tool rounds per turn before the orchestrator is made to answer
+            max_tool_workers (int): Maximum number of tool calls of one response that run at the same time
         """
-        self.name = "Atomic Agent"
-        self.client = instructor.from_openai(
-            openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        )
-        self.system_prompt = SystemPromptGenerator(
-            background=[role, goal, knowledge],
+        self.name = AGENT_NAME
+        self.model = model
+        self.max_rounds = max_rounds
+        # Built with the first message, see the agent property
+        self._agent = None
+        self._prompt_date = None
+        self._prompt_stage = None
+        self.stage_tracker = StageTracker()
+        self.last_turn_failed = False
+
+        # Tool calls requested in the same response run concurrently on this pool
+        self.tool_executor = ThreadPoolExecutor(max_workers=max_tool_workers, thread_name_prefix="atomic-tool")
+
+        # LLM calls, tool rounds, tool calls and validation retries of each turn
+        self.turn_stats = []
+        self._validation_retries = 0
+
+    @property
+    def agent(self):
+        """
+        The orchestrator agent, built on first use. Its system prompt is replaced when the date (see
+        prompts.prompt_date) or the decision stage (see prompts.stage_knowledge) changes.
+        """
+        day, stage = prompt_date(), self.stage_tracker.stage
+        if self._agent is None:
+            self._agent = self._create_orchestrator_agent(self.model, day, stage)
+        elif day != self._prompt_date or stage != self._prompt_stage:
+            self.system_prompt = self._create_system_prompt(day, stage)
+            self._agent.system_prompt_generator = self.system_prompt
+        self._prompt_date = day
+        self._prompt_stage = stage
+        return self._agent
+
+    @staticmethod
+    def _create_system_prompt(day=None, stage=None):
+        """
+        Create the system prompt generator for a date, or for looking the date up when day is None, with the
+        knowledge for a decision stage, or all of it when stage is None.
+        """
+        from atomic_agents.lib.components.system_prompt_generator import SystemPromptGenerator
+
+        return SystemPromptGenerator(
+            background=[dated_role(day), goal, stage_knowledge(stage)],
             steps=[
                 "Understand the user's input and provide a relevant response.",
-                "Respond to the user."
+                "If tools are needed, request all the tool calls you need at once; their results will follow.",
+                "Respond to the user with the final answer."
             ],
             output_instructions=[
-                instructions,
-                "***IMPORTANT***: When selecting a tool, make sure to adhere to the schema."
+                dated_instructions(day),
+                "***IMPORTANT***: When selecting a tool, make sure to adhere to the schema.",
+                "Return either tool_calls or final_answer, not both."
             ],
         )
+
+    def _create_orchestrator_agent(self, model: str, day=None, stage=None) -> "BaseAgent":
+        """
+        Create the client, system prompt, tools and the orchestrator agent.
+        """
+        import instructor
+        from atomic_agents.agents.base_agent import BaseAgent, BaseAgentConfig
+        from atomic_agents.lib.components.agent_memory import AgentMemory
+        from http_clients import openai_client
+
+        self.client = instructor.from_openai(
+            openai_client(api_key=os.getenv("OPENAI_API_KEY"))
+        )
+        # instructor re-asks the model when its response does not validate; count these retries
+        self.client.on("parse:error", self._count_validation_retry)
+        self.system_prompt = self._create_system_prompt(day, stage)
         self.tools = self._create_tools()
-        self.agent = self._create_orchestrator_agent(model)
+
+        config = BaseAgentConfig(
+            client=self.client,
+            model=model,
+            system_prompt_generator=self.system_prompt,
+            input_schema=schemas().OrchestratorInputSchema,
+            output_schema=schemas().OrchestratorOutputSchema,
+            memory=AgentMemory(max_messages=100),
+        )
+        return BaseAgent(config)
 
     @staticmethod
+    @traced_tool("date")
     def date_tool() -> str:
         """
         Get the current date.
@@ -82,18 +203,26 @@ class Agent:
         return f"Today's date is: {today}"
 
     @staticmethod
+    @traced_tool("web_search")
     def web_search(query: str) -> str:
         """
         Search the web for the given query and return the results as a JSON string.
         """
-        search_response = tavily_client.search(query)
-        return json.dumps(search_response.get('results', []))
+        from search_compaction import search
+
+        return search(query)
 
     def _create_tools(self) -> dict:
         """
         Create the tools for the agent.
         """
+        from atomic_agents.lib.base.base_tool import BaseTool
+
         agent = self
+        BaseIOSchema = schemas().BaseIOSchema
+        DateToolOutputSchema = schemas().DateToolOutputSchema
+        WebSearchToolInputSchema = schemas().WebSearchToolInputSchema
+        WebSearchToolOutputSchema = schemas().WebSearchToolOutputSchema
 
         class DateTool(BaseTool):
             """ Tool for looking up today's date.  Should be used to establish context."""
@@ -114,59 +243,115 @@ class Agent:
 
         return {"date": DateTool(), "web_search": WebSearchTool()}
 
-    def _create_orchestrator_agent(self, model: str) -> BaseAgent:
+    def _count_validation_retry(self, error):
+        self._validation_retries += 1
+
+    def _call_tool(self, tool_call):
         """
-        Create the orchestrator agent.
+        Run one tool call.
+
+        Args:
+            tool_call (ToolCallSchema): The tool and its parameters
+
+        Returns:
+            BaseIOSchema: The tool's output
         """
-        config = BaseAgentConfig(
-            client=self.client,
-            model=model,
-            system_prompt_generator=self.system_prompt,
-            input_schema=OrchestratorInputSchema,
-            output_schema=OrchestratorOutputSchema,
-            memory=AgentMemory(max_messages=100),
-        )
-        return BaseAgent(config)
+        if tool_call.tool == "date":
+            return self.tools["date"].run()
+        query = str(tool_call.parameters.get("query") or self._agent.current_user_input.chat_message)
+        return self.tools["web_search"].run(schemas().WebSearchToolInputSchema(query=query))
+
+    def _call_tools(self, tool_calls):
+        """
+        Run the tool calls of one response concurrently. A call that fails is reported to the model as an
+        error instead of failing the whole turn.
+
+        Returns:
+            list: The outputs, in the same order as tool_calls
+        """
+        # Each call runs in a copy of this context, so its trace span is nested under the turn
+        futures = [self.tool_executor.submit(contextvars.copy_context().run, self._call_tool, tool_call)
+                   for tool_call in tool_calls]
+        outputs = []
+        for tool_call, future in zip(tool_calls, futures):
+            try:
+                outputs.append(future.result())
+            except Exception as e:
+                outputs.append(schemas().ToolErrorSchema(error=f"The {tool_call.tool} tool failed: {e}"))
+        return outputs
 
+    @traced_turn
     def chat(self, message: str) -> str:
         """
         Process a chat message and return the agent's response.
         """
+        OrchestratorInputSchema = schemas().OrchestratorInputSchema
+        FinalAnswerSchema = schemas().FinalAnswerSchema
+
+        self._validation_retries = 0
+        stats = {"llm_calls": 1, "tool_rounds": 0, "tool_calls": 0}
         try:
-            input_schema = OrchestratorInputSchema(chat_message=message)
-            tool_selection = self.agent.run(input_schema)
-
-            if tool_selection.tool == "date":
-                tool_output = self.tools["date"].run()
-                self.agent.memory.add_message("system", tool_output)
-            elif tool_selection.tool == "web_search":
-                params = WebSearchToolInputSchema(
-                    query=tool_selection.tool_parameters.get('query', message)
-                )
-                tool_output = self.tools["web_search"].run(params)
-                self.agent.memory.add_message("system", tool_output)
-            else:
-                # Override unexpected tool selections
-                tool_selection.tool = "none"
-                no_tool = FinalAnswerSchema(final_answer="I can answer this questions without a tool.")
-                self.agent.memory.add_message("system", no_tool)
-
-            self.agent.output_schema = FinalAnswerSchema
-            final_answer = self.agent.run(input_schema)
-            self.agent.output_schema = OrchestratorOutputSchema
-
-            return final_answer.final_answer
+            self.last_turn_failed = False
+            self.stage_tracker.observe(message)
+            response = self.agent.run(OrchestratorInputSchema(chat_message=message))
+
+            while response.tool_calls and stats["tool_rounds"] < self.max_rounds:
+                for output in self._call_tools(response.tool_calls):
+                    self.agent.memory.add_message("system", output)
+                stats["tool_rounds"] += 1
+                stats["tool_calls"] += len(response.tool_calls)
+                # Without new input, the orchestrator continues the turn from the tool outputs
+                response = self.agent.run()
+                stats["llm_calls"] += 1
+
+            if not response.final_answer:
+                # Out of tool rounds: ask for the answer alone, without changing the agent's output schema
+                response = self.agent.get_response(response_model=FinalAnswerSchema)
+                self.agent.memory.add_message("assistant", response)
+                stats["llm_calls"] += 1
+
+            return response.final_answer
 
         except Exception as e:
             print(f"Error in chat: {e}")
+            self.last_turn_failed = True
             return "Sorry, I encountered an error processing your request."
 
+        finally:
+            stats["validation_retries"] = self._validation_retries
+            self.turn_stats.append(stats)
+            annotate(**{f"orchestrator_{name}": value for name, value in stats.items()})
+
+    async def achat(self, message: str) -> str:
+        """
+        Process a chat message without blocking the event loop.
+        BaseAgent only offers a streaming async run, so the synchronous chat runs on a worker thread.
+        """
+        return await asyncio.to_thread(self.chat, message)
+
+    def remember_turn(self, message, response):
+        """
+        Add a turn answered without the model (see response_cache.py) to the conversation, as if chat had
+        answered it.
+
+        Args:
+            message (str): User's input message
+            response (str): Assistant's response
+        """
+        self.stage_tracker.observe(message)
+        self.agent.memory.add_message("user", schemas().OrchestratorInputSchema(chat_message=message))
+        self.agent.memory.add_message("assistant", schemas().OrchestratorOutputSchema(final_answer=response))
+
     def clear_chat(self) -> bool:
         """
         Reset the conversation context.
         """
         try:
-            self.agent.memory = AgentMemory(max_messages=100)
+            if self._agent is not None:
+                from atomic_agents.lib.components.agent_memory import AgentMemory
+
+                self._agent.memory = AgentMemory(max_messages=100)
+            self.stage_tracker.reset()
             return True
         except Exception as e:
             print(f"Error clearing chat: {e}")
@@ -0,0 +1 @@
+# Benchmarks for the agent examples. Run them from the project root, e.g. `python -m benchmarks.startup`.
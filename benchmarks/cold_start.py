@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+# Cold-start benchmark for the agent modules.
+#
+# For each *_agent.py, in a fresh interpreter, measures:
+#   - import: importing the module
+#   - Agent(): building the agent
+#   - first token: from sending the first message to the first chunk of the answer (stream_chat, or the whole
+#     answer for agents without it). The framework import and client creation deferred by the module are
+#     paid here.
+#   - first turn: the whole first turn
+#   - RSS after the import and after the first turn
+#
+# By default the agents talk to fake_servers.py, so no API keys or network are needed. Use --live to run
+# against the real APIs from .env.
+#
+# Usage: python -m benchmarks.cold_start [--agent anthropic_agent ...] [--repeat 3] [--live] [--json]
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import os, sys, json, time, importlib
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+sys.stdout = open(os.devnull, 'w')  # the agents print their tool calls
+result = {{'rss_start_mb': rss_mb()}}
+start = time.perf_counter()
+module = importlib.import_module({module_name!r})
+result['import'] = time.perf_counter() - start
+result['rss_import_mb'] = rss_mb()
+
+start = time.perf_counter()
+agent = module.Agent()
+result['agent'] = time.perf_counter() - start
+
+start = time.perf_counter()
+first_token = None
+if hasattr(agent, 'stream_chat'):
+    for chunk in agent.stream_chat({message!r}):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+else:
+    agent.chat({message!r})
+result['first_turn'] = time.perf_counter() - start
+result['first_token'] = result['first_turn'] if first_token is None else first_token
+result['rss_turn_mb'] = rss_mb()
+sys.stdout = sys.__stdout__
+print(json.dumps(result))
+"""
+
+MEASUREMENTS = [
+    ("import", "import (s)", "{:.3f}"),
+    ("agent", "Agent() (s)", "{:.3f}"),
+    ("first_token", "first token (s)", "{:.3f}"),
+    ("first_turn", "first turn (s)", "{:.3f}"),
+    ("rss_import_mb", "RSS import (MB)", "{:.0f}"),
+    ("rss_turn_mb", "RSS turn (MB)", "{:.0f}"),
+]
+
+
+def probe(module_name, message, env):
+    """
+    Import, build and run one agent in a fresh interpreter.
+
+    Args:
+        module_name (str): Module name of the agent
+        message (str): The first message sent to the agent
+        env (dict): Environment of the child process
+
+    Returns:
+        dict: Seconds and RSS figures of the run, see PROBE
+    """
+    completed = subprocess.run([sys.executable, "-c", PROBE.format(module_name=module_name, message=message)],
+                               cwd=PROJECT_ROOT, env=env, check=True, capture_output=True, text=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run_benchmark(agents, repeat, message, env):
+    """
+    Probe every agent repeat times and keep the median of each measurement.
+
+    Returns:
+        dict: Module name -> measurement -> median
+    """
+    results = {}
+    for module_name in agents:
+        try:
+            runs = [probe(module_name, message, env) for _ in range(repeat)]
+        except subprocess.CalledProcessError as e:
+            print(f"{module_name} failed:\n{e.stderr}", file=sys.stderr)
+            continue
+        results[module_name] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    return results
+
+
+def main():
+    """
+    Run the cold-start benchmark and print a table.
+    """
+    sys.path.insert(0, PROJECT_ROOT)
+    from agent_discovery import discover_agents
+
+    parser = argparse.ArgumentParser(description="Measure import, construction and first-token time per agent.")
+    parser.add_argument("--agent", action="append", help="Agent module to measure (repeatable, default all)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--message", default="Should I rent or buy a home?")
+    parser.add_argument("--live", action="store_true", help="Use the real APIs instead of fake_servers.py")
+    parser.add_argument("--json", action="store_true", help="Print the raw results as JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    servers = None
+    if not args.live:
+        from fake_servers import FakeServers
+        servers = FakeServers().start()
+        env.update(servers.env())
+    try:
+        results = run_benchmark(args.agent or list(discover_agents(PROJECT_ROOT)), args.repeat, args.message, env)
+    finally:
+        if servers is not None:
+            servers.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'agent':<20}" + "".join(f"{label:>17}" for _, label, _ in MEASUREMENTS))
+    for module_name, result in results.items():
+        print(f"{module_name:<20}" + "".join(f"{fmt.format(result[key]):>17}" for key, _, fmt in MEASUREMENTS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+# Per-turn framework overhead of an agent over a long conversation, by default the CrewAI agent.
+#
+# Each CrewAI turn is a crew kickoff, and the conversation so far is pasted into its task. This runs one agent
+# for many turns in a fresh interpreter, with tracing on (see tracing.py), and prints for every turn:
+#   - total: the duration of chat()
+#   - overhead: the time not spent in LLM requests or tools, i.e. in the framework (building and running the
+#     crew, formatting the task, telemetry, parsing)
+#   - input tokens: the tokens sent to the LLM during the turn, which grow with the history the agent sends
+#   - history tokens: the tokens of the history the agent sent, and of the whole conversation (agents with a
+#     TokenBudgetHistory, see history.py)
+#   - memory: the retrieval time and the tokens of the recalled turns (agents with a RetrievalMemory, see
+#     vector_memory.py; run with MEMORY_RECENT_TOKENS=300 to see older turns being recalled sooner)
+# The first turn also pays for building the agent, so the mean overhead is reported without it as well.
+#
+# The agent talks to fake_servers.py, so no API keys or network are needed. Use --live for the real APIs.
+#
+# Usage: python -m benchmarks.kickoff_overhead [--agent crewai_agent] [--turns 10] [--live] [--json]
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MESSAGES = [
+    "Should I rent or buy a home?",
+    "I live in Berlin and earn 70,000 euros a year.",
+    "What about the transaction costs?",
+    "How long would I need to stay for buying to pay off?",
+    "And if interest rates go up?",
+    "Summarize the decision for me.",
+]
+
+PROBE = """
+import os, sys, json, importlib
+sys.stdout = open(os.devnull, 'w')  # the agents print their tool calls
+agent = importlib.import_module({module_name!r}).Agent()
+messages = {messages!r}
+history = []
+for turn in range({turns}):
+    agent.chat(messages[turn % len(messages)])
+    metrics = getattr(getattr(agent, 'history', None), 'last_metrics', None) or {{}}
+    metrics.update((getattr(agent, 'memory_metrics', None) or [{{}}])[-1])
+    history.append(metrics)
+sys.__stdout__.write(json.dumps(history))
+"""
+
+
+def probe(module_name, turns, env):
+    """
+    Run a conversation with one agent and break every turn down.
+
+    Args:
+        module_name (str): Module name of the agent
+        turns (int): Number of turns
+        env (dict): Environment of the child process
+
+    Returns:
+        list: One dict per turn with total, LLM, tool and overhead ms, input tokens and history tokens
+    """
+    from tracing import summarize
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.jsonl")
+        code = PROBE.format(module_name=module_name, turns=turns, messages=MESSAGES)
+        completed = subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT, env=dict(env, TRACE_PATH=path),
+                                   check=True, capture_output=True, text=True)
+        summary = summarize(path)
+    history = json.loads(completed.stdout)
+    return [{
+        "turn": index + 1,
+        "total_ms": turn["total_ms"],
+        "llm_ms": turn["llm_ms"],
+        "tool_ms": turn["tool_ms"],
+        "overhead_ms": turn["other_ms"],
+        "llm_calls": turn["llm_calls"],
+        "input_tokens": turn["input_tokens"],
+        "history_sent_tokens": metrics.get("sent_tokens"),
+        "history_total_tokens": metrics.get("history_tokens"),
+        "memory_retrieval_ms": metrics.get("retrieval_ms"),
+        "memory_injected_tokens": metrics.get("injected_tokens"),
+    } for index, (turn, metrics) in enumerate(zip(summary, history))]
+
+
+def main():
+    """
+    Run the benchmark and print the per-turn breakdown.
+    """
+    sys.path.insert(0, PROJECT_ROOT)
+
+    parser = argparse.ArgumentParser(description="Measure the per-turn framework overhead of an agent.")
+    parser.add_argument("--agent", default="crewai_agent", help="Agent module to measure")
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--live", action="store_true", help="Use the real APIs instead of fake_servers.py")
+    parser.add_argument("--json", action="store_true", help="Print the raw results as JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    servers = None
+    if not args.live:
+        from fake_servers import FakeServers
+        servers = FakeServers().start()
+        env.update(servers.env())
+    try:
+        turns = probe(args.agent, args.turns, env)
+    except subprocess.CalledProcessError as e:
+        print(f"{args.agent} failed:\n{e.stderr}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if servers is not None:
+            servers.stop()
+
+    if args.json:
+        print(json.dumps(turns, indent=2))
+        return
+    print(f"{'turn':>4}{'total ms':>10}{'LLM ms':>9}{'tool ms':>9}{'overhead ms':>13}{'input tokens':>14}"
+          f"{'history sent/total':>20}{'memory ms':>11}{'recalled tokens':>17}")
+    for turn in turns:
+        history = (f"{turn['history_sent_tokens']}/{turn['history_total_tokens']}"
+                   if turn["history_sent_tokens"] is not None else "-")
+        memory = (f"{turn['memory_retrieval_ms']:>11.2f}{turn['memory_injected_tokens']:>17}"
+                  if turn["memory_retrieval_ms"] is not None else f"{'-':>11}{'-':>17}")
+        print(f"{turn['turn']:>4}{turn['total_ms']:>10.0f}{turn['llm_ms']:>9.0f}{turn['tool_ms']:>9.0f}"
+              f"{turn['overhead_ms']:>13.1f}{turn['input_tokens']:>14}{history:>20}{memory}")
+    later = turns[1:] or turns
+    print(f"mean overhead: {sum(t['overhead_ms'] for t in turns) / len(turns):.1f} ms per turn, "
+          f"{sum(t['overhead_ms'] for t in later) / len(later):.1f} ms after the first")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+# Input tokens per turn, with the whole decision-process guide in the system prompt or only its current stage.
+#
+# Each agent is run through a conversation that moves through the stages of a decision, twice, in a fresh
+# interpreter each time:
+#   - full: KNOWLEDGE_MODE=full, all nine stages of prompts.knowledge on every call
+#   - stage: the default, the current stage and its neighbours (see prompts.stage_knowledge)
+# with tracing on (see tracing.py). Per turn, the trace gives the input tokens sent to the LLM provider and the
+# requests made to it; the stage the agent's StageTracker settled on is reported as well. The input tokens also
+# count the history and tool results, which both modes share, so the difference is what the knowledge costs.
+# For the OpenAI Assistants agent, the requests include the thread and run bookkeeping, and in stage mode the
+# update of the assistant's instructions when the stage changes.
+#
+# By default the agents talk to fake_servers.py, so no API keys or network are needed. Use --live to run
+# against the real APIs from .env.
+#
+# Usage: python -m benchmarks.knowledge_tokens [--agent anthropic_agent ...] [--live] [--json]
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = ("full", "stage")
+
+# One message per stage or so, in the order a decision session usually goes
+MESSAGES = [
+    "I'm trying to decide whether I should rent or buy a home.",
+    "My main goal is financial security, and it's important to me to stay flexible.",
+    "My budget is limited: I earn 70,000 euros a year and have 40,000 in savings.",
+    "What options do I have besides renting or buying outright?",
+    "How much do apartments cost in Berlin, and what are the current mortgage rates?",
+    "Can you compare the pros and cons and the risks of each?",
+    "Which one would you recommend?",
+    "What are the next steps and a timeline to get started?",
+    "How should I track my progress and review the decision later?",
+]
+
+PROBE = """
+import os, sys, json, importlib
+sys.stdout = open(os.devnull, 'w')  # the agents print their tool calls
+agent = importlib.import_module({module_name!r}).Agent()
+stages = []
+for message in {messages!r}:
+    agent.chat(message)
+    stages.append(agent.stage_tracker.current)
+sys.__stdout__.write(json.dumps(stages))
+"""
+
+
+def probe(module_name, mode, env):
+    """
+    Run the conversation with one agent in one knowledge mode, and break it down per turn.
+
+    Args:
+        module_name (str): Module name of the agent
+        mode (str): 'full' or 'stage', see MODES
+        env (dict): Environment of the child process
+
+    Returns:
+        list: One dict per turn with the stage, input tokens, LLM requests and duration
+    """
+    from tracing import summarize
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.jsonl")
+        code = PROBE.format(module_name=module_name, messages=MESSAGES)
+        completed = subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT,
+                                   env=dict(env, TRACE_PATH=path, KNOWLEDGE_MODE=mode), check=True,
+                                   capture_output=True, text=True)
+        summary = summarize(path)
+    stages = json.loads(completed.stdout)
+    return [{
+        "turn": index + 1,
+        "stage": stage,
+        "input_tokens": turn["input_tokens"],
+        "llm_calls": turn["llm_calls"],
+        "total_ms": turn["total_ms"],
+    } for index, (turn, stage) in enumerate(zip(summary, stages))]
+
+
+def run_benchmark(agents, env):
+    """
+    Probe every agent in both modes.
+
+    Returns:
+        dict: Module name -> mode -> per-turn figures
+    """
+    results = {}
+    for module_name in agents:
+        try:
+            results[module_name] = {mode: probe(module_name, mode, env) for mode in MODES}
+        except subprocess.CalledProcessError as e:
+            print(f"{module_name} failed:\n{e.stderr}", file=sys.stderr)
+    return results
+
+
+def main():
+    """
+    Run the benchmark and print the input tokens per turn in both modes.
+    """
+    sys.path.insert(0, PROJECT_ROOT)
+    from agent_discovery import discover_agents
+
+    parser = argparse.ArgumentParser(description="Compare input tokens per turn with the full or staged knowledge.")
+    parser.add_argument("--agent", action="append", help="Agent module to measure (repeatable, default all)")
+    parser.add_argument("--live", action="store_true", help="Use the real APIs instead of fake_servers.py")
+    parser.add_argument("--json", action="store_true", help="Print the raw results as JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    servers = None
+    if not args.live:
+        from fake_servers import FakeServers
+        servers = FakeServers().start()
+        env.update(servers.env())
+    try:
+        results = run_benchmark(args.agent or list(discover_agents(PROJECT_ROOT)), env)
+    finally:
+        if servers is not None:
+            servers.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for module_name, result in results.items():
+        full, staged = result["full"], result["stage"]
+        print(module_name)
+        print(f"{'turn':>6}{'stage':>7}{'input tokens':>22}{'LLM calls':>14}")
+        print(f"{'':>13}{'full -> stage':>22}{'full -> stage':>14}")
+        for before, after in zip(full, staged):
+            tokens = f"{before['input_tokens']} -> {after['input_tokens']}"
+            calls = f"{before['llm_calls']} -> {after['llm_calls']}"
+            print(f"{before['turn']:>6}{after['stage']:>7}{tokens:>22}{calls:>14}")
+        total_full = sum(turn["input_tokens"] for turn in full)
+        total_staged = sum(turn["input_tokens"] for turn in staged)
+        saved = 1 - total_staged / total_full if total_full else 0
+        print(f"{'total':>13}{f'{total_full} -> {total_staged}':>22}  ({saved:.0%} fewer input tokens)\n")
+
+
+if __name__ == "__main__":
+    main()
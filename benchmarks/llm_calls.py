@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+# LLM calls per turn, with the date looked up by the model or written into the prompt.
+#
+# Each agent is run for a few turns twice, in a fresh interpreter each time:
+#   - tool: DATE_IN_PROMPT=0, the original prompts, which order the model to call the `date` tool first
+#   - prompt: the default, today's date is part of the system prompt (see prompts.prompt_date)
+# with tracing on (see tracing.py). Per turn, the trace gives the requests made to the LLM provider, the tool
+# calls (and among them, the date lookups) and the input tokens. For the OpenAI Assistants agent the
+# requests also include the thread and run bookkeeping, not just model calls.
+#
+# By default the agents talk to fake_servers.py, whose fake model, like the real one, only looks up the date
+# when the prompt tells it to. No API keys or network are needed. Use --live to run against the real APIs
+# from .env.
+#
+# Usage: python -m benchmarks.llm_calls [--agent anthropic_agent ...] [--turns 3] [--live] [--json]
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {"tool": "0", "prompt": "1"}
+
+PROBE = """
+import os, sys, importlib
+sys.stdout = open(os.devnull, 'w')  # the agents print their tool calls
+agent = importlib.import_module({module_name!r}).Agent()
+for turn in range({turns}):
+    agent.chat({message!r})
+"""
+
+
+def probe(module_name, mode, turns, message, env):
+    """
+    Run a few turns of one agent with tracing on, and break them down per turn.
+
+    Args:
+        module_name (str): Module name of the agent
+        mode (str): 'tool' or 'prompt', see MODES
+        turns (int): Number of turns to run
+        message (str): The message sent on every turn
+        env (dict): Environment of the child process
+
+    Returns:
+        dict: LLM requests, tool calls, date lookups and input tokens per turn, averaged over the turns
+    """
+    from tracing import summarize
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.jsonl")
+        child_env = dict(env, TRACE_PATH=path, DATE_IN_PROMPT=MODES[mode])
+        code = PROBE.format(module_name=module_name, turns=turns, message=message)
+        subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT, env=child_env, check=True,
+                       capture_output=True, text=True)
+        summary = summarize(path)
+        with open(path, encoding="utf-8") as source:
+            spans = [json.loads(line) for line in source if line.strip()]
+    date_calls = sum(1 for record in spans if record["kind"] == "tool" and record["name"] == "date")
+    count = len(summary) or 1
+    return {
+        "turns": len(summary),
+        "llm_calls": sum(turn["llm_calls"] for turn in summary) / count,
+        "tool_calls": sum(turn["tool_calls"] for turn in summary) / count,
+        "date_calls": date_calls / count,
+        "input_tokens": sum(turn["input_tokens"] for turn in summary) / count,
+        "total_ms": sum(turn["total_ms"] for turn in summary) / count,
+    }
+
+
+def run_benchmark(agents, turns, message, env):
+    """
+    Probe every agent in both modes.
+
+    Returns:
+        dict: Module name -> mode -> per-turn figures
+    """
+    results = {}
+    for module_name in agents:
+        try:
+            results[module_name] = {mode: probe(module_name, mode, turns, message, env) for mode in MODES}
+        except subprocess.CalledProcessError as e:
+            print(f"{module_name} failed:\n{e.stderr}", file=sys.stderr)
+    return results
+
+
+def main():
+    """
+    Run the benchmark and print LLM calls per turn before and after.
+    """
+    sys.path.insert(0, PROJECT_ROOT)
+    from agent_discovery import discover_agents
+
+    parser = argparse.ArgumentParser(description="Count LLM calls per turn with and without the date in the prompt.")
+    parser.add_argument("--agent", action="append", help="Agent module to measure (repeatable, default all)")
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--message", default="Should I rent or buy a home?")
+    parser.add_argument("--live", action="store_true", help="Use the real APIs instead of fake_servers.py")
+    parser.add_argument("--json", action="store_true", help="Print the raw results as JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    servers = None
+    if not args.live:
+        from fake_servers import FakeServers
+        servers = FakeServers().start()
+        env.update(servers.env())
+    try:
+        results = run_benchmark(args.agent or list(discover_agents(PROJECT_ROOT)), args.turns, args.message, env)
+    finally:
+        if servers is not None:
+            servers.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'agent':<20}{'LLM calls/turn':>16}{'date calls/turn':>17}{'tool calls/turn':>17}"
+          f"{'input tokens/turn':>19}{'ms/turn':>15}")
+    print(f"{'':<20}" + f"{'tool -> prompt':>16}{'tool -> prompt':>17}{'tool -> prompt':>17}"
+                        f"{'tool -> prompt':>19}{'tool -> prompt':>15}")
+    for module_name, result in results.items():
+        before, after = result["tool"], result["prompt"]
+        cells = [f"{before[key]:.1f} -> {after[key]:.1f}" for key in ("llm_calls", "date_calls", "tool_calls")]
+        cells += [f"{before[key]:.0f} -> {after[key]:.0f}" for key in ("input_tokens", "total_ms")]
+        print(f"{module_name:<20}{cells[0]:>16}{cells[1]:>17}{cells[2]:>17}{cells[3]:>19}{cells[4]:>15}")
+
+
+if __name__ == "__main__":
+    main()
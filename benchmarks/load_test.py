@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import threading
+import statistics
+
+import httpx
+
+# Load test for server.py.
+#
+# Opens --sessions sessions of one agent type and has each of them send --turns messages, at most
+# --concurrency turns in flight at once, then reports throughput and turn latency percentiles.
+#
+# By default the server is started in-process on a free port, with the agents pointed at fake_servers.py
+# (use --latency to give the fake model a realistic response time). Pass --url to load an already running
+# server instead; it then talks to whatever APIs that server was configured with.
+#
+# Usage: python -m benchmarks.load_test [--agent anthropic_agent] [--sessions 20] [--turns 3]
+#                                       [--concurrency 20] [--latency 300] [--url http://127.0.0.1:8000]
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a list of values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def start_local_server(latency_ms, concurrency, workers):
+    """
+    Start fake_servers.py and server.py in this process.
+
+    Returns:
+        tuple: (base URL of the API server, FakeServers instance, uvicorn Server)
+    """
+    sys.path.insert(0, PROJECT_ROOT)
+    import uvicorn
+    from fake_servers import FakeServers
+
+    latency = {"dist": "fixed", "ms": latency_ms}
+    servers = FakeServers(config={"latency": {"openai.chat": latency, "anthropic.messages": latency,
+                                              "openai.run": latency}}).start()
+    os.environ.update(servers.env())
+
+    from server import SessionManager, create_app
+    from agent_discovery import discover_agents
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    manager = SessionManager(discover_agents(PROJECT_ROOT), concurrency=concurrency, workers=workers)
+    server = uvicorn.Server(uvicorn.Config(create_app(manager), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", servers, server
+
+
+async def run_load(url, agent_type, sessions, turns, concurrency):
+    """
+    Drive the server and collect per-turn latencies.
+
+    Returns:
+        dict: Timings and counts of the run
+    """
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    async with httpx.AsyncClient(base_url=url, timeout=300,
+                                 limits=httpx.Limits(max_connections=concurrency * 2)) as client:
+        start = time.perf_counter()
+        created = await asyncio.gather(*(client.post("/sessions", json={"agent_type": agent_type})
+                                         for _ in range(sessions)))
+        session_ids = [response.json()["session_id"] for response in created if response.status_code == 200]
+        setup = time.perf_counter() - start
+
+        async def converse(index, session_id):
+            nonlocal errors
+            for turn in range(turns):
+                async with limit:
+                    turn_start = time.perf_counter()
+                    response = await client.post(f"/sessions/{session_id}/chat",
+                                                 json={"message": f"Session {index}, question {turn}?"})
+                    if response.status_code == 200:
+                        latencies.append(time.perf_counter() - turn_start)
+                    else:
+                        errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(converse(i, session_id) for i, session_id in enumerate(session_ids)))
+        elapsed = time.perf_counter() - start
+        server_stats = (await client.get("/stats")).json()
+        await asyncio.gather(*(client.delete(f"/sessions/{session_id}") for session_id in session_ids))
+
+    return {
+        "agent_type": agent_type,
+        "sessions": len(session_ids),
+        "session_errors": sessions - len(session_ids),
+        "turns": len(latencies),
+        "turn_errors": errors,
+        "setup_seconds": setup,
+        "elapsed_seconds": elapsed,
+        "turns_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "latency_mean": statistics.mean(latencies) if latencies else 0.0,
+        "server": server_stats,
+    }
+
+
+def main():
+    """
+    Run the load test and print a summary.
+    """
+    parser = argparse.ArgumentParser(description="Measure server.py throughput and latency.")
+    parser.add_argument("--url", help="Base URL of a running server; by default one is started in-process")
+    parser.add_argument("--agent", default="anthropic_agent", help="Agent type to load")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=20, help="Turns in flight at once")
+    parser.add_argument("--latency", type=float, default=300, help="Fake model latency in ms (in-process only)")
+    parser.add_argument("--server-concurrency", type=int, default=64, help="Per agent type limit (in-process only)")
+    parser.add_argument("--workers", type=int, default=32, help="Server worker pool size (in-process only)")
+    parser.add_argument("--json", action="store_true", help="Print the raw results as JSON")
+    args = parser.parse_args()
+
+    url, servers, server = args.url, None, None
+    if url is None:
+        url, servers, server = start_local_server(args.latency, args.server_concurrency, args.workers)
+    try:
+        results = asyncio.run(run_load(url, args.agent, args.sessions, args.turns, args.concurrency))
+    finally:
+        if server is not None:
+            server.should_exit = True
+        if servers is not None:
+            servers.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{results['agent_type']}: {results['sessions']} sessions x {args.turns} turns, "
+          f"{args.concurrency} in flight")
+    print(f"  throughput   {results['turns_per_second']:.2f} turns/s "
+          f"({results['turns']} turns in {results['elapsed_seconds']:.2f}s, {results['turn_errors']} errors)")
+    print(f"  latency      p50 {results['latency_p50']:.2f}s  p95 {results['latency_p95']:.2f}s  "
+          f"p99 {results['latency_p99']:.2f}s")
+    print(f"  session setup {results['setup_seconds']:.2f}s for {results['sessions']} sessions")
+    for provider, pool in results["server"].get("http_pools", {}).items():
+        print(f"  {provider} pool  {pool['requests']} requests, {pool['connections_opened']} connections opened, "
+              f"peak {pool['peak_in_flight']}/{pool['pool_size']} in flight, {pool['saturated']} saturated")
+
+
+if __name__ == "__main__":
+    main()
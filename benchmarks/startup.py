@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+
+# Startup benchmark for the Streamlit UI.
+#
+# Compares the two ways agent-ui.py has listed its agents:
+#   - import: import every *_agent.py and build its Agent just to read .name (the old behaviour)
+#   - ast: read AGENT_NAME from each module's source (agent_discovery.discover_agents)
+# and, for reference, what it costs to build the one selected agent. Every measurement runs in a fresh
+# interpreter so that import costs are paid in full, as they are when Streamlit starts.
+#
+# By default the agents talk to fake_servers.py, so no API keys or network are needed. Use --live to run
+# against the real APIs from .env.
+#
+# Usage: python -m benchmarks.startup [--repeat 3] [--agent anthropic_agent] [--live] [--json]
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_DISCOVERY = """
+import os, importlib
+agents = {}
+for file in os.listdir('.'):
+    if file.endswith('_agent.py'):
+        module_name = file[:-3]
+        try:
+            module = importlib.import_module(module_name)
+            agents[module_name] = module.Agent().name
+        except Exception as e:
+            print(f"Error loading {module_name}: {e}")
+"""
+
+AST_DISCOVERY = """
+from agent_discovery import discover_agents
+agents = discover_agents('.')
+"""
+
+LOAD_AGENT = """
+from agent_discovery import load_agent
+agent = load_agent({module_name!r})
+"""
+
+
+def time_snippet(code, env):
+    """
+    Run a snippet in a fresh interpreter and time it.
+
+    Args:
+        code (str): Python code to run from the project root
+        env (dict): Environment of the child process
+
+    Returns:
+        float: Wall-clock seconds, including interpreter start-up
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def run_benchmark(repeat, agent, env):
+    """
+    Time each discovery strategy and the selected agent's construction.
+
+    Args:
+        repeat (int): Number of runs per measurement
+        agent (str): Module name of the agent to build
+        env (dict): Environment of the child processes
+
+    Returns:
+        dict: Measurement name -> list of seconds
+    """
+    cases = {
+        "interpreter": "pass",
+        "discovery (import + Agent())": IMPORT_DISCOVERY,
+        "discovery (AGENT_NAME via ast)": AST_DISCOVERY,
+        f"build selected agent ({agent})": LOAD_AGENT.format(module_name=agent),
+    }
+    return {name: [time_snippet(code, env) for _ in range(repeat)] for name, code in cases.items()}
+
+
+def main():
+    """
+    Run the startup benchmark and print a summary.
+    """
+    parser = argparse.ArgumentParser(description="Measure agent discovery and construction time for the UI.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--agent", default="anthropic_agent", help="Agent module to build")
+    parser.add_argument("--live", action="store_true", help="Use the real APIs instead of fake_servers.py")
+    parser.add_argument("--json", action="store_true", help="Print the raw timings as JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    servers = None
+    if not args.live:
+        sys.path.insert(0, PROJECT_ROOT)
+        from fake_servers import FakeServers
+        servers = FakeServers().start()
+        env.update(servers.env())
+    try:
+        results = run_benchmark(args.repeat, args.agent, env)
+    finally:
+        if servers is not None:
+            servers.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'measurement':<45}{'median (s)':>12}{'min (s)':>10}")
+    for name, timings in results.items():
+        print(f"{name:<45}{statistics.median(timings):>12.3f}{min(timings):>10.3f}")
+    old = statistics.median(results["discovery (import + Agent())"])
+    new = statistics.median(results["discovery (AGENT_NAME via ast)"])
+    print(f"\nDiscovery speed-up: {old / new:.1f}x ({old - new:.2f}s saved when the UI starts)")
+
+
+if __name__ == "__main__":
+    main()
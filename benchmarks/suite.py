@@ -0,0 +1,338 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import statistics
+
+from benchmarks.load_test import percentile
+
+# Cross-framework benchmark suite.
+#
+# Drives every agent through the same scripted multi-turn decision scenarios (SCENARIOS), each agent and
+# scenario in a fresh interpreter with tracing on (see tracing.py), against fake_servers.py. Per framework it
+# reports:
+#   - turn latency p50 / p95 / p99 (ms)
+#   - LLM requests, input and output tokens, and tool calls per turn, from the trace
+#   - peak memory (RSS high-water mark) of the process
+#   - turns answered with the agent's error message
+# Every agent first answers one warm-up message, untraced, so that the framework import and client creation
+# deferred to the first turn are not counted (see benchmarks/cold_start.py for those); use --no-warmup to
+# include them.
+#
+# The results are written as JSON and as a markdown table to --output (default benchmarks/results/), named
+# after the time of the run. Pass an earlier JSON file as --baseline to add the change in p50 latency and in
+# tokens per turn to the table.
+#
+# The fake model answers instantly unless given a --latency, so by default the latency figures are the
+# frameworks' own overhead plus the local HTTP round trips.
+#
+# Usage: python -m benchmarks.suite [--agent anthropic_agent ...] [--scenario rent_or_buy ...] [--repeat 3]
+#                                   [--latency 300] [--no-warmup] [--output DIR] [--baseline FILE] [--json]
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WARMUP_MESSAGE = "Hello, can you help me with a decision?"
+
+ERROR_REPLY = "Sorry, I encountered an error"
+
+# Each scenario is a conversation and, optionally, the script the fake model follows (see fake_servers.py).
+# Without a script, every turn looks up the date (only when the prompt asks for it), searches once and answers.
+SCENARIOS = {
+    "rent_or_buy": {
+        "messages": [
+            "I need to decide whether to rent or buy a home in the next six months.",
+            "My budget is about 400k and I might move for work within five years.",
+            "What are the main risks of buying right now?",
+            "Which option would you recommend given all of this?",
+        ],
+    },
+    "job_offer": {
+        "messages": [
+            "I have two job offers and need help choosing between them.",
+            "One is a startup with equity, the other a large company with a higher salary.",
+            "How should I weigh equity against salary?",
+        ],
+        # The second turn needs no research, the third compares two searches
+        "script": {"turns": [
+            [{"tool_calls": [{"name": "date", "arguments": {}}]},
+             {"tool_calls": [{"name": "web_search", "arguments": {"query": "{message}"}}]},
+             {"text": "Let us start by framing the decision: {message}"}],
+            [{"text": "Thanks, that helps to frame the two options."}],
+            [{"tool_calls": [{"name": "date", "arguments": {}}]},
+             {"tool_calls": [{"name": "web_search", "arguments": {"query": "startup equity value"}},
+                             {"name": "web_search", "arguments": {"query": "salary versus equity"}}]},
+             {"text": "Here is how equity and salary compare: {message}"}],
+        ]},
+    },
+    "vendor_selection": {
+        "messages": [
+            "Our team has to pick a cloud vendor for a new data platform.",
+            "Cost matters most, then reliability, then the tooling our engineers know.",
+            "Can you research current pricing for the three largest vendors?",
+            "What would a good evaluation process look like?",
+            "Summarise the decision and the next steps.",
+        ],
+    },
+}
+
+PROBE = """
+import os, sys, json, time, importlib
+import tracing
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+sys.stdout = open(os.devnull, 'w')  # the agents print their tool calls
+trace_path = os.environ.pop('TRACE_PATH')
+agent = importlib.import_module({module_name!r}).Agent()
+if {warmup!r}:
+    tracing.configure(None)
+    agent.chat({warmup_message!r})
+    agent.clear_chat()
+errors = 0
+for repeat in range({repeat}):
+    tracing.configure(trace_path)
+    for message in {messages!r}:
+        reply = agent.chat(message)
+        errors += str(reply).startswith({error_reply!r})
+    tracing.configure(None)
+    agent.clear_chat()
+sys.stdout = sys.__stdout__
+print(json.dumps({{'errors': errors, 'peak_rss_mb': peak_rss_mb()}}))
+"""
+
+
+def probe(module_name, scenario, repeat, warmup, env):
+    """
+    Run one scenario with one agent in a fresh interpreter, and read its turns back from the trace.
+
+    Args:
+        module_name (str): Module name of the agent
+        scenario (dict): The scenario, see SCENARIOS
+        repeat (int): Times the conversation is run, the agent's chat being cleared in between
+        warmup (bool): Answer an untraced warm-up message first
+        env (dict): Environment of the child process, pointing at the fake servers
+
+    Returns:
+        dict: The per-turn figures of tracing.summarize, plus the run's errors and peak memory
+    """
+    from tracing import summarize
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.jsonl")
+        code = PROBE.format(module_name=module_name, warmup=warmup, warmup_message=WARMUP_MESSAGE,
+                            repeat=repeat, messages=scenario["messages"], error_reply=ERROR_REPLY)
+        completed = subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT, env=dict(env, TRACE_PATH=path),
+                                   check=True, capture_output=True, text=True)
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        result["turns"] = summarize(path) if os.path.exists(path) else []
+    return result
+
+
+def aggregate(turns, peak_rss_mb, errors):
+    """
+    Reduce the traced turns of a framework to its summary figures.
+
+    Args:
+        turns (list): Per-turn dicts from tracing.summarize
+        peak_rss_mb (float): Highest peak memory of the framework's runs
+        errors (int): Turns answered with the agent's error message
+
+    Returns:
+        dict: Latency percentiles, per-turn means, peak memory and errors
+    """
+    latencies = [turn["total_ms"] for turn in turns]
+
+    def mean(key):
+        return statistics.mean(turn[key] for turn in turns) if turns else 0.0
+
+    return {
+        "turns": len(turns),
+        "errors": errors,
+        "latency_p50_ms": percentile(latencies, 50),
+        "latency_p95_ms": percentile(latencies, 95),
+        "latency_p99_ms": percentile(latencies, 99),
+        "latency_mean_ms": mean("total_ms"),
+        "llm_ms_per_turn": mean("llm_ms"),
+        "tool_ms_per_turn": mean("tool_ms"),
+        "other_ms_per_turn": mean("other_ms"),
+        "llm_calls_per_turn": mean("llm_calls"),
+        "input_tokens_per_turn": mean("input_tokens"),
+        "output_tokens_per_turn": mean("output_tokens"),
+        "tool_calls_per_turn": mean("tool_calls"),
+        "peak_rss_mb": peak_rss_mb,
+    }
+
+
+def run_suite(agents, scenarios, repeat, warmup, latency_ms):
+    """
+    Run every scenario with every agent.
+
+    Args:
+        agents (list): Module names of the agents
+        scenarios (list): Names of the scenarios to run
+        repeat (int): Times each conversation is run
+        warmup (bool): Answer an untraced warm-up message before each scenario
+        latency_ms (float): Fixed latency of the fake model, in milliseconds
+
+    Returns:
+        dict: Module name -> {"summary": overall figures, "scenarios": scenario name -> figures}
+    """
+    from fake_servers import FakeServers
+
+    latency = {"dist": "fixed", "ms": latency_ms}
+    runs = {module_name: {} for module_name in agents}
+    for name in scenarios:
+        config = {"latency": {"openai.chat": latency, "anthropic.messages": latency, "openai.run": latency}}
+        if SCENARIOS[name].get("script"):
+            config["script"] = SCENARIOS[name]["script"]
+        servers = FakeServers(config=config).start()
+        env = dict(os.environ, **servers.env())
+        try:
+            for module_name in agents:
+                try:
+                    runs[module_name][name] = probe(module_name, SCENARIOS[name], repeat, warmup, env)
+                except subprocess.CalledProcessError as e:
+                    print(f"{module_name} failed on {name}:\n{e.stderr}", file=sys.stderr)
+        finally:
+            servers.stop()
+
+    results = {}
+    for module_name, by_scenario in runs.items():
+        if not by_scenario:
+            continue
+        results[module_name] = {
+            "summary": aggregate([turn for run in by_scenario.values() for turn in run["turns"]],
+                                 max(run["peak_rss_mb"] for run in by_scenario.values()),
+                                 sum(run["errors"] for run in by_scenario.values())),
+            "scenarios": {name: aggregate(run["turns"], run["peak_rss_mb"], run["errors"])
+                          for name, run in by_scenario.items()},
+        }
+    return results
+
+
+def git_commit():
+    """
+    The commit the suite ran on, or None outside a git checkout.
+    """
+    try:
+        completed = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                                   capture_output=True, text=True, check=True)
+        return completed.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def markdown_table(report, baseline=None):
+    """
+    Render the per-framework summary as a markdown table.
+
+    Args:
+        report (dict): The suite's report, see main
+        baseline (dict): An earlier report to compare p50 latency and tokens per turn against
+
+    Returns:
+        str: The table, with a header line describing the run
+    """
+    run = report["run"]
+    lines = [f"Benchmark suite, {run['timestamp']}, commit {run['commit']}, scenarios {', '.join(run['scenarios'])}, "
+             f"x{run['repeat']}, fake model latency {run['latency_ms']:.0f} ms", ""]
+    header = ["framework", "turns", "p50 ms", "p95 ms", "p99 ms", "LLM calls/turn", "input tokens/turn",
+              "output tokens/turn", "tool calls/turn", "peak RSS MB", "errors"]
+    if baseline:
+        header += ["p50 vs baseline", "tokens vs baseline"]
+    lines += ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    for module_name, result in report["results"].items():
+        summary = result["summary"]
+        row = [module_name, str(summary["turns"]), f"{summary['latency_p50_ms']:.0f}",
+               f"{summary['latency_p95_ms']:.0f}", f"{summary['latency_p99_ms']:.0f}",
+               f"{summary['llm_calls_per_turn']:.2f}", f"{summary['input_tokens_per_turn']:.0f}",
+               f"{summary['output_tokens_per_turn']:.0f}", f"{summary['tool_calls_per_turn']:.2f}",
+               f"{summary['peak_rss_mb']:.0f}", str(summary["errors"])]
+        if baseline:
+            before = baseline["results"].get(module_name, {}).get("summary")
+            if before:
+                tokens = summary["input_tokens_per_turn"] + summary["output_tokens_per_turn"]
+                tokens_before = before["input_tokens_per_turn"] + before["output_tokens_per_turn"]
+                row += [f"{summary['latency_p50_ms'] - before['latency_p50_ms']:+.0f} ms",
+                        f"{tokens - tokens_before:+.0f}"]
+            else:
+                row += ["", ""]
+        lines.append("| " + " | ".join(row) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    """
+    Run the suite, write the JSON and markdown reports and print the table.
+    """
+    sys.path.insert(0, PROJECT_ROOT)
+    from agent_discovery import discover_agents
+
+    parser = argparse.ArgumentParser(description="Compare the agents' latency, LLM calls, tokens and memory.")
+    parser.add_argument("--agent", action="append", help="Agent module to run (repeatable, default all)")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable, default all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Times each conversation is run")
+    parser.add_argument("--latency", type=float, default=0, help="Fake model latency in ms")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false",
+                        help="Count the first turn's framework import and client creation")
+    parser.add_argument("--output", default=os.path.join(PROJECT_ROOT, "benchmarks", "results"),
+                        help="Directory the JSON and markdown reports are written to")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare against")
+    parser.add_argument("--json", action="store_true", help="Print the JSON report instead of the table")
+    args = parser.parse_args()
+
+    scenarios = args.scenario or list(SCENARIOS)
+    started = time.time()
+    results = run_suite(args.agent or list(discover_agents(PROJECT_ROOT)), scenarios, args.repeat, args.warmup,
+                        args.latency)
+    report = {
+        "run": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scenarios": scenarios,
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "latency_ms": args.latency,
+            "seconds": time.time() - started,
+        },
+        "results": results,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as source:
+            baseline = json.load(source)
+    table = markdown_table(report, baseline)
+
+    os.makedirs(args.output, exist_ok=True)
+    stem = os.path.join(args.output, "suite-" + time.strftime("%Y%m%d-%H%M%S", time.localtime(started)))
+    with open(stem + ".json", "w", encoding="utf-8") as target:
+        json.dump(report, target, indent=2)
+    with open(stem + ".md", "w", encoding="utf-8") as target:
+        target.write(table)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(table)
+    print(f"Written to {stem}.json and {stem}.md")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,513 @@
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import deque
+from urllib.parse import parse_qsl, urlencode
+
+import httpx
+
+# Record and replay of the agents' HTTP traffic.
+#
+# Every request to OpenAI, Anthropic and Tavily goes through the shared transports in http_clients.py, which
+# hand it to handle_request / ahandle_request here. With CASSETTE_MODE=record the exchange is sent as usual
+# and appended to a cassette file; with CASSETTE_MODE=replay it is answered from the cassette instead, and
+# nothing goes over the network. This works the same for all agents, whichever framework makes the calls.
+#
+# A cassette is a JSON lines file (gzip-compressed if its name ends in .gz), one exchange per line:
+#   {"provider", "method", "path", "key", "status", "content_type", "body", "ttfb_ms", "duration_ms"}
+# Requests are stored only as the key they are matched on: a hash of the method, path, query and the
+# normalized body. Normalizing makes replay tolerate differences that do not matter: JSON key order, null
+# fields, whitespace and dates (so a conversation recorded yesterday, with yesterday's date in its system
+# prompt, still replays today). Request headers, and with them the API keys, are never stored; the values of
+# *_API_KEY variables are also scrubbed from the response bodies. Identical requests (such as polls of a run)
+# are answered in the order they were recorded, the last answer being repeated once they run out. A request
+# with no recorded answer gets a 404 naming it, and is counted as a miss.
+#
+# Replay answers immediately unless CASSETTE_TIMING=1, which waits the recorded time to the first byte and
+# spreads the rest of the recorded duration over the events of a streamed response.
+#
+# Configured through environment variables:
+#   CASSETTE_MODE     record or replay (default off)
+#   CASSETTE_PATH     The cassette file (default cassette.jsonl)
+#   CASSETTE_TIMING   Set to 1 to replay with the recorded timing
+#
+# The disk tier of the search cache (SEARCH_CACHE_PATH) answers searches without a request, so leave it off
+# when recording a conversation to replay elsewhere.
+#
+# `python cassettes.py record cassette.jsonl --agent anthropic_agent "message" ...` records a conversation,
+# `python cassettes.py replay cassette.jsonl` plays it back to the same agent; see main().
+
+SCRUBBED = "<scrubbed>"
+
+# Body fields that carry credentials (Tavily takes its key in the body)
+SECRET_FIELDS = re.compile(r"^(api_key|apikey|token|access_token|secret)$", re.IGNORECASE)
+
+DATE_PATTERNS = [
+    re.compile(r"\b(January|February|March|April|May|June|July|August|September|October|November|December) "
+               r"\d{1,2}, \d{4}\b"),
+    re.compile(r"\b\d{4}-\d{2}-\d{2}\b"),
+]
+
+
+class CassetteError(Exception):
+    pass
+
+
+def _secrets():
+    return [value for name, value in os.environ.items()
+            if value and len(value) >= 8 and (name.endswith("_API_KEY") or name.endswith("_TOKEN"))]
+
+
+def scrub(text):
+    """
+    Replace the values of *_API_KEY and *_TOKEN environment variables in text.
+    """
+    for secret in _secrets():
+        text = text.replace(secret, SCRUBBED)
+    return text
+
+
+def _normalize_value(value):
+    if isinstance(value, dict):
+        return {key: SCRUBBED if SECRET_FIELDS.match(key) else _normalize_value(item)
+                for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [_normalize_value(item) for item in value]
+    if isinstance(value, str):
+        for pattern in DATE_PATTERNS:
+            value = pattern.sub("<date>", value)
+        return " ".join(value.split())
+    return value
+
+
+def normalize_body(body):
+    """
+    Reduce a request body to what identifies the request.
+
+    Args:
+        body (bytes): The raw request body
+
+    Returns:
+        str: Canonical JSON without nulls, credentials, dates or extra whitespace, or the text with its
+            dates and whitespace normalized if the body is not JSON
+    """
+    text = body.decode("utf-8", errors="replace")
+    try:
+        data = json.loads(text) if text else None
+    except ValueError:
+        return _normalize_value(text)
+    return json.dumps(_normalize_value(data), sort_keys=True, separators=(",", ":"))
+
+
+def request_key(request, body):
+    """
+    The key a request is recorded and replayed under.
+
+    Args:
+        request (httpx.Request): The request
+        body (bytes): Its body
+
+    Returns:
+        str: Hex digest of the method, path, sorted query and normalized body
+    """
+    query = urlencode(sorted(parse_qsl(request.url.query.decode("ascii"))))
+    text = f"{request.method} {request.url.path}?{query} {normalize_body(body)}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def _split_events(text):
+    """
+    Split a server-sent events body into its events, each with its trailing blank line.
+    """
+    events = [event + "\n\n" for event in text.split("\n\n") if event.strip()]
+    return events or [text]
+
+
+class Cassette:
+    def __init__(self, path, mode, timing=False):
+        """
+        A cassette file being recorded or replayed.
+
+        Args:
+            path (str): The cassette file; .gz for a compressed one
+            mode (str): 'record' or 'replay'
+            timing (bool): Replay with the recorded time to first byte and duration
+        """
+        if mode not in ("record", "replay"):
+            raise CassetteError(f"Unknown cassette mode {mode!r}, expected 'record' or 'replay'")
+        self.path = path
+        self.mode = mode
+        self.timing = timing
+        self.header = None
+        self._lock = threading.Lock()
+        self._exchanges = {}  # key -> deque of recorded exchanges
+        self.counters = {"recorded": 0, "replayed": 0, "misses": 0}
+        if mode == "replay":
+            self._load()
+
+    def _open(self, mode):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise CassetteError(f"Cassette {self.path} not found")
+        with self._open("r") as source:
+            for line in source:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if "key" in record:
+                    self._exchanges.setdefault(record["key"], deque()).append(record)
+                elif self.header is None:
+                    self.header = record
+
+    def _append(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            with self._open("a") as target:
+                target.write(line)
+
+    def write_header(self, **fields):
+        """
+        Start a new cassette file with a header line (e.g. the agent and messages of a recorded conversation).
+        """
+        with self._lock:
+            with self._open("w") as target:
+                target.write(json.dumps(scrub_value(fields), separators=(",", ":")) + "\n")
+        self.header = fields
+
+    ### Recording ###
+    def record(self, provider, request, key, response, body, ttfb, duration):
+        """
+        Append one exchange to the cassette.
+        """
+        content_type = response.headers.get("content-type", "")
+        text = scrub(body.decode("utf-8", errors="replace"))
+        stored = text
+        if "json" in content_type:
+            try:
+                stored = json.loads(text)
+            except ValueError:
+                pass
+        self._append({
+            "provider": provider,
+            "method": request.method,
+            "path": request.url.path,
+            "key": key,
+            "status": response.status_code,
+            "content_type": content_type,
+            "body": stored,
+            "ttfb_ms": round(ttfb * 1000),
+            "duration_ms": round(duration * 1000),
+        })
+        with self._lock:
+            self.counters["recorded"] += 1
+
+    ### Replay ###
+    def next_exchange(self, key):
+        """
+        The next recorded answer to a request, or None if it was never recorded.
+        Once a key's answers run out, its last one is repeated.
+        """
+        with self._lock:
+            recorded = self._exchanges.get(key)
+            if not recorded:
+                self.counters["misses"] += 1
+                return None
+            self.counters["replayed"] += 1
+            return recorded.popleft() if len(recorded) > 1 else recorded[0]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats.update(mode=self.mode, path=self.path)
+        return stats
+
+
+def scrub_value(value):
+    """
+    Scrub credentials from a JSON-like value, see scrub.
+    """
+    return json.loads(scrub(json.dumps(value)))
+
+
+_cassette = None
+_configured = False
+_config_lock = threading.Lock()
+
+
+def configure(mode=None, path=None, timing=False):
+    """
+    Start recording or replaying (or stop, with mode None). By default the environment variables are read
+    on the first request; call this to change them at run time.
+
+    Args:
+        mode (str): 'record', 'replay' or None
+        path (str): The cassette file
+        timing (bool): Replay with the recorded timing
+
+    Returns:
+        Cassette: The active cassette, or None
+    """
+    global _cassette, _configured
+    with _config_lock:
+        _cassette = Cassette(path or "cassette.jsonl", mode, timing) if mode else None
+        _configured = True
+        return _cassette
+
+
+def active():
+    """
+    The active cassette, or None when neither recording nor replaying.
+    """
+    if not _configured:
+        mode = os.getenv("CASSETTE_MODE", "").strip().lower()
+        configure(mode if mode and mode != "off" else None, os.getenv("CASSETTE_PATH"),
+                  os.getenv("CASSETTE_TIMING", "0") == "1")
+    return _cassette
+
+
+def stats():
+    """
+    Exchanges recorded, replayed and missed by the active cassette.
+    """
+    cassette = active()
+    return cassette.stats() if cassette is not None else {"mode": "off"}
+
+
+def _miss_response(request):
+    message = f"No recorded exchange for {request.method} {request.url.path} in the cassette"
+    print(f"Cassette miss: {request.method} {request.url.path}", file=sys.stderr)
+    return httpx.Response(404, headers={"content-type": "application/json"},
+                          content=json.dumps({"error": {"message": message, "type": "cassette_miss"}}).encode())
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    def __init__(self, chunks, delay):
+        self._chunks = chunks
+        self._delay = delay
+
+    def __iter__(self):
+        for i, chunk in enumerate(self._chunks):
+            if i and self._delay:
+                time.sleep(self._delay)
+            yield chunk
+
+    def close(self):
+        pass
+
+
+class _AsyncReplayStream(httpx.AsyncByteStream):
+    def __init__(self, chunks, delay):
+        self._chunks = chunks
+        self._delay = delay
+
+    async def __aiter__(self):
+        for i, chunk in enumerate(self._chunks):
+            if i and self._delay:
+                await asyncio.sleep(self._delay)
+            yield chunk
+
+    async def aclose(self):
+        pass
+
+
+def _replay_parts(cassette, record):
+    """
+    The chunks of a recorded response, the wait before it and the wait between its chunks.
+    """
+    body = record["body"]
+    text = body if isinstance(body, str) else json.dumps(body)
+    chunks = _split_events(text) if "event-stream" in record["content_type"] else [text]
+    chunks = [chunk.encode("utf-8") for chunk in chunks]
+    if not cassette.timing:
+        return chunks, 0.0, 0.0
+    ttfb = record["ttfb_ms"] / 1000
+    rest = max(0.0, record["duration_ms"] / 1000 - ttfb)
+    return chunks, ttfb, rest / (len(chunks) - 1) if len(chunks) > 1 else 0.0
+
+
+def _replay_headers(record):
+    return {"content-type": record["content_type"]} if record["content_type"] else {}
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self._chunks = []
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._chunks.append(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if self._on_close is not None:
+                self._on_close(b"".join(self._chunks))
+                self._on_close = None
+
+
+class _AsyncRecordingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self._chunks = []
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._chunks.append(chunk)
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                self._on_close(b"".join(self._chunks))
+                self._on_close = None
+
+
+def handle_request(provider, request, transport):
+    """
+    Send a request through transport, recording the exchange, or answer it from the cassette.
+    Without an active cassette this is transport.handle_request(request).
+
+    Args:
+        provider (str): 'openai', 'anthropic' or 'tavily'
+        request (httpx.Request): The request
+        transport (httpx.BaseTransport): The transport that reaches the provider
+
+    Returns:
+        httpx.Response: The response
+    """
+    cassette = active()
+    if cassette is None:
+        return transport.handle_request(request)
+    key = request_key(request, request.read())
+
+    if cassette.mode == "replay":
+        record = cassette.next_exchange(key)
+        if record is None:
+            return _miss_response(request)
+        chunks, wait, delay = _replay_parts(cassette, record)
+        if wait:
+            time.sleep(wait)
+        return httpx.Response(record["status"], headers=_replay_headers(record),
+                              stream=_ReplayStream(chunks, delay))
+
+    # Uncompressed, so the recorded bodies can be stored as text
+    request.headers["Accept-Encoding"] = "identity"
+    start = time.perf_counter()
+    response = transport.handle_request(request)
+    ttfb = time.perf_counter() - start
+
+    def on_close(body):
+        cassette.record(provider, request, key, response, body, ttfb, time.perf_counter() - start)
+
+    return httpx.Response(status_code=response.status_code, headers=response.headers,
+                          stream=_RecordingStream(response.stream, on_close), extensions=response.extensions)
+
+
+async def ahandle_request(provider, request, transport):
+    """
+    Async version of handle_request.
+    """
+    cassette = active()
+    if cassette is None:
+        return await transport.handle_async_request(request)
+    key = request_key(request, await request.aread())
+
+    if cassette.mode == "replay":
+        record = cassette.next_exchange(key)
+        if record is None:
+            return _miss_response(request)
+        chunks, wait, delay = _replay_parts(cassette, record)
+        if wait:
+            await asyncio.sleep(wait)
+        return httpx.Response(record["status"], headers=_replay_headers(record),
+                              stream=_AsyncReplayStream(chunks, delay))
+
+    request.headers["Accept-Encoding"] = "identity"
+    start = time.perf_counter()
+    response = await transport.handle_async_request(request)
+    ttfb = time.perf_counter() - start
+
+    def on_close(body):
+        cassette.record(provider, request, key, response, body, ttfb, time.perf_counter() - start)
+
+    return httpx.Response(status_code=response.status_code, headers=response.headers,
+                          stream=_AsyncRecordingStream(response.stream, on_close), extensions=response.extensions)
+
+
+### Command line ###
+def main():
+    """
+    Record a conversation with one agent to a cassette, or replay a recorded one.
+    """
+    import argparse
+    import importlib
+
+    parser = argparse.ArgumentParser(description="Record or replay an agent conversation's HTTP traffic.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="Run a conversation and record it")
+    record.add_argument("cassette")
+    record.add_argument("messages", nargs="+", help="The user's messages, one per turn")
+    record.add_argument("--agent", required=True, help="Agent module, e.g. anthropic_agent")
+    record.add_argument("--fake", action="store_true", help="Record against fake_servers.py")
+    replay = commands.add_parser("replay", help="Replay a recorded conversation")
+    replay.add_argument("cassette")
+    replay.add_argument("--agent", help="Agent module, defaults to the recorded one")
+    replay.add_argument("--timing", action="store_true", help="Replay with the recorded timing")
+    args = parser.parse_args()
+
+    # Searches must reach the cassette, not a cache that is not there on replay
+    os.environ.pop("SEARCH_CACHE_PATH", None)
+    servers = None
+    if args.command == "record":
+        if args.fake:
+            from fake_servers import FakeServers
+            servers = FakeServers().start()
+            os.environ.update(servers.env())
+        cassette = configure("record", args.cassette)
+        cassette.write_header(agent=args.agent, messages=args.messages,
+                              recorded_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        module_name, messages = args.agent, args.messages
+    else:
+        cassette = configure("replay", args.cassette, args.timing)
+        if not cassette.header:
+            raise CassetteError(f"{args.cassette} has no header; replay it by setting CASSETTE_MODE=replay")
+        module_name, messages = args.agent or cassette.header["agent"], cassette.header["messages"]
+        # The SDKs insist on a key, although nothing is sent
+        for name in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "TAVILY_API_KEY"):
+            os.environ.setdefault(name, "replay")
+
+    try:
+        agent = importlib.import_module(module_name).Agent()
+        for message in messages:
+            start = time.perf_counter()
+            response = agent.chat(message)
+            print(f"You: {message}\nAssistant ({time.perf_counter() - start:.2f}s): {response}\n")
+    finally:
+        if servers is not None:
+            servers.stop()
+    print(json.dumps(stats()))
+    if stats().get("misses"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Run main in the imported module, the one http_clients hands its requests to, not in __main__
+    import cassettes
+    cassettes.main()
@@ -0,0 +1,366 @@
+import os
+import time
+import zlib
+import atexit
+import sqlite3
+import threading
+
+from langgraph.checkpoint.memory import MemorySaver
+
+# Checkpoint storage for the LangGraph agent.
+#
+# LangGraph saves a checkpoint of the conversation state after every step of the graph, each one holding the
+# full message list. MemorySaver keeps all of them, for every thread, for the life of the process. The
+# CheckpointStore defined here keeps them in memory the same way (it is a MemorySaver, so LangGraph reads
+# them exactly as before) but bounds them:
+#   - only the latest `keep` checkpoints of a thread are kept (at least 2, so the parent of the latest one,
+#     which holds its pending sends, survives)
+#   - delete_thread drops a thread (the agent calls it on clear_chat)
+#   - threads not updated for max_age seconds are deleted, and the least recently updated threads are
+#     deleted while all threads together take more than max_bytes
+#
+# With a path it is also durable: checkpoints are written to a SQLite file (zlib-compressed) and read back
+# when a thread is first used after a restart. Writes are batched: new and pruned checkpoints are queued and
+# written in a single transaction once `batch` of them are pending, when flush() is called (the agent does so
+# after every turn) and at exit. A checkpoint that is pruned before its batch is written never reaches the
+# disk. Space freed by deletions is returned to the file system with incremental vacuuming.
+#
+# shared_store(path) gives the process-wide store of a file, so that every agent using it shares one
+# connection and one set of limits. stats() reports threads, checkpoints, memory and disk usage, and flushes.
+#
+# Configured through environment variables:
+#   LANGGRAPH_CHECKPOINT_PATH   SQLite file for durable checkpoints (in memory only when unset)
+#   CHECKPOINT_KEEP             Checkpoints kept per thread (default 2)
+#   CHECKPOINT_MAX_AGE          Seconds after its last update before a thread is deleted (default 7 days, 0: never)
+#   CHECKPOINT_MAX_BYTES        Size of all threads before the least recently updated are deleted (default 64 MB)
+#   CHECKPOINT_BATCH            Pending rows that trigger a write to disk (default 64)
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS checkpoints ("
+    "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, parent_id TEXT, "
+    "checkpoint_type TEXT NOT NULL, checkpoint BLOB NOT NULL, metadata_type TEXT NOT NULL, metadata BLOB NOT NULL, "
+    "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))",
+    "CREATE TABLE IF NOT EXISTS writes ("
+    "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, task_id TEXT NOT NULL, "
+    "idx INTEGER NOT NULL, channel TEXT NOT NULL, value_type TEXT NOT NULL, value BLOB NOT NULL, task_path TEXT, "
+    "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))",
+    "CREATE TABLE IF NOT EXISTS threads ("
+    "thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL, bytes INTEGER NOT NULL)",
+]
+
+
+def _entry_bytes(entry):
+    # Size of a stored checkpoint (checkpoint, metadata, parent) or write (task, channel, value, path)
+    return sum(len(part[1]) for part in entry if isinstance(part, tuple))
+
+
+class CheckpointStore(MemorySaver):
+    def __init__(self, path=None, keep=2, max_age=7 * 24 * 3600, max_bytes=64 * 1024 * 1024, batch=64):
+        """
+        Initialize the store.
+
+        Args:
+            path (str): SQLite file for durable checkpoints, or None to keep them in memory only
+            keep (int): Latest checkpoints kept per thread, at least 2
+            max_age (float): Seconds after its last update before a thread is deleted, 0 for no limit
+            max_bytes (int): Serialized size of all threads before the least recently updated are deleted
+            batch (int): Pending rows that trigger a write to disk
+        """
+        super().__init__()
+        self.path = path
+        self.keep = max(2, keep)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.batch = batch
+        self._lock = threading.RLock()
+        self._db = None
+        self._threads = {}  # thread_id -> [updated_at, bytes]
+        self._loaded = set()  # threads read back from disk (or created) in this process
+        self._pending_checkpoints = {}  # (thread_id, ns, checkpoint_id) -> row
+        self._pending_writes = {}  # (thread_id, ns, checkpoint_id, task_id, idx) -> row
+        self._pending_deletes = set()  # (thread_id, ns, checkpoint_id)
+        self._pending_threads = set()  # threads whose row in the threads table changed
+        self._deleted_threads = set()
+        self.counters = {"flushes": 0, "rows_written": 0, "rows_skipped": 0, "pruned_checkpoints": 0,
+                         "deleted_threads": 0, "expired_threads": 0, "evicted_threads": 0}
+        if path:
+            self._connect()
+
+    ### Disk ###
+    def _connect(self):
+        """
+        Open the SQLite file and read the thread index (not the checkpoints, which are read per thread).
+        """
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        # Set before the tables exist, so that deleted pages can be given back with incremental_vacuum
+        self._db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        for statement in SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+        for thread_id, updated_at, size in self._db.execute("SELECT thread_id, updated_at, bytes FROM threads"):
+            self._threads[thread_id] = [updated_at, size]
+
+    def _load_thread(self, thread_id):
+        """
+        Read a thread's checkpoints and writes back from disk, the first time it is used in this process.
+        """
+        if thread_id in self._loaded:
+            return
+        self._loaded.add(thread_id)
+        if self._db is None or thread_id not in self._threads:
+            return
+        for ns, checkpoint_id, parent_id, ctype, checkpoint, mtype, metadata in self._db.execute(
+                "SELECT checkpoint_ns, checkpoint_id, parent_id, checkpoint_type, checkpoint, metadata_type, "
+                "metadata FROM checkpoints WHERE thread_id = ?", (thread_id,)):
+            self.storage[thread_id][ns][checkpoint_id] = (
+                (ctype, zlib.decompress(checkpoint)), (mtype, zlib.decompress(metadata)), parent_id)
+        for ns, checkpoint_id, task_id, idx, channel, vtype, value, task_path in self._db.execute(
+                "SELECT checkpoint_ns, checkpoint_id, task_id, idx, channel, value_type, value, task_path "
+                "FROM writes WHERE thread_id = ?", (thread_id,)):
+            self.writes[(thread_id, ns, checkpoint_id)][(task_id, idx)] = (
+                task_id, channel, (vtype, zlib.decompress(value)), task_path)
+
+    def _pending(self):
+        return (len(self._pending_checkpoints) + len(self._pending_writes) + len(self._pending_deletes)
+                + len(self._deleted_threads))
+
+    def _write_batch(self):
+        """
+        Write every pending change to disk in one transaction.
+        """
+        if self._db is None or not self._pending():
+            return
+        db = self._db
+        with db:
+            for thread_id in self._deleted_threads:
+                for table in ("checkpoints", "writes", "threads"):
+                    db.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            db.executemany("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                           self._pending_deletes)
+            db.executemany("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                           self._pending_deletes)
+            db.executemany("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           self._pending_checkpoints.values())
+            db.executemany("INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           self._pending_writes.values())
+            db.executemany("INSERT OR REPLACE INTO threads VALUES (?, ?, ?)",
+                           [(thread_id, *self._threads[thread_id]) for thread_id in self._pending_threads
+                            if thread_id in self._threads])
+        if self._deleted_threads or self._pending_deletes:
+            db.execute("PRAGMA incremental_vacuum")
+        self.counters["flushes"] += 1
+        self.counters["rows_written"] += len(self._pending_checkpoints) + len(self._pending_writes)
+        self._pending_checkpoints.clear()
+        self._pending_writes.clear()
+        self._pending_deletes.clear()
+        self._pending_threads.clear()
+        self._deleted_threads.clear()
+
+    ### Limits ###
+    def _touch(self, thread_id):
+        """
+        Record a thread's update time and recompute its size.
+        """
+        size = sum(_entry_bytes(entry) for checkpoints in self.storage[thread_id].values()
+                   for entry in checkpoints.values())
+        size += sum(_entry_bytes(entry) for (thread, _, _), writes in self.writes.items() if thread == thread_id
+                    for entry in writes.values())
+        self._threads[thread_id] = [time.time(), size]
+        self._pending_threads.add(thread_id)
+
+    def _prune(self, thread_id, ns):
+        """
+        Drop all but the latest `keep` checkpoints of a thread, with their writes.
+        """
+        checkpoints = self.storage[thread_id][ns]
+        if len(checkpoints) <= self.keep:
+            return
+        for checkpoint_id in sorted(checkpoints)[:-self.keep]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, ns, checkpoint_id), None)
+            key = (thread_id, ns, checkpoint_id)
+            if self._pending_checkpoints.pop(key, None) is not None:
+                # Never written, so there is nothing to delete on disk either
+                self.counters["rows_skipped"] += 1
+            else:
+                self._pending_deletes.add(key)
+            for write_key in [k for k in self._pending_writes if k[:3] == key]:
+                del self._pending_writes[write_key]
+                self.counters["rows_skipped"] += 1
+            self.counters["pruned_checkpoints"] += 1
+
+    def _drop_thread(self, thread_id):
+        self.storage.pop(thread_id, None)
+        for key in [key for key in self.writes if key[0] == thread_id]:
+            del self.writes[key]
+        self._threads.pop(thread_id, None)
+        self._loaded.discard(thread_id)
+        self._pending_threads.discard(thread_id)
+        for pending in (self._pending_checkpoints, self._pending_writes):
+            for key in [key for key in pending if key[0] == thread_id]:
+                del pending[key]
+        self._pending_deletes = {key for key in self._pending_deletes if key[0] != thread_id}
+        if self._db is not None:
+            self._deleted_threads.add(thread_id)
+
+    def _enforce_limits(self, active=None):
+        """
+        Delete expired threads, then the least recently updated ones while the size limit is exceeded.
+        The thread being written to (active) is never evicted for size.
+        """
+        if self.max_age:
+            cutoff = time.time() - self.max_age
+            for thread_id in [t for t, (updated_at, _) in self._threads.items() if updated_at < cutoff]:
+                self._drop_thread(thread_id)
+                self.counters["expired_threads"] += 1
+        total = sum(size for _, size in self._threads.values())
+        for thread_id in sorted(self._threads, key=lambda t: self._threads[t][0]):
+            if total <= self.max_bytes:
+                break
+            if thread_id == active:
+                continue
+            total -= self._threads[thread_id][1]
+            self._drop_thread(thread_id)
+            self.counters["evicted_threads"] += 1
+
+    ### Checkpointer interface ###
+    def get_tuple(self, config):
+        with self._lock:
+            self._load_thread(config["configurable"]["thread_id"])
+            return super().get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        with self._lock:
+            for thread_id in ([config["configurable"]["thread_id"]] if config else list(self._threads)):
+                self._load_thread(thread_id)
+            # Materialized under the lock, since other threads may prune while the caller iterates
+            return iter(list(super().list(config, filter=filter, before=before, limit=limit)))
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            ns = config["configurable"]["checkpoint_ns"]
+            self._load_thread(thread_id)
+            result = super().put(config, checkpoint, metadata, new_versions)
+            if self._db is not None:
+                (ctype, cbytes), (mtype, mbytes), parent_id = self.storage[thread_id][ns][checkpoint["id"]]
+                self._pending_checkpoints[(thread_id, ns, checkpoint["id"])] = (
+                    thread_id, ns, checkpoint["id"], parent_id, ctype, zlib.compress(cbytes),
+                    mtype, zlib.compress(mbytes))
+            self._prune(thread_id, ns)
+            self._touch(thread_id)
+            if self._pending() >= self.batch:
+                self._enforce_limits(active=thread_id)
+                self._write_batch()
+            return result
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            ns = config["configurable"].get("checkpoint_ns", "")
+            checkpoint_id = config["configurable"]["checkpoint_id"]
+            self._load_thread(thread_id)
+            super().put_writes(config, writes, task_id, task_path)
+            if self._db is not None:
+                for (task, idx), (_, channel, (vtype, value), path) in self.writes[
+                        (thread_id, ns, checkpoint_id)].items():
+                    if task == task_id:
+                        self._pending_writes[(thread_id, ns, checkpoint_id, task, idx)] = (
+                            thread_id, ns, checkpoint_id, task, idx, channel, vtype, zlib.compress(value), path)
+            self._touch(thread_id)
+
+    ### Management ###
+    def delete_thread(self, thread_id):
+        """
+        Delete every checkpoint of a thread, in memory and (with the next flush) on disk.
+        """
+        with self._lock:
+            self._drop_thread(str(thread_id))
+            self.counters["deleted_threads"] += 1
+
+    def flush(self):
+        """
+        Apply the age and size limits and write pending changes to disk.
+        """
+        with self._lock:
+            self._enforce_limits()
+            self._write_batch()
+
+    def close(self):
+        """
+        Flush and close the SQLite file.
+        """
+        with self._lock:
+            self.flush()
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self):
+        """
+        Report the store's size and activity.
+
+        Returns:
+            dict: Threads, checkpoints, serialized bytes in memory, file size on disk, pending rows and counters
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats["threads"] = len(self._threads)
+            stats["threads_in_memory"] = len(self.storage)
+            stats["checkpoints_in_memory"] = sum(len(checkpoints) for namespaces in self.storage.values()
+                                                 for checkpoints in namespaces.values())
+            stats["memory_bytes"] = sum(size for thread_id, (_, size) in self._threads.items()
+                                        if thread_id in self.storage)
+            stats["bytes"] = sum(size for _, size in self._threads.values())
+            stats["pending_rows"] = self._pending()
+            stats["path"] = self.path
+            if self._db is not None:
+                stats["disk_checkpoints"] = self._db.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+                stats["disk_bytes"] = sum(os.path.getsize(self.path + suffix) for suffix in ("", "-wal")
+                                          if os.path.exists(self.path + suffix))
+        return stats
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def shared_store(path=None):
+    """
+    The process-wide checkpoint store of a SQLite file, configured from the environment.
+
+    Args:
+        path (str): The SQLite file, defaults to LANGGRAPH_CHECKPOINT_PATH
+
+    Returns:
+        CheckpointStore: The shared store, or None when no path is configured
+    """
+    path = path or os.getenv("LANGGRAPH_CHECKPOINT_PATH")
+    if not path:
+        return None
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = new_store(path)
+        return _stores[path]
+
+
+def new_store(path=None):
+    """
+    A checkpoint store with the limits from the environment.
+    """
+    return CheckpointStore(
+        path=path,
+        keep=int(os.getenv("CHECKPOINT_KEEP", "2")),
+        max_age=float(os.getenv("CHECKPOINT_MAX_AGE", str(7 * 24 * 3600))),
+        max_bytes=int(os.getenv("CHECKPOINT_MAX_BYTES", str(64 * 1024 * 1024))),
+        batch=int(os.getenv("CHECKPOINT_BATCH", "64")),
+    )
+
+
+@atexit.register
+def _close_stores():
+    with _stores_lock:
+        for store in _stores.values():
+            store.close()
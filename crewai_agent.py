@@ -1,58 +1,116 @@
-import os
-from dotenv import load_dotenv
 from datetime import date
-from tavily import TavilyClient
-import json
 
-# CrewAI imports
-from crewai import Agent as CrewAIAgent
-from crewai import Task, Crew
-from langchain_community.tools import tool
-from prompts import role, goal, instructions, knowledge
+from prompts import goal, stage_knowledge, StageTracker, prompt_date, dated_role, dated_instructions
+from history import TokenBudgetHistory
+from tracing import traced_turn, traced_tool
 
-# Load environment variables
-load_dotenv()
+# CrewAI, the HTTP layer and the search modules are imported on first use, and the crew is built with the
+# first message, so importing this module and creating an Agent stay cheap (see benchmarks/cold_start.py).
+# http_clients loads the .env file when it is first imported, before any API key is read.
+#
+# Every turn is a kickoff of the same crew, agent and task, whose description gets the conversation so far
+# and the latest query. The history is kept within a token budget (see history.py) and pasted in as one
+# "role: content" line per message. The agent and crew are not verbose, and CrewAI's telemetry is turned off
+# on this agent's crew and task rather than through OTEL_SDK_DISABLED, which would turn OpenTelemetry off for
+# the whole process. python -m benchmarks.kickoff_overhead measures the framework overhead and input tokens of
+# each turn.
 
-# Initialize Tavily client
-tavily_api_key = os.getenv("TAVILY_API_KEY")
-tavily_client = TavilyClient(api_key=tavily_api_key)
+# Display name of this agent. agent-ui.py reads it without importing the module (see agent_discovery.py)
+AGENT_NAME = "CrewAI Agent"
 
 
 class Agent:
-    def __init__(self, model="gpt-4o-mini"):
+    def __init__(self, model="gpt-4o-mini", history_tokens=4000):
         """
         Initialize the CrewAI agent.
 
         Args:
             model (str): The language model to use
+            history_tokens (int): Token budget for the conversation history pasted into the task
         """
-        self.name = "CrewAI Agent"
-        # Create tools
-        self.tools = self._create_tools()
-
-        # Create the CrewAI agent
-        self.agent = self._create_crewai_agent(model)
+        self.name = AGENT_NAME
+        self.model = model
+        # Built with the first message, see the crew property
+        self._crew = None
+        self.task = None
+        self._prompt_date = None
+        self._prompt_stage = None
+        self.stage_tracker = StageTracker()
+        self.last_turn_failed = False
+
+        # Conversation history. Older turns are folded into a running summary once it goes over its budget
+        self.history = TokenBudgetHistory(max_tokens=history_tokens)
+
+    @property
+    def crew(self):
+        """
+        The crew, built on first use. The date is part of the CrewAI agent's role and goal, so the agent, its
+        task and the crew are built again when the date changes (see prompts.prompt_date). When the decision
+        stage changes, only the agent's backstory is replaced with the knowledge for that stage (see
+        prompts.stage_knowledge), and the crew is kept.
+        """
+        day, stage = prompt_date(), self.stage_tracker.stage
+        if day != self._prompt_date:
+            self.task = None
+            self._crew = None
+        if self._crew is None:
+            self._crew = self._create_crew(day, stage)
+            self._prompt_date = day
+        elif stage != self._prompt_stage:
+            self.agent.backstory = stage_knowledge(stage)
+            # Every kickoff formats the backstory from the one saved at the first kickoff, so save it again
+            self.agent._original_backstory = None
+        self._prompt_stage = stage
+        return self._crew
+
+    def _create_crew(self, day=None, stage=None):
+        """
+        Build the tools, the CrewAI agent and its generic task, and the crew that runs them.
+        The crew is reused for every turn; only the task's inputs change between kickoffs.
 
-        # Create a generic task for the agent
-        self.task = Task(
-            description=("Answer the user's query comprehensively, using tools when necessary. "
-                         "This is the conversation history: {history}"
-                         "This is the user's latest query: {query}"),
-            expected_output="A clear, well-formatted answer, incorporating tool results when appropriate.",
-            agent=self.agent
-        )
+        Args:
+            day (datetime.date): The date to write into the agent's role and goal, or None to have the model
+                look it up
+            stage (int): The decision stage whose knowledge is the agent's backstory, or None for all of it
+        """
+        from crewai import Task, Crew
+        import litellm
+        from http_clients import get_http_client, get_async_http_client
+
+        # CrewAI calls its LLM through litellm, which is pointed at the process-wide OpenAI connection pool
+        litellm.client_session = get_http_client("openai")
+        litellm.aclient_session = get_async_http_client("openai")
+
+        if self.task is None:
+            # Create tools
+            self.tools = self._create_tools()
+
+            # Create the CrewAI agent
+            self.agent = self._create_crewai_agent(self.model, day, stage)
+
+            # Create a generic task for the agent
+            self.task = Task(
+                description=("Answer the user's query comprehensively, using tools when necessary.\n"
+                             "This is the conversation history:\n{history}\n"
+                             "This is the user's latest query: {query}"),
+                expected_output="A clear, well-formatted answer, incorporating tool results when appropriate.",
+                agent=self.agent
+            )
 
         # Create the crew
-        self.crew = Crew(
+        crew = Crew(
             agents=[self.agent],
             tasks=[self.task],
             verbose=False
         )
-
-        # Conversation history
-        self.messages = []
+        # CrewAI records telemetry spans on every kickoff and task. They are turned off on this crew and task
+        # only, so OpenTelemetry stays available to the rest of the process
+        crew._telemetry.ready = False
+        self.task._telemetry.ready = False
+        return crew
 
     @staticmethod
+    @traced_tool("date")
     def date_tool():
         """
         Function to get the current date. This tool takes no arguments.
@@ -61,17 +119,15 @@ class Agent:
         return today.strftime("%B %d, %Y")
 
     @staticmethod
+    @traced_tool("web_search")
     def web_search(query):
         """
         This function searches the web for the given query and returns the results.
         The tool takes a search string as a parameter.
         """
-        # Call Tavily's search and dump the results as a JSON string
-        search_response = tavily_client.search(query)
-        results = json.dumps(search_response.get('results', []))
-        print(f"Web Search Results for '{query}':")
-        print(results)
-        return results
+        from search_compaction import search
+
+        return search(query)
 
     def _create_tools(self):
         """
@@ -80,6 +136,7 @@ class Agent:
         Returns:
             List of tools
         """
+        from langchain_community.tools import tool
 
         @tool("Get Current Date")
         def date_tool_wrapper():
@@ -96,25 +153,50 @@ class Agent:
 
         return [date_tool_wrapper, web_search_wrapper]
 
-    def _create_crewai_agent(self, model):
+    def _create_crewai_agent(self, model, day=None, stage=None):
         """
         Create a CrewAI agent with the specified configuration.
 
         Args:
             model (str): The language model to use
+            day (datetime.date): The date to write into the role and goal, or None to have the model look it up
+            stage (int): The decision stage whose knowledge is the backstory, or None for all of it
 
         Returns:
             CrewAI Agent
         """
+        from crewai import Agent as CrewAIAgent
+
         return CrewAIAgent(
-            role=role,
-            goal="\n".join([goal,instructions]),
-            backstory=knowledge,
+            role=dated_role(day),
+            goal="\n".join([goal,dated_instructions(day)]),
+            backstory=stage_knowledge(stage),
             tools=self.tools,
             verbose=False,
             llm=model
         )
 
+    @property
+    def messages(self):
+        """
+        The turns of the conversation the history budget has kept.
+        """
+        return self.history.messages
+
+    def _inputs(self, message):
+        """
+        The task inputs of a turn. The history is first brought within its token budget.
+
+        Args:
+            message (str): User's input message
+
+        Returns:
+            dict: The query and the history as "role: content" lines
+        """
+        self.history.compact()
+        return {"query": message, "history": self.history.as_text() or "(none yet)"}
+
+    @traced_turn
     def chat(self, message):
         """
         Send a message and get a response.
@@ -126,19 +208,62 @@ class Agent:
             str: Assistant's response
         """
         try:
+            self.last_turn_failed = False
+            self.stage_tracker.observe(message)
             # Kickoff the crew with the user's query
-            response = self.crew.kickoff(inputs={"query": message, "history": self.messages})
+            response = self.crew.kickoff(inputs=self._inputs(message))
 
             # Maintain conversation history
-            self.messages.append({"role": "user", "content": str(message)})
-            self.messages.append({"role": "assistant", "content": str(response)})
+            self.history.add("user", str(message))
+            self.history.add("assistant", str(response))
+
+            return response
+
+        except Exception as e:
+            print(f"Error in chat: {e}")
+            self.last_turn_failed = True
+            return "Sorry, I encountered an error processing your request."
+
+    @traced_turn
+    async def achat(self, message):
+        """
+        Send a message and get a response, without blocking the event loop.
+        CrewAI's kickoff_async runs the (synchronous) crew on a worker thread.
+
+        Args:
+            message (str): User's input message
+
+        Returns:
+            str: Assistant's response
+        """
+        try:
+            self.last_turn_failed = False
+            self.stage_tracker.observe(message)
+            response = await self.crew.kickoff_async(inputs=self._inputs(message))
+
+            self.history.add("user", str(message))
+            self.history.add("assistant", str(response))
 
             return response
 
         except Exception as e:
             print(f"Error in chat: {e}")
+            self.last_turn_failed = True
             return "Sorry, I encountered an error processing your request."
 
+    def remember_turn(self, message, response):
+        """
+        Add a turn answered without the model (see response_cache.py) to the conversation, as if chat had
+        answered it.
+
+        Args:
+            message (str): User's input message
+            response (str): Assistant's response
+        """
+        self.stage_tracker.observe(message)
+        self.history.add("user", str(message))
+        self.history.add("assistant", str(response))
+
     def clear_chat(self):
         """
         Reset the conversation context.
@@ -147,15 +272,9 @@ class Agent:
             bool: True if reset was successful
         """
         try:
-            # Reset messages
-            self.messages = []
-
-            # Recreate the crew to ensure a fresh state
-            self.crew = Crew(
-                agents=[self.agent],
-                tasks=[self.task],
-                verbose=False
-            )
+            # Reset messages. The crew keeps no conversation state of its own, so it is reused
+            self.history.clear()
+            self.stage_tracker.reset()
 
             return True
         except Exception as e:
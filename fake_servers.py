@@ -0,0 +1,1027 @@
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local stand-ins for the OpenAI, Anthropic and Tavily APIs.
+#
+# This lets every *_agent.py module run a full tool-call loop without network access or API keys, so that
+# agents can be exercised in CI and benchmarked on an offline box. A single HTTP server speaks:
+#   - OpenAI chat completions (function calling, forced tool_choice as used by instructor, and the
+#     plain-text ReAct format used by the LangChain, Llama-Index and CrewAI agents)
+#   - the OpenAI Assistants API (assistants, threads, messages, runs, submit_tool_outputs)
+#   - the Anthropic Messages API
+#   - Tavily search
+#
+# The agent modules are pointed at it through environment variables only:
+#   OPENAI_BASE_URL / OPENAI_API_BASE, ANTHROPIC_BASE_URL and TAVILY_BASE_URL
+# Run `python fake_servers.py` to start a server and print the variables to export.
+#
+# What the fake model does each turn is driven by a script (see DEFAULT_SCRIPT). Each endpoint can be given
+# a latency distribution and an error rate through a JSON config file:
+#   {
+#     "latency": {"anthropic.messages": {"dist": "lognormal", "ms": 400, "sigma": 0.5},
+#                 "tavily.search": {"dist": "uniform", "min_ms": 100, "max_ms": 300}},
+#     "errors": {"openai.chat": {"rate": 0.1, "status": 429},
+#                "tavily.search": {"rate": 0.05, "timeout": true}},
+#     "script": {"turns": [[{"tool_calls": [{"name": "web_search", "arguments": {"query": "..."}}]},
+#                           {"text": "..."}]]},
+#     "token_ms": 20
+#   }
+# Endpoint names are openai.chat, openai.assistants, openai.queue, openai.run, anthropic.messages and
+# tavily.search. openai.queue is the time a new Assistants run stays queued before it starts, and openai.run
+# the time it then spends in progress before its next status is available.
+# Requests made with stream=true are answered with server-sent events, one word per chunk, token_ms apart;
+# the endpoint latency then becomes the time to first token.
+#
+# With "capture_requests": N in the config, the bodies of the first N requests that carry a prompt (chat
+# completions, Anthropic messages, and the creation of assistants and thread messages) are kept in
+# FakeServers.captured, e.g. to see what an agent really sends (see prompt_size.py).
+
+ENDPOINTS = ["openai.chat", "openai.assistants", "openai.queue", "openai.run", "anthropic.messages",
+             "tavily.search"]
+
+# By default each turn looks up the date, searches the web for the user's message and then answers.
+# A step is either {"tool_calls": [{"name": ..., "arguments": {...}}, ...]} or {"text": ...}.
+# The placeholder {message} is replaced with the user's latest message.
+# Like the real model, the fake only looks up the date when its prompt tells it to: steps that call nothing
+# but the date tool are skipped when the prompt lacks DATE_DIRECTIVE (see prompts.prompt_date).
+DATE_DIRECTIVE = "ALWAYS begin by checking the current date"
+
+# Handlers whose request bodies carry a prompt, and may be captured
+PROMPT_HANDLERS = ("chat_completions", "anthropic_messages", "create_assistant", "update_assistant",
+                   "create_message")
+
+# Marks the user's message in the task description of the CrewAI agent
+CREWAI_QUERY = "This is the user's latest query:"
+
+DEFAULT_SCRIPT = {
+    "turns": [[
+        {"tool_calls": [{"name": "date", "arguments": {}}]},
+        {"tool_calls": [{"name": "web_search", "arguments": {"query": "{message}"}}]},
+        {"text": "Here is what I found about: {message}"},
+    ]]
+}
+
+
+def estimate_tokens(text):
+    """
+    Rough token count used for the fake usage figures (about four characters per token).
+    """
+    return max(1, len(text) // 4)
+
+
+def _new_id(prefix):
+    return f"{prefix}{uuid.uuid4().hex[:24]}"
+
+
+def _normalize_name(name):
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def _match_tool_name(name, available):
+    """
+    Map a tool name from the script onto the closest tool the agent actually offered.
+    Frameworks name the same tool differently ("web_search", "Web Search", "date_tool", "Get Current Date").
+    """
+    if not available:
+        return name
+    wanted = _normalize_name(name)
+    for candidate in available:
+        if _normalize_name(candidate) == wanted:
+            return candidate
+    for candidate in available:
+        normalized = _normalize_name(candidate)
+        if wanted in normalized or normalized in wanted:
+            return candidate
+    return name
+
+
+class LatencyModel:
+    def __init__(self, spec=None, rng=None):
+        """
+        A latency distribution for one endpoint.
+
+        Args:
+            spec (dict): {"dist": "fixed"|"uniform"|"normal"|"lognormal", "ms": .., "min_ms": .., "max_ms": ..,
+                          "sigma": ..}
+            rng (random.Random): Random number generator to draw from
+        """
+        self.spec = spec or {"dist": "fixed", "ms": 0}
+        self.rng = rng or random.Random()
+
+    def sample(self):
+        """
+        Draw a latency in seconds.
+        """
+        spec = self.spec
+        dist = spec.get("dist", "fixed")
+        if dist == "uniform":
+            ms = self.rng.uniform(spec.get("min_ms", 0), spec.get("max_ms", spec.get("ms", 0)))
+        elif dist == "normal":
+            ms = self.rng.gauss(spec.get("ms", 0), spec.get("sigma", 0))
+        elif dist == "lognormal":
+            # "ms" is the median, "sigma" the standard deviation of the underlying normal
+            ms = spec.get("ms", 0) * self.rng.lognormvariate(0, spec.get("sigma", 0.5))
+        else:
+            ms = spec.get("ms", 0)
+        return max(0.0, ms) / 1000.0
+
+
+def parse_latency(text):
+    """
+    Parse the compact command line form of a latency spec.
+
+    Examples: "200" (fixed), "uniform:100:300", "normal:200:50", "lognormal:400:0.5"
+    """
+    parts = text.split(":")
+    if len(parts) == 1:
+        return {"dist": "fixed", "ms": float(parts[0])}
+    dist = parts[0]
+    if dist == "uniform":
+        return {"dist": dist, "min_ms": float(parts[1]), "max_ms": float(parts[2])}
+    return {"dist": dist, "ms": float(parts[1]), "sigma": float(parts[2]) if len(parts) > 2 else 0.5}
+
+
+def parse_error(text):
+    """
+    Parse the compact command line form of an error spec.
+
+    Examples: "429:0.1" (10% of requests get a 429), "timeout:0.05" (5% of requests hang), "500:1:3"
+    (the first 3 requests get a 500)
+    """
+    parts = text.split(":")
+    spec = {"rate": float(parts[1]) if len(parts) > 1 else 1.0}
+    if parts[0] == "timeout":
+        spec["timeout"] = True
+    else:
+        spec["status"] = int(parts[0])
+    if len(parts) > 2:
+        spec["first_n"] = int(parts[2])
+    return spec
+
+
+class PromptCache:
+    # How far back from a breakpoint the Anthropic API looks for an earlier cache entry
+    LOOKBACK_BLOCKS = 20
+
+    def __init__(self):
+        """
+        Simulates Anthropic prompt caching so that cache_control breakpoints show up in the usage figures.
+        The prompt is treated as a sequence of blocks (tools, then system, then message content); a prefix
+        is written to the cache at each breakpoint and later requests read the longest cached prefix.
+        """
+        self.prefixes = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _blocks(body):
+        blocks = list(body.get("tools", []))
+        system = body.get("system") or []
+        blocks += [{"type": "text", "text": system}] if isinstance(system, str) else list(system)
+        for message in body.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, str):
+                content = [{"type": "text", "text": content}]
+            blocks += [dict(block, role=message.get("role")) for block in content]
+        return blocks
+
+    def usage(self, body):
+        """
+        Work out the input token usage of a request, split into uncached, cache write and cache read.
+
+        Returns:
+            dict: input_tokens, cache_creation_input_tokens and cache_read_input_tokens
+        """
+        blocks = self._blocks(body)
+        hashes, sizes, breakpoints = [], [], []
+        digest = hashlib.sha256()
+        total = 0
+        for i, block in enumerate(blocks):
+            if "cache_control" in block:
+                breakpoints.append(i)
+            cleaned = {key: value for key, value in block.items() if key != "cache_control"}
+            serialized = json.dumps(cleaned, sort_keys=True)
+            digest.update(serialized.encode("utf-8"))
+            hashes.append(digest.hexdigest())
+            total += estimate_tokens(serialized)
+            sizes.append(total)
+
+        read = 0
+        with self.lock:
+            for point in breakpoints:
+                for i in range(point, max(-1, point - self.LOOKBACK_BLOCKS), -1):
+                    if hashes[i] in self.prefixes:
+                        read = max(read, sizes[i])
+                        break
+            written = sizes[breakpoints[-1]] - read if breakpoints and sizes[breakpoints[-1]] > read else 0
+            self.prefixes.update(hashes[point] for point in breakpoints)
+        return {"input_tokens": total - read - written, "cache_creation_input_tokens": written,
+                "cache_read_input_tokens": read}
+
+
+class FakeState:
+    def __init__(self, config=None, seed=None):
+        """
+        Shared state of the fake server: configuration, Assistants objects and counters.
+
+        Args:
+            config (dict): Latency, error and script configuration (see the top of this module)
+            seed (int): Seed for the latency and error random number generator
+        """
+        config = config or {}
+        self.rng = random.Random(seed)
+        self.latency = {name: LatencyModel(spec, self.rng) for name, spec in config.get("latency", {}).items()}
+        self.errors = config.get("errors", {})
+        self.script = config.get("script") or DEFAULT_SCRIPT
+        self.answer_words = config.get("answer_words", 60)
+        self.search_results = config.get("search_results", 5)
+        self.result_words = config.get("result_words", 120)
+        self.hang_seconds = config.get("hang_seconds", 60)
+        self.token_seconds = config.get("token_ms", 0) / 1000.0
+        self.lock = threading.Lock()
+        self.assistants = {}
+        self.threads = {}
+        self.runs = {}
+        self.prompt_cache = PromptCache()
+        self.capture_limit = config.get("capture_requests", 0)
+        self.captured = []
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {name: {"requests": 0, "errors": 0, "input_tokens": 0, "output_tokens": 0, "tool_calls": 0}
+                          for name in ENDPOINTS}
+
+    def count(self, endpoint, **amounts):
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, {"requests": 0})
+            for key, value in amounts.items():
+                stats[key] = stats.get(key, 0) + value
+
+    def capture(self, handler, body):
+        """
+        Keep the body of a request that carries a prompt, until capture_requests of them have been kept.
+        """
+        with self.lock:
+            if len(self.captured) < self.capture_limit:
+                self.captured.append({"handler": handler, "body": body})
+
+    def delay(self, endpoint):
+        model = self.latency.get(endpoint)
+        return model.sample() if model else 0.0
+
+    def injected_error(self, endpoint):
+        """
+        Decide whether this request should fail.
+
+        Returns:
+            dict: The error spec to apply, or None
+        """
+        spec = self.errors.get(endpoint)
+        if not spec:
+            return None
+        with self.lock:
+            seen = self.stats.get(endpoint, {}).get("requests", 0)
+            if "first_n" in spec and seen >= spec["first_n"]:
+                return None
+            if self.rng.random() >= spec.get("rate", 1.0):
+                return None
+        return spec
+
+    ### Script ###
+    def step(self, turn_index, step_index, message, prompt=None):
+        """
+        Look up what the fake model does at a given point of a turn.
+
+        Args:
+            turn_index (int): Zero-based index of the user turn in the conversation
+            step_index (int): Number of tool rounds already completed in this turn
+            message (str): The user's latest message
+            prompt (str): The system prompt or instructions of the request, if known
+
+        Returns:
+            dict: {"tool_calls": [...]} or {"text": ...}
+        """
+        turns = self.script["turns"]
+        steps = turns[min(turn_index, len(turns) - 1)]
+        if prompt is not None and DATE_DIRECTIVE not in prompt:
+            steps = [step for step in steps
+                     if not step.get("tool_calls") or any(call["name"] != "date" for call in step["tool_calls"])]
+        if step_index >= len(steps):
+            step = {"text": steps[-1].get("text", "Done.") if steps else "Done."}
+        else:
+            step = steps[step_index]
+        step = json.loads(json.dumps(step).replace("{message}", json.dumps(message)[1:-1]))
+        if "text" in step:
+            step["text"] = self._pad_answer(step["text"])
+        return step
+
+    def final_text(self, turn_index, message):
+        """
+        The text the script ends a turn with.
+        """
+        turns = self.script["turns"]
+        steps = turns[min(turn_index, len(turns) - 1)]
+        texts = [step["text"] for step in steps if "text" in step] or ["Done."]
+        return self._pad_answer(texts[-1].replace("{message}", message))
+
+    def _pad_answer(self, text):
+        words = text.split()
+        filler = ["Considering", "your", "goals", "and", "constraints,", "the", "evidence", "suggests",
+                  "weighing", "each", "option", "carefully."]
+        while len(words) < self.answer_words:
+            words.append(filler[len(words) % len(filler)])
+        return " ".join(words)
+
+    def search_response(self, query):
+        seed = int(hashlib.sha256(query.encode("utf-8")).hexdigest()[:8], 16)
+        rng = random.Random(seed)
+        vocabulary = query.split() + ["decision", "analysis", "cost", "benefit", "risk", "market", "study",
+                                      "evidence", "review", "option", "report", "trend"]
+        results = []
+        for i in range(self.search_results):
+            content = " ".join(rng.choice(vocabulary) for _ in range(self.result_words))
+            results.append({
+                "title": f"Result {i + 1} for {query}",
+                "url": f"https://example.com/{seed:x}/{i}",
+                "content": content,
+                "score": round(1.0 - i * 0.1, 3),
+                "raw_content": None,
+            })
+        return {"query": query, "follow_up_questions": None, "answer": None, "images": [],
+                "results": results, "response_time": 0.0}
+
+
+### Conversation analysis ###
+def _text_of(content):
+    """
+    Flatten message content (a string or a list of content parts) into plain text.
+    """
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    parts = []
+    for part in content:
+        if isinstance(part, dict):
+            if isinstance(part.get("text"), str):
+                parts.append(part["text"])
+            elif isinstance(part.get("text"), dict):
+                parts.append(part["text"].get("value", ""))
+            elif "content" in part:
+                parts.append(_text_of(part["content"]))
+        else:
+            parts.append(str(part))
+    return "\n".join(parts)
+
+
+def _is_real_user_message(message):
+    """
+    True for messages typed by the user, as opposed to tool results or ReAct observations that the
+    frameworks send back with the user role.
+    """
+    if message.get("role") != "user":
+        return False
+    content = message.get("content")
+    if isinstance(content, list) and content and all(
+            isinstance(part, dict) and part.get("type") == "tool_result" for part in content):
+        return False
+    return not _text_of(content).lstrip().startswith("Observation:")
+
+
+def analyze_conversation(messages):
+    """
+    Work out where a stateless request is in the conversation.
+
+    Returns:
+        tuple: (turn_index, step_index, latest user message)
+    """
+    user_indexes = [i for i, m in enumerate(messages) if _is_real_user_message(m)]
+    if not user_indexes:
+        return 0, 0, ""
+    last = user_indexes[-1]
+    message = _text_of(messages[last].get("content"))
+    try:
+        # Structured-input agents (Atomic) send the user's message wrapped in a JSON object
+        fields = json.loads(message)
+        if isinstance(fields, dict) and len(fields) == 1 and isinstance(next(iter(fields.values())), str):
+            message = next(iter(fields.values()))
+    except ValueError:
+        pass
+    step_index = sum(1 for m in messages[last + 1:] if m.get("role") == "assistant")
+    if step_index == 0 and "Question:" in message:
+        # LangChain's ReAct agent sends a single prompt with the scratchpad appended after the question
+        tail = message[message.rfind("Question:"):]
+        step_index = tail.count("\nObservation:")
+        message = tail[len("Question:"):].split("\n")[0].strip()
+    elif CREWAI_QUERY in message:
+        # CrewAI sends the whole task, with the conversation history, as the user message
+        message = message[message.rfind(CREWAI_QUERY) + len(CREWAI_QUERY):].split("\n")[0].strip()
+    return len(user_indexes) - 1, step_index, message
+
+
+def _react_tool_names(prompt):
+    match = re.search(r"one (?:name )?of \[([^\]]+)\]", prompt) or re.search(r"\(one of ([^)]+)\)", prompt)
+    if not match:
+        return []
+    return [name.strip() for name in match.group(1).split(",") if name.strip()]
+
+
+def _react_text(step, tool_names):
+    """
+    Render a script step in the plain-text ReAct format.
+    """
+    if "tool_calls" in step:
+        call = step["tool_calls"][0]
+        return ("Thought: I need to use a tool to help me answer the question.\n"
+                f"Action: {_match_tool_name(call['name'], tool_names)}\n"
+                f"Action Input: {json.dumps(call.get('arguments', {}))}")
+    return f"Thought: I can answer without using any more tools.\nFinal Answer: {step['text']}"
+
+
+def _fill_schema(schema, step, final_text):
+    """
+    Build arguments for a forced function call (instructor's structured output) from a script step.
+    A schema with a tool_calls list (the Atomic agent's orchestrator) gets all the step's tool calls, or the
+    answer in its final_answer field. Schemas without one can only hold an answer, so they get the turn's
+    final text.
+    """
+    properties = schema.get("properties", {})
+    arguments = {}
+    if "tool_calls" in properties:
+        if "tool_calls" not in step:
+            return {"tool_calls": [], "final_answer": step.get("text") or final_text}
+        item = properties["tool_calls"].get("items", {})
+        if "$ref" in item:
+            item = schema.get("$defs", {}).get(item["$ref"].rsplit("/", 1)[-1], {})
+        names = item.get("properties", {}).get("tool", {}).get("enum", [])
+        return {"tool_calls": [{"tool": _match_tool_name(call["name"], names), "parameters": call.get("arguments", {})}
+                               for call in step["tool_calls"]],
+                "final_answer": None}
+    text = step.get("text") or final_text
+    for name, prop in properties.items():
+        if prop.get("type", "string") == "string":
+            arguments[name] = text
+    return arguments
+
+
+### Request handler ###
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None  # set by FakeServers
+
+    routes = [
+        ("POST", r"/v1/chat/completions", "openai.chat", "chat_completions"),
+        ("POST", r"/v1/messages", "anthropic.messages", "anthropic_messages"),
+        ("POST", r"/search", "tavily.search", "tavily_search"),
+        ("POST", r"/v1/assistants", "openai.assistants", "create_assistant"),
+        ("POST", r"/v1/assistants/(?P<assistant_id>[^/]+)", "openai.assistants", "update_assistant"),
+        ("POST", r"/v1/threads", "openai.assistants", "create_thread"),
+        ("POST", r"/v1/threads/(?P<thread_id>[^/]+)/messages", "openai.assistants", "create_message"),
+        ("GET", r"/v1/threads/(?P<thread_id>[^/]+)/messages", "openai.assistants", "list_messages"),
+        ("POST", r"/v1/threads/(?P<thread_id>[^/]+)/runs", "openai.assistants", "create_run"),
+        ("GET", r"/v1/threads/(?P<thread_id>[^/]+)/runs/(?P<run_id>[^/]+)", "openai.assistants", "retrieve_run"),
+        ("POST", r"/v1/threads/(?P<thread_id>[^/]+)/runs/(?P<run_id>[^/]+)/submit_tool_outputs",
+         "openai.assistants", "submit_tool_outputs"),
+        ("GET", r"/_stats", None, "get_stats"),
+        ("POST", r"/_reset", None, "reset_stats"),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        path = self.path.split("?")[0]
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        body = json.loads(raw) if raw else {}
+        for route_method, pattern, endpoint, handler in self.routes:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                if endpoint:
+                    error = self.state.injected_error(endpoint)
+                    self.state.count(endpoint, requests=1)
+                    time.sleep(self.state.delay(endpoint))
+                    if error:
+                        self.state.count(endpoint, errors=1)
+                        return self._send_error(endpoint, error)
+                if handler in PROMPT_HANDLERS:
+                    self.state.capture(handler, body)
+                return getattr(self, handler)(body, **match.groupdict())
+        self._send_json({"error": {"message": f"No fake for {method} {path}"}}, status=404)
+
+    def _send_json(self, payload, status=200, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _send_event(self, data, event=None):
+        """
+        Write one server-sent event as an HTTP chunk.
+        """
+        text = "" if event is None else f"event: {event}\n"
+        text += f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n"
+        chunk = text.encode("utf-8")
+        self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _words(self, text):
+        """
+        Split text into streaming chunks, pausing token_ms before each one after the first.
+        """
+        for i, word in enumerate(re.findall(r"\s*\S+", text or "")):
+            if i and self.state.token_seconds:
+                time.sleep(self.state.token_seconds)
+            yield word
+
+    def _send_error(self, endpoint, spec):
+        if spec.get("timeout"):
+            # Hang until the client gives up, then drop the connection
+            time.sleep(self.state.hang_seconds)
+            self.close_connection = True
+            return
+        status = spec.get("status", 500)
+        message = f"Injected error {status} from fake {endpoint}"
+        kind = "rate_limit_error" if status == 429 else "api_error"
+        if endpoint.startswith("anthropic"):
+            payload = {"type": "error", "error": {"type": kind, "message": message}}
+        elif endpoint.startswith("tavily"):
+            payload = {"detail": {"error": message}}
+        else:
+            payload = {"error": {"message": message, "type": kind, "code": None}}
+        self._send_json(payload, status=status, headers={"Retry-After": "0", "Connection": "close"})
+        self.close_connection = True
+
+    ### OpenAI chat completions ###
+    def chat_completions(self, body):
+        messages = body.get("messages", [])
+        turn_index, step_index, message = analyze_conversation(messages)
+        prompt = "\n".join(_text_of(m.get("content")) for m in messages)
+        step = self.state.step(turn_index, step_index, message, prompt)
+        tools = [t["function"]["name"] for t in body.get("tools", []) if t.get("type") == "function"]
+        forced = body.get("tool_choice")
+
+        tool_calls = None
+        content = None
+        if isinstance(forced, dict) and forced.get("type") == "function":
+            # Structured output: the client forces a call to the function describing its schema
+            name = forced["function"]["name"]
+            schema = next((t["function"].get("parameters", {}) for t in body.get("tools", [])
+                           if t["function"]["name"] == name), {})
+            tool_calls = [{"id": _new_id("call_"), "type": "function",
+                           "function": {"name": name, "arguments": json.dumps(
+                               _fill_schema(schema, step, self.state.final_text(turn_index, message)))}}]
+            if "tool" in schema.get("properties", {}) and "tool_calls" in step:
+                self.state.count("openai.chat", tool_calls=1)
+        elif tools and "tool_calls" in step:
+            tool_calls = [{"id": _new_id("call_"), "type": "function",
+                           "function": {"name": _match_tool_name(call["name"], tools),
+                                        "arguments": json.dumps(call.get("arguments", {}))}}
+                          for call in step["tool_calls"]]
+            self.state.count("openai.chat", tool_calls=len(tool_calls))
+        elif not tools and "Action Input" in prompt:
+            content = _react_text(step, _react_tool_names(prompt))
+            if "tool_calls" in step:
+                self.state.count("openai.chat", tool_calls=1)
+        else:
+            content = step.get("text", "Done.")
+
+        input_tokens = estimate_tokens(json.dumps(messages) + json.dumps(body.get("tools", [])))
+        output_tokens = estimate_tokens(content or json.dumps(tool_calls))
+        self.state.count("openai.chat", input_tokens=input_tokens, output_tokens=output_tokens)
+        completion = {
+            "id": _new_id("chatcmpl-"),
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "tool_calls": tool_calls, "refusal": None},
+                "finish_reason": "tool_calls" if tool_calls and not forced else "stop",
+                "logprobs": None,
+            }],
+            "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                      "total_tokens": input_tokens + output_tokens},
+        }
+        if body.get("stream"):
+            self._stream_chat_completion(completion, (body.get("stream_options") or {}).get("include_usage"))
+        else:
+            self._send_json(completion)
+
+    def _stream_chat_completion(self, completion, include_usage):
+        choice = completion["choices"][0]
+        header = {key: completion[key] for key in ("id", "created", "model")}
+        header["object"] = "chat.completion.chunk"
+
+        def chunk(delta, finish_reason=None):
+            return dict(header, choices=[{"index": 0, "delta": delta, "finish_reason": finish_reason,
+                                          "logprobs": None}])
+
+        self._start_stream()
+        # Like the real API, the first chunk has content "" for text answers and null for tool calls
+        self._send_event(chunk({"role": "assistant", "content": None if choice["message"]["tool_calls"] else ""}))
+        for word in self._words(choice["message"]["content"]):
+            self._send_event(chunk({"content": word}))
+        for index, call in enumerate(choice["message"]["tool_calls"] or []):
+            self._send_event(chunk({"tool_calls": [{"index": index, "id": call["id"], "type": "function",
+                                                    "function": {"name": call["function"]["name"],
+                                                                 "arguments": ""}}]}))
+            self._send_event(chunk({"tool_calls": [{"index": index,
+                                                    "function": {"arguments": call["function"]["arguments"]}}]}))
+        self._send_event(chunk({}, choice["finish_reason"]))
+        if include_usage:
+            self._send_event(dict(header, choices=[], usage=completion["usage"]))
+        self._send_event("[DONE]")
+        self._end_stream()
+
+    ### Anthropic messages ###
+    def anthropic_messages(self, body):
+        messages = body.get("messages", [])
+        turn_index, step_index, message = analyze_conversation(messages)
+        step = self.state.step(turn_index, step_index, message, _text_of(body.get("system")))
+        tools = [t["name"] for t in body.get("tools", [])]
+
+        if tools and "tool_calls" in step:
+            content = [{"type": "tool_use", "id": _new_id("toolu_"), "name": _match_tool_name(call["name"], tools),
+                        "input": call.get("arguments", {})} for call in step["tool_calls"]]
+            stop_reason = "tool_use"
+            self.state.count("anthropic.messages", tool_calls=len(content))
+        else:
+            content = [{"type": "text", "text": step.get("text", "Done.")}]
+            stop_reason = "end_turn"
+
+        usage = self.state.prompt_cache.usage(body)
+        output_tokens = estimate_tokens(json.dumps(content))
+        usage["output_tokens"] = output_tokens
+        self.state.count("anthropic.messages", **usage)
+        response = {
+            "id": _new_id("msg_"),
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "claude"),
+            "content": content,
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": usage,
+        }
+        if body.get("stream"):
+            self._stream_anthropic_message(response)
+        else:
+            self._send_json(response)
+
+    def _stream_anthropic_message(self, response):
+        self._start_stream()
+        start = dict(response, content=[], stop_reason=None, usage=dict(response["usage"], output_tokens=1))
+        self._send_event({"type": "message_start", "message": start}, "message_start")
+        for index, block in enumerate(response["content"]):
+            if block["type"] == "text":
+                self._send_event({"type": "content_block_start", "index": index,
+                                  "content_block": {"type": "text", "text": ""}}, "content_block_start")
+                for word in self._words(block["text"]):
+                    self._send_event({"type": "content_block_delta", "index": index,
+                                      "delta": {"type": "text_delta", "text": word}}, "content_block_delta")
+            else:
+                self._send_event({"type": "content_block_start", "index": index,
+                                  "content_block": dict(block, input={})}, "content_block_start")
+                self._send_event({"type": "content_block_delta", "index": index,
+                                  "delta": {"type": "input_json_delta", "partial_json": json.dumps(block["input"])}},
+                                 "content_block_delta")
+            self._send_event({"type": "content_block_stop", "index": index}, "content_block_stop")
+        self._send_event({"type": "message_delta",
+                          "delta": {"stop_reason": response["stop_reason"], "stop_sequence": None},
+                          "usage": {"output_tokens": response["usage"]["output_tokens"]}}, "message_delta")
+        self._send_event({"type": "message_stop"}, "message_stop")
+        self._end_stream()
+
+    ### Tavily ###
+    def tavily_search(self, body):
+        self._send_json(self.state.search_response(str(body.get("query", ""))))
+
+    ### OpenAI Assistants ###
+    def create_assistant(self, body):
+        assistant = {"id": _new_id("asst_"), "object": "assistant", "created_at": int(time.time()),
+                     "name": body.get("name"), "description": None, "model": body.get("model", "gpt-4o-mini"),
+                     "instructions": body.get("instructions"), "tools": body.get("tools", []),
+                     "metadata": {}, "top_p": 1.0, "temperature": 1.0, "response_format": "auto"}
+        with self.state.lock:
+            self.state.assistants[assistant["id"]] = assistant
+        self._send_json(assistant)
+
+    def update_assistant(self, body, assistant_id):
+        with self.state.lock:
+            assistant = self.state.assistants.get(assistant_id)
+            if assistant is not None:
+                assistant.update({key: value for key, value in body.items() if key in assistant})
+        if assistant is None:
+            return self._send_json({"error": {"message": f"No assistant found with id '{assistant_id}'."}},
+                                   status=404)
+        self._send_json(assistant)
+
+    def create_thread(self, body):
+        thread = {"id": _new_id("thread_"), "object": "thread", "created_at": int(time.time()),
+                  "metadata": {}, "tool_resources": None}
+        with self.state.lock:
+            self.state.threads[thread["id"]] = {"thread": thread, "messages": []}
+        self._send_json(thread)
+
+    def _thread_message(self, thread_id, role, text, run_id=None, assistant_id=None):
+        message = {"id": _new_id("msg_"), "object": "thread.message", "created_at": int(time.time()),
+                   "thread_id": thread_id, "role": role, "status": "completed",
+                   "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+                   "assistant_id": assistant_id, "run_id": run_id, "attachments": [], "metadata": {}}
+        with self.state.lock:
+            self.state.threads[thread_id]["messages"].append(message)
+        return message
+
+    def create_message(self, body, thread_id):
+        self._send_json(self._thread_message(thread_id, body.get("role", "user"), _text_of(body.get("content"))))
+
+    def list_messages(self, body, thread_id):
+        messages = list(self.state.threads[thread_id]["messages"])
+        if "order=asc" not in self.path:
+            messages.reverse()
+        self._send_json({"object": "list", "data": messages,
+                         "first_id": messages[0]["id"] if messages else None,
+                         "last_id": messages[-1]["id"] if messages else None, "has_more": False})
+
+    def _run_payload(self, run):
+        payload = dict(run["run"])
+        now = time.time()
+        if payload["status"] == "queued" and now >= run["queued_until"]:
+            self._start_run(run)
+            payload = dict(run["run"])
+        if payload["status"] == "in_progress" and now >= run["ready_at"]:
+            self._advance_run(run)
+            payload = dict(run["run"])
+        return payload
+
+    @staticmethod
+    def _start_run(run):
+        """
+        Move a queued run to in progress.
+        """
+        run["run"]["status"] = "in_progress"
+        run["run"]["started_at"] = int(time.time())
+
+    def _advance_run(self, run):
+        """
+        Move an in-progress run to its next state according to the script.
+
+        Returns:
+            dict: The assistant message added to the thread if the run completed, otherwise None
+        """
+        data = run["run"]
+        thread = self.state.threads[data["thread_id"]]
+        user_messages = [m for m in thread["messages"] if m["role"] == "user"]
+        message = _text_of(user_messages[-1]["content"]) if user_messages else ""
+        step = self.state.step(len(user_messages) - 1, run["steps"], message, data.get("instructions") or "")
+        tools = [t["function"]["name"] for t in run["tools"] if t.get("type") == "function"]
+        if tools and "tool_calls" in step:
+            calls = [{"id": _new_id("call_"), "type": "function",
+                      "function": {"name": _match_tool_name(call["name"], tools),
+                                   "arguments": json.dumps(call.get("arguments", {}))}}
+                     for call in step["tool_calls"]]
+            data["status"] = "requires_action"
+            data["required_action"] = {"type": "submit_tool_outputs", "submit_tool_outputs": {"tool_calls": calls}}
+            self.state.count("openai.assistants", tool_calls=len(calls))
+            return None
+        else:
+            message = self._thread_message(data["thread_id"], "assistant", step.get("text", "Done."),
+                                           run_id=data["id"], assistant_id=data["assistant_id"])
+            data["status"] = "completed"
+            data["required_action"] = None
+            data["completed_at"] = int(time.time())
+            prompt = json.dumps(thread["messages"]) + (data.get("instructions") or "")
+            input_tokens = estimate_tokens(prompt)
+            output_tokens = estimate_tokens(step.get("text", ""))
+            data["usage"] = {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                             "total_tokens": input_tokens + output_tokens}
+            self.state.count("openai.assistants", input_tokens=input_tokens, output_tokens=output_tokens)
+            return message
+
+    def _stream_run(self, run, created=False):
+        """
+        Stream a run as Assistants events until it needs tool outputs or completes.
+
+        Args:
+            run (dict): The run being streamed
+            created (bool): True for a new run, which is announced and queued first
+        """
+        self._start_stream()
+        data = run["run"]
+        if created:
+            self._send_event(dict(data), "thread.run.created")
+        if data["status"] == "queued":
+            self._send_event(dict(data), "thread.run.queued")
+            time.sleep(max(0.0, run["queued_until"] - time.time()))
+            self._start_run(run)
+        self._send_event(dict(data), f"thread.run.{data['status']}")
+        time.sleep(max(0.0, run["ready_at"] - time.time()))
+        message = self._advance_run(run)
+        if message is not None:
+            text = message["content"][0]["text"]["value"]
+            pending = dict(message, status="in_progress", content=[])
+            self._send_event(pending, "thread.message.created")
+            for word in self._words(text):
+                self._send_event({"id": message["id"], "object": "thread.message.delta",
+                                  "delta": {"content": [{"index": 0, "type": "text",
+                                                         "text": {"value": word, "annotations": []}}]}},
+                                 "thread.message.delta")
+            self._send_event(message, "thread.message.completed")
+        self._send_event(dict(data), f"thread.run.{data['status']}")
+        self._send_event("[DONE]", "done")
+        self._end_stream()
+
+    def create_run(self, body, thread_id):
+        assistant = self.state.assistants.get(body.get("assistant_id"), {})
+        data = {"id": _new_id("run_"), "object": "thread.run", "created_at": int(time.time()),
+                "assistant_id": body.get("assistant_id"), "thread_id": thread_id, "status": "queued",
+                "required_action": None, "last_error": None, "model": assistant.get("model", "gpt-4o-mini"),
+                "instructions": body.get("instructions") or assistant.get("instructions", ""),
+                "tools": assistant.get("tools", []), "metadata": {}, "usage": None,
+                "started_at": None, "completed_at": None, "cancelled_at": None, "failed_at": None,
+                "expires_at": None, "incomplete_details": None, "parallel_tool_calls": True,
+                "response_format": "auto", "tool_choice": "auto", "truncation_strategy": None}
+        queued_until = time.time() + self.state.delay("openai.queue")
+        run = {"run": data, "steps": 0, "tools": assistant.get("tools", []), "lock": threading.Lock(),
+               "queued_until": queued_until, "ready_at": queued_until + self.state.delay("openai.run")}
+        with self.state.lock:
+            self.state.runs[data["id"]] = run
+        if body.get("stream"):
+            with run["lock"]:
+                self._stream_run(run, created=True)
+        else:
+            self._send_json(dict(data))
+
+    def retrieve_run(self, body, thread_id, run_id):
+        run = self.state.runs[run_id]
+        with run["lock"]:
+            self._send_json(self._run_payload(run))
+
+    def submit_tool_outputs(self, body, thread_id, run_id):
+        run = self.state.runs[run_id]
+        with run["lock"]:
+            run["steps"] += 1
+            run["run"]["status"] = "in_progress"
+            run["run"]["required_action"] = None
+            run["ready_at"] = time.time() + self.state.delay("openai.run")
+            if body.get("stream"):
+                self._stream_run(run)
+            else:
+                self._send_json(dict(run["run"]))
+
+    ### Control endpoints ###
+    def get_stats(self, body):
+        with self.state.lock:
+            self._send_json(json.loads(json.dumps(self.state.stats)))
+
+    def reset_stats(self, body):
+        self.state.reset_stats()
+        self._send_json({"ok": True})
+
+
+class FakeServers:
+    def __init__(self, host="127.0.0.1", port=0, config=None, seed=None):
+        """
+        A fake OpenAI/Anthropic/Tavily server running on a background thread.
+
+        Args:
+            host (str): Interface to bind to
+            port (int): Port to listen on, 0 picks a free port
+            config (dict): Latency, error and script configuration
+            seed (int): Seed for reproducible latencies and errors
+        """
+        self.state = FakeState(config, seed=seed)
+        handler = type("BoundFakeHandler", (FakeHandler,), {"state": self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        """
+        Environment variables that point every agent module at this server.
+
+        Returns:
+            dict: Variable name to value
+        """
+        return {
+            "OPENAI_BASE_URL": f"{self.url}/v1",
+            "OPENAI_API_BASE": f"{self.url}/v1",  # read by Llama-Index and LiteLLM (CrewAI)
+            "ANTHROPIC_BASE_URL": self.url,
+            "TAVILY_BASE_URL": self.url,
+            "OPENAI_API_KEY": "fake-openai-key",
+            "ANTHROPIC_API_KEY": "fake-anthropic-key",
+            "TAVILY_API_KEY": "fake-tavily-key",
+            "LITELLM_LOCAL_MODEL_COST_MAP": "True",  # stop LiteLLM fetching its model list at import
+            "OTEL_SDK_DISABLED": "true",  # stop CrewAI sending telemetry
+        }
+
+    def stats(self):
+        with self.state.lock:
+            return json.loads(json.dumps(self.state.stats))
+
+    @property
+    def captured(self):
+        """
+        The captured request bodies, oldest first, as {"handler", "body"} dicts (see capture_requests).
+        """
+        with self.state.lock:
+            return list(self.state.captured)
+
+    def clear_captured(self):
+        with self.state.lock:
+            self.state.captured.clear()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    """
+    Start the fake server and print the environment variables that select it.
+    """
+    parser = argparse.ArgumentParser(description="Local stand-ins for the OpenAI, Anthropic and Tavily APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--config", help="JSON file with latency, errors and script sections")
+    parser.add_argument("--script", help="JSON file with a script, overrides the one in --config")
+    parser.add_argument("--latency", action="append", default=[], metavar="ENDPOINT=SPEC",
+                        help="e.g. anthropic.messages=lognormal:400:0.5 or tavily.search=uniform:100:300")
+    parser.add_argument("--error", action="append", default=[], metavar="ENDPOINT=SPEC",
+                        help="e.g. openai.chat=429:0.1 or tavily.search=timeout:0.05")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    config = {}
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+    if args.script:
+        with open(args.script) as f:
+            config["script"] = json.load(f)
+    for item in args.latency:
+        endpoint, spec = item.split("=", 1)
+        config.setdefault("latency", {})[endpoint] = parse_latency(spec)
+    for item in args.error:
+        endpoint, spec = item.split("=", 1)
+        config.setdefault("errors", {})[endpoint] = parse_error(spec)
+
+    servers = FakeServers(args.host, args.port, config, seed=args.seed)
+    print(f"Fake OpenAI/Anthropic/Tavily server listening on {servers.url}", file=sys.stderr)
+    print("Point the agents at it with:", file=sys.stderr)
+    for key, value in servers.env().items():
+        print(f"export {key}={value}")
+    try:
+        servers.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+import re
+import threading
+
+# Token-budgeted conversation history.
+#
+# Agents that resend their conversation on every call (the Anthropic agent) or paste it into the prompt
+# (the Langchain agent) would otherwise send a history that grows without bound. TokenBudgetHistory keeps the
+# token count of every message as it is added, so the size of the history is known without re-counting it.
+# When the budget is exceeded, it folds the oldest turns into a running summary. The most recent turns are
+# always kept verbatim.
+#
+# Tokens are counted with tiktoken when its encoding is available. Otherwise, for example offline, the
+# count is estimated at about four characters per token.
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _load_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    # tiktoken is missing or cannot fetch its encoding: fall back to the estimate for good
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+
+def tokenizer_name():
+    """
+    The name of the encoding count_tokens uses, or 'estimate' when it estimates.
+    """
+    encoding = _load_encoding()
+    return encoding.name if encoding is not None else "estimate"
+
+
+def count_tokens(text):
+    """
+    Count the tokens of a piece of text.
+
+    Args:
+        text (str): The text to count
+
+    Returns:
+        int: Its token count, exact if tiktoken's cl100k_base encoding can be loaded and estimated otherwise
+    """
+    encoding = _load_encoding()
+    text = str(text)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def extractive_summary(summary, messages, max_tokens):
+    """
+    Default summarizer: the first sentence of each message, appended to the running summary.
+    It needs no model call. Once the summary goes over max_tokens, its oldest lines are dropped.
+
+    Args:
+        summary (str): The running summary so far, possibly empty
+        messages (list): The messages being folded into the summary, as {"role", "content"} dicts
+        max_tokens (int): Budget for the summary
+
+    Returns:
+        str: The new summary
+    """
+    lines = summary.split("\n") if summary else []
+    for message in messages:
+        text = " ".join(str(message["content"]).split())
+        sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+        if len(sentence) > 200:
+            sentence = sentence[:197] + "..."
+        lines.append(f"{message['role']}: {sentence}")
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+class TokenBudgetHistory:
+    def __init__(self, max_tokens=4000, keep_messages=4, summary_tokens=500, summarizer=extractive_summary):
+        """
+        Initialize an empty history.
+
+        Args:
+            max_tokens (int): Budget for the history sent with each call, including the summary
+            keep_messages (int): Number of most recent messages that are never summarized
+            summary_tokens (int): Budget for the running summary
+            summarizer (callable): summarizer(summary, messages, max_tokens) -> new summary
+        """
+        self.max_tokens = max_tokens
+        self.keep_messages = keep_messages
+        self.summary_tokens = summary_tokens
+        self.summarizer = summarizer
+        self.clear()
+
+    def clear(self):
+        """
+        Forget the whole conversation, including the summary and the metrics.
+        """
+        self.messages = []
+        self._tokens = []          # token count of each message, kept in step with self.messages
+        self._lines = []           # "role: content" rendering of each message, for as_text
+        self.message_tokens = 0    # tokens of the messages currently kept
+        self.summary = ""
+        self.summary_tokens_used = 0
+        self.total_tokens = 0      # tokens of every message ever added, i.e. the unmanaged history size
+        self.summarized_messages = 0
+        self._text = None
+        self.turn_metrics = []
+
+    @property
+    def tokens(self):
+        """
+        Tokens of the history as it is sent: the kept messages plus the summary.
+        """
+        return self.message_tokens + self.summary_tokens_used
+
+    def add(self, role, content):
+        """
+        Append a message. Its tokens are counted once, here.
+
+        Args:
+            role (str): 'user' or 'assistant'
+            content (str): The message text
+        """
+        tokens = count_tokens(content)
+        line = f"{role}: {content}"
+        self.messages.append({"role": role, "content": content})
+        self._tokens.append(tokens)
+        self._lines.append(line)
+        self.message_tokens += tokens
+        self.total_tokens += tokens
+        if self._text is not None:
+            self._text = f"{self._text}\n{line}" if self._text else line
+
+    def compact(self):
+        """
+        Bring the history back under its budget by folding the oldest messages into the summary.
+        Each fold runs up to the next user message, so the kept history still starts with a user message even
+        when a turn left no assistant reply. The last user message is never folded.
+        Call it once per turn, before the history is sent. It records the turn's metrics.
+
+        Returns:
+            dict: The turn's metrics (see turn_metrics)
+        """
+        count = 0
+        if self.tokens > self.max_tokens:
+            # The summary is rewritten after folding and can grow up to summary_tokens, so that much is kept free
+            # for it: fold until the kept messages and a full summary fit the budget
+            tokens = self.message_tokens + max(self.summary_tokens, self.summary_tokens_used)
+            while tokens > self.max_tokens:
+                end = count + 1
+                while end < len(self.messages) and self.messages[end]["role"] != "user":
+                    end += 1
+                if end >= len(self.messages) or len(self.messages) - end < self.keep_messages:
+                    break
+                tokens -= sum(self._tokens[count:end])
+                count = end
+        folded = self.messages[:count]
+        if folded:
+            self.message_tokens -= sum(self._tokens[:count])
+            del self.messages[:count], self._tokens[:count], self._lines[:count]
+            self.summary = self.summarizer(self.summary, folded, self.summary_tokens)
+            self.summary_tokens_used = count_tokens(self.summary) if self.summary else 0
+            self.summarized_messages += count
+            self._text = None
+        metrics = {
+            "history_tokens": self.total_tokens,
+            "sent_tokens": self.tokens,
+            "tokens_saved": self.total_tokens - self.tokens,
+            "summarized_messages": self.summarized_messages,
+        }
+        self.turn_metrics.append(metrics)
+        return metrics
+
+    def pop(self):
+        """
+        Remove the last message, for example the user message of a turn that failed, so the history does
+        not end up with two user messages in a row.
+
+        Returns:
+            dict: The removed {"role", "content"} message, or None if the kept history is empty
+        """
+        if not self.messages:
+            return None
+        tokens = self._tokens.pop()
+        self._lines.pop()
+        self.message_tokens -= tokens
+        self.total_tokens -= tokens
+        self._text = None
+        return self.messages.pop()
+
+    @property
+    def last_metrics(self):
+        """
+        Metrics of the most recent turn, or None before the first one.
+        """
+        return self.turn_metrics[-1] if self.turn_metrics else None
+
+    def as_text(self):
+        """
+        Render the history as text for inclusion in a prompt. The summary, if any, comes first.
+        The rendering is extended as messages are added and only rebuilt after a compaction.
+
+        Returns:
+            str: A string of the form:
+                user: hello
+                assistant: hello, how may I help you?
+        """
+        if self._text is None:
+            self._text = "\n".join(self._lines)
+        if self.summary:
+            return f"Summary of the earlier conversation:\n{self.summary}\n{self._text}"
+        return self._text
+
+
+def check():
+    """
+    Regression checks for compact, run by `python history.py`.
+
+    Returns:
+        list: A description of every check that failed, empty if all passed
+    """
+    failures = []
+
+    # A history just over its budget folds only the oldest turns, not all but the last keep_messages, and is
+    # sent within its budget once the summary is written
+    history = TokenBudgetHistory(keep_messages=4, summary_tokens=100)
+    for turn in range(10):
+        history.add("user", f"Question {turn}. " + "word " * 40)
+        history.add("assistant", f"Answer {turn}. " + "word " * 40)
+    history.add("user", "A last question. " + "word " * 40)
+    history.max_tokens = history.tokens - 20
+    before = len(history.messages)
+    metrics = history.compact()
+    folded = before - len(history.messages)
+    if folded > 4 or metrics["sent_tokens"] > history.max_tokens:
+        failures.append(f"just over budget: folded {folded} of {before} messages, sent {metrics['sent_tokens']} "
+                        f"tokens against a budget of {history.max_tokens}")
+
+    # Turn after turn, the history is sent within its budget, summary included
+    history = TokenBudgetHistory(max_tokens=600, keep_messages=2, summary_tokens=150)
+    for turn in range(30):
+        history.add("user", f"Question {turn} about renting or buying a home in a city. " + "word " * 30)
+        metrics = history.compact()
+        if metrics["sent_tokens"] > history.max_tokens:
+            failures.append(f"turn {turn}: sent {metrics['sent_tokens']} tokens against a budget of "
+                            f"{history.max_tokens}")
+            break
+        history.add("assistant", f"Answer {turn}, weighing the costs and the risks. " + "word " * 30)
+
+    # A turn without an assistant reply does not shift what is folded, and the kept history starts with a user
+    history = TokenBudgetHistory(max_tokens=300, keep_messages=2, summary_tokens=50)
+    for turn in range(6):
+        history.add("user", f"Question {turn}. " + "word " * 30)
+        if turn != 2:
+            history.add("assistant", f"Answer {turn}. " + "word " * 30)
+        history.compact()
+        if history.messages[0]["role"] != "user":
+            failures.append(f"turn {turn}: the kept history starts with {history.messages[0]['role']}")
+            break
+
+    # A failed turn's user message can be taken back, leaving the counts as they were
+    history = TokenBudgetHistory()
+    history.add("user", "hello")
+    history.add("assistant", "hello, how may I help you?")
+    tokens, text = history.tokens, history.as_text()
+    history.add("user", "this turn fails")
+    history.pop()
+    if history.tokens != tokens or history.as_text() != text or history.total_tokens != tokens:
+        failures.append("pop: the history is not as it was before the failed turn")
+    return failures
+
+
+def main():
+    """
+    Run the regression checks and exit with status 1 if any fails.
+    """
+    import sys
+
+    failures = check()
+    for failure in failures:
+        print(f"FAILED {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+    print("history checks passed")
+
+
+if __name__ == "__main__":
+    main()
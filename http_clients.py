@@ -0,0 +1,542 @@
+import os
+import json
+import time
+import asyncio
+import weakref
+import threading
+import concurrent.futures
+
+import httpx
+from dotenv import load_dotenv
+from tavily import TavilyClient
+from tavily.errors import UsageLimitExceededError, InvalidAPIKeyError
+
+import tracing
+import cassettes
+
+# Shared HTTP layer for every agent module.
+#
+# Each provider (OpenAI, Anthropic, Tavily) gets one process-wide httpx client with a keep-alive connection
+# pool of its own, so connections (and their TLS sessions) are reused across agents, sessions and threads
+# instead of being opened for every Agent() or every search. The OpenAI and Anthropic SDKs, the frameworks
+# built on them and the Tavily client are all handed these clients.
+#
+# httpx clients are safe to share between threads. Async connections belong to the event loop that opened
+# them, so the async clients keep a separate pool per event loop behind a single client object.
+#
+# Every pool is metered: requests, in-flight and peak in-flight requests, how often a request found the pool
+# already fully busy (saturation), connections and TLS handshakes opened, and errors. See pool_stats().
+# When tracing is on (see tracing.py), every request is also recorded as a span, with the token usage of
+# LLM responses.
+# With CASSETTE_MODE set, requests are recorded to, or answered from, a cassette file (see cassettes.py).
+#
+# Configuration, through environment variables:
+#   HTTP_POOL_SIZE_OPENAI, HTTP_POOL_SIZE_ANTHROPIC, HTTP_POOL_SIZE_TAVILY   Connections per provider
+#   HTTP_KEEPALIVE_EXPIRY   Seconds an idle connection is kept open (default 60)
+#   HTTP2                   Set to 1 to negotiate HTTP/2 (needs the h2 package; ignored without it)
+
+load_dotenv()
+
+# Base URL of each provider; the same environment variables also point the SDKs at fake_servers.py
+PROVIDERS = {
+    "openai": ("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+    "anthropic": ("ANTHROPIC_BASE_URL", "https://api.anthropic.com"),
+    "tavily": ("TAVILY_BASE_URL", "https://api.tavily.com"),
+}
+
+DEFAULT_POOL_SIZES = {"openai": 64, "anthropic": 64, "tavily": 16}
+
+# Providers whose requests are traced as LLM calls
+LLM_PROVIDERS = ("openai", "anthropic")
+
+
+def base_url(provider):
+    """
+    The base URL requests to a provider go to.
+    """
+    env_var, default = PROVIDERS[provider]
+    return os.getenv(env_var) or default
+
+
+def pool_size(provider):
+    """
+    Number of connections in a provider's pool.
+    """
+    return int(os.getenv(f"HTTP_POOL_SIZE_{provider.upper()}", str(DEFAULT_POOL_SIZES[provider])))
+
+
+def http2_enabled():
+    """
+    Whether HTTP/2 was requested and can be used.
+    """
+    if os.getenv("HTTP2", "0") != "1":
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print("HTTP2=1 but the h2 package is not installed, using HTTP/1.1")
+        return False
+    return True
+
+
+def _limits(provider):
+    size = pool_size(provider)
+    return httpx.Limits(max_connections=size, max_keepalive_connections=size,
+                        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60")))
+
+
+class PoolMetrics:
+    def __init__(self, provider, size):
+        """
+        Counters of one provider's connection pool.
+
+        Args:
+            provider (str): The provider name
+            size (int): Number of connections in the pool
+        """
+        self.provider = provider
+        self.size = size
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "errors": 0, "in_flight": 0, "peak_in_flight": 0, "saturated": 0,
+                         "connections_opened": 0, "tls_handshakes": 0, "seconds": 0.0}
+
+    def started(self):
+        with self._lock:
+            if self.counters["in_flight"] >= self.size:
+                # Every connection is busy, so this request waits for one to free up
+                self.counters["saturated"] += 1
+            self.counters["requests"] += 1
+            self.counters["in_flight"] += 1
+            self.counters["peak_in_flight"] = max(self.counters["peak_in_flight"], self.counters["in_flight"])
+        return time.perf_counter()
+
+    def finished(self, start, error=False):
+        with self._lock:
+            self.counters["in_flight"] -= 1
+            self.counters["seconds"] += time.perf_counter() - start
+            if error:
+                self.counters["errors"] += 1
+
+    def traced(self, event):
+        """
+        Count connection set-up events reported by httpcore's trace extension.
+        """
+        if event == "connection.connect_tcp.complete":
+            with self._lock:
+                self.counters["connections_opened"] += 1
+        elif event == "connection.start_tls.complete":
+            with self._lock:
+                self.counters["tls_handshakes"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats["pool_size"] = self.size
+        stats["saturation_rate"] = stats["saturated"] / stats["requests"] if stats["requests"] else 0.0
+        stats["reuse_rate"] = 1 - stats["connections_opened"] / stats["requests"] if stats["requests"] else 0.0
+        return stats
+
+
+def _start_request_span(provider, request):
+    """
+    Start the trace span of a request, or return None while tracing is off.
+    """
+    if not tracing.enabled():
+        return None
+    kind = "llm" if provider in LLM_PROVIDERS else "http"
+    current = tracing.start_span(f"{provider} {request.method} {request.url.path}", kind, provider=provider)
+    try:
+        body = request.content
+    except httpx.RequestNotRead:
+        body = b""
+    current.set(request_bytes=len(body))
+    if kind == "llm" and body:
+        try:
+            current.set(model=json.loads(body).get("model"))
+        except (ValueError, AttributeError):
+            pass
+    return current
+
+
+def _end_request_span(current, response, chunks, error=None):
+    """
+    Finish the trace span of a request with its status, size and, for LLM calls, token usage.
+    """
+    if current is None:
+        return
+    if response is not None:
+        body = b"".join(chunks)
+        current.set(status_code=response.status_code, response_bytes=len(body))
+        if current.kind == "llm":
+            current.set(**tracing.parse_usage(body, response.headers.get("content-type", "")))
+    current.end(error)
+
+
+class _MeteredStream(httpx.SyncByteStream):
+    """
+    Response body that reports the request as finished once the body has been read and closed.
+    Streamed responses (server-sent events) hold their connection until then.
+    While the request is traced, the body is also collected for its token usage.
+    """
+
+    def __init__(self, stream, on_close, chunks=None):
+        self._stream = stream
+        self._on_close = on_close
+        self._chunks = chunks
+
+    def __iter__(self):
+        for chunk in self._stream:
+            if self._chunks is not None:
+                self._chunks.append(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if self._on_close is not None:
+                self._on_close()
+                self._on_close = None
+
+
+class _MeteredAsyncStream(httpx.AsyncByteStream):
+    """
+    Async version of _MeteredStream.
+    """
+
+    def __init__(self, stream, on_close, chunks=None):
+        self._stream = stream
+        self._on_close = on_close
+        self._chunks = chunks
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            if self._chunks is not None:
+                self._chunks.append(chunk)
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                self._on_close()
+                self._on_close = None
+
+
+class MeteredTransport(httpx.BaseTransport):
+    def __init__(self, metrics, **kwargs):
+        """
+        An httpx.HTTPTransport that reports to a PoolMetrics.
+
+        Args:
+            metrics (PoolMetrics): Where to report
+            **kwargs: Passed to httpx.HTTPTransport (limits, http2, ...)
+        """
+        self.metrics = metrics
+        self._transport = httpx.HTTPTransport(**kwargs)
+
+    def handle_request(self, request):
+        def trace(event, info):
+            self.metrics.traced(event)
+
+        request.extensions = dict(request.extensions, trace=trace)
+        current = _start_request_span(self.metrics.provider, request)
+        start = self.metrics.started()
+        try:
+            response = cassettes.handle_request(self.metrics.provider, request, self._transport)
+        except Exception as e:
+            self.metrics.finished(start, error=True)
+            _end_request_span(current, None, None, e)
+            raise
+        chunks = [] if current is not None else None
+
+        def on_close():
+            self.metrics.finished(start)
+            _end_request_span(current, response, chunks)
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_MeteredStream(response.stream, on_close, chunks),
+            extensions=response.extensions,
+        )
+
+    def close(self):
+        self._transport.close()
+
+
+class LoopLocalAsyncTransport(httpx.AsyncBaseTransport):
+    def __init__(self, metrics, **kwargs):
+        """
+        An async transport with one httpx.AsyncHTTPTransport per event loop, reporting to a PoolMetrics.
+        A single AsyncClient built on it can be used from any loop (the server's, async_runtime's
+        background loop, a test's asyncio.run) without handing a connection to the wrong loop.
+
+        Args:
+            metrics (PoolMetrics): Where to report
+            **kwargs: Passed to httpx.AsyncHTTPTransport (limits, http2, ...)
+        """
+        self.metrics = metrics
+        self._kwargs = kwargs
+        self._transports = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _transport(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = self._transports[loop] = httpx.AsyncHTTPTransport(**self._kwargs)
+            return transport
+
+    async def handle_async_request(self, request):
+        async def trace(event, info):
+            self.metrics.traced(event)
+
+        request.extensions = dict(request.extensions, trace=trace)
+        current = _start_request_span(self.metrics.provider, request)
+        start = self.metrics.started()
+        try:
+            response = await cassettes.ahandle_request(self.metrics.provider, request, self._transport())
+        except Exception as e:
+            self.metrics.finished(start, error=True)
+            _end_request_span(current, None, None, e)
+            raise
+        chunks = [] if current is not None else None
+
+        def on_close():
+            self.metrics.finished(start)
+            _end_request_span(current, response, chunks)
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_MeteredAsyncStream(response.stream, on_close, chunks),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.pop(loop, None)
+        if transport is not None:
+            await transport.aclose()
+
+
+_lock = threading.Lock()
+_metrics = {}
+_clients = {}
+_async_clients = {}
+
+
+def _pool_metrics(provider):
+    if provider not in _metrics:
+        _metrics[provider] = PoolMetrics(provider, pool_size(provider))
+    return _metrics[provider]
+
+
+def get_http_client(provider):
+    """
+    The shared httpx.Client of a provider, created on first use.
+
+    Args:
+        provider (str): 'openai', 'anthropic' or 'tavily'
+
+    Returns:
+        httpx.Client: A client safe to share between threads
+    """
+    with _lock:
+        client = _clients.get(provider)
+        if client is None:
+            transport = MeteredTransport(_pool_metrics(provider), limits=_limits(provider), http2=http2_enabled())
+            client = _clients[provider] = httpx.Client(transport=transport, timeout=httpx.Timeout(600, connect=10))
+        return client
+
+
+def get_async_http_client(provider):
+    """
+    The shared httpx.AsyncClient of a provider, created on first use. Its pool is kept per event loop.
+
+    Args:
+        provider (str): 'openai', 'anthropic' or 'tavily'
+
+    Returns:
+        httpx.AsyncClient: A client usable from any event loop
+    """
+    with _lock:
+        client = _async_clients.get(provider)
+        if client is None:
+            transport = LoopLocalAsyncTransport(_pool_metrics(provider), limits=_limits(provider),
+                                                http2=http2_enabled())
+            client = _async_clients[provider] = httpx.AsyncClient(transport=transport,
+                                                                  timeout=httpx.Timeout(600, connect=10))
+        return client
+
+
+### SDK clients on the shared pools ###
+def openai_client(**kwargs):
+    """
+    An openai.OpenAI client using the shared OpenAI pool.
+    """
+    import openai
+    return openai.OpenAI(http_client=get_http_client("openai"), **kwargs)
+
+
+def async_openai_client(**kwargs):
+    """
+    An openai.AsyncOpenAI client using the shared OpenAI pool.
+    """
+    import openai
+    return openai.AsyncOpenAI(http_client=get_async_http_client("openai"), **kwargs)
+
+
+def anthropic_client(**kwargs):
+    """
+    An anthropic.Anthropic client using the shared Anthropic pool.
+    """
+    import anthropic
+    return anthropic.Anthropic(http_client=get_http_client("anthropic"), **kwargs)
+
+
+def async_anthropic_client(**kwargs):
+    """
+    An anthropic.AsyncAnthropic client using the shared Anthropic pool.
+    """
+    import anthropic
+    return anthropic.AsyncAnthropic(http_client=get_async_http_client("anthropic"), **kwargs)
+
+
+class PooledTavilyClient(TavilyClient):
+    """
+    TavilyClient whose requests go through the shared Tavily pool instead of a new connection per search.
+    It also offers asearch, a native async search.
+    """
+
+    def __init__(self, api_key=None):
+        super().__init__(api_key=api_key)
+        self.base_url = base_url("tavily")
+
+    def _request_data(self, query, search_depth="basic", topic="general", days=3, max_results=5,
+                      include_domains=None, exclude_domains=None, include_answer=False,
+                      include_raw_content=False, include_images=False, **kwargs):
+        data = {
+            "query": query,
+            "search_depth": search_depth,
+            "topic": topic,
+            "days": days,
+            "include_answer": include_answer,
+            "include_raw_content": include_raw_content,
+            "max_results": max_results,
+            "include_domains": include_domains,
+            "exclude_domains": exclude_domains,
+            "include_images": include_images,
+        }
+        data.update(kwargs)
+        return data
+
+    @staticmethod
+    def _handle_response(response):
+        # Same error handling as TavilyClient
+        if response.status_code == 200:
+            return response.json()
+        elif response.status_code == 429:
+            detail = 'Too many requests.'
+            try:
+                detail = response.json()['detail']['error']
+            except Exception:
+                pass
+            raise UsageLimitExceededError(detail)
+        elif response.status_code == 401:
+            raise InvalidAPIKeyError()
+        response.raise_for_status()
+
+    def _search(self, query, **kwargs):
+        response = get_http_client("tavily").post(self.base_url + "/search", json=self._request_data(query, **kwargs),
+                                                  headers=self.headers, timeout=100)
+        return self._handle_response(response)
+
+    async def asearch(self, query, **kwargs):
+        """
+        Async version of search.
+        """
+        response = await get_async_http_client("tavily").post(self.base_url + "/search",
+                                                              json=self._request_data(query, **kwargs),
+                                                              headers=self.headers, timeout=100)
+        response_dict = self._handle_response(response)
+        response_dict["results"] = response_dict.get("results", [])
+        return response_dict
+
+
+_tavily_clients = {}
+
+
+def shared_tavily_client(api_key=None):
+    """
+    The process-wide Tavily client for an API key.
+
+    Args:
+        api_key (str): Tavily API key, defaults to TAVILY_API_KEY
+
+    Returns:
+        PooledTavilyClient: The shared client
+    """
+    api_key = api_key or os.getenv("TAVILY_API_KEY")
+    with _lock:
+        if api_key not in _tavily_clients:
+            _tavily_clients[api_key] = PooledTavilyClient(api_key=api_key)
+        return _tavily_clients[api_key]
+
+
+def tavily_client():
+    """
+    The Tavily client the agents search with: the shared client for TAVILY_API_KEY, created on the first
+    search. TAVILY_BASE_URL can point it elsewhere.
+    """
+    return shared_tavily_client(os.getenv("TAVILY_API_KEY"))
+
+
+### Warm-up and metrics ###
+def warm_up(providers=None, connections=1, timeout=5):
+    """
+    Open connections to the providers ahead of the first real request, so that its latency does not
+    include DNS, TCP and TLS set-up. Failures are ignored: the connection is opened all the same, and the
+    providers answer a bare request with an error status.
+
+    Args:
+        providers (list): Providers to warm up, defaults to all of them
+        connections (int): Connections to open per provider
+        timeout (float): Seconds to wait for each request
+
+    Returns:
+        dict: Provider -> seconds taken, or None if it could not be reached
+    """
+    providers = list(providers or PROVIDERS)
+
+    def touch(provider):
+        start = time.perf_counter()
+        try:
+            get_http_client(provider).head(base_url(provider), timeout=timeout)
+        except httpx.HTTPError:
+            return provider, None
+        return provider, time.perf_counter() - start
+
+    jobs = [provider for provider in providers for _ in range(connections)]
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(jobs) or 1) as executor:
+        for provider, seconds in executor.map(touch, jobs):
+            if results.get(provider) is None:
+                results[provider] = seconds
+    return results
+
+
+def pool_stats():
+    """
+    Metrics of every pool created so far.
+
+    Returns:
+        dict: Provider -> counters
+    """
+    with _lock:
+        metrics = list(_metrics.values())
+    return {m.provider: m.stats() for m in metrics}
@@ -1,54 +1,195 @@
 import os
-from dotenv import load_dotenv
-from datetime import date
-from tavily import TavilyClient
+import sys
 import json
+import time
+import hashlib
+import queue
+import functools
+import threading
+import contextvars
+from datetime import date
+from history import TokenBudgetHistory
+from prompts import goal, stage_knowledge, StageTracker, langchain_react_prompt, prompt_date, dated_role, dated_instructions
+from tracing import traced_turn, traced_tool
+
+# Langchain, the HTTP layer and the search modules are imported on first use, and the agent executor is built
+# with the first message, so importing this module and creating an Agent stay cheap (see
+# benchmarks/cold_start.py). http_clients loads the .env file when it is first imported, before any API key
+# is read.
 
-# Langchain imports
-from langchain import hub
-from langchain.agents import AgentExecutor, create_react_agent
-from langchain_core.tools import Tool
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from prompts import role, goal, instructions, knowledge, langchain_react_prompt
+# Display name of this agent. agent-ui.py reads it without importing the module (see agent_discovery.py)
+AGENT_NAME = "Langchain Agent"
 
-# Load environment variables
-load_dotenv()
+# The agent is built on the ReAct prompt hwchase17/react of the LangChain hub, of which it takes the input
+# variables. A copy pinned to the version last pulled is kept in react_prompt.json and read once per process,
+# so building the agent needs no network. `python langchain_agent.py --refresh-react-prompt` pulls the prompt
+# from the hub again and rewrites the file; review the diff before committing it.
+REACT_PROMPT_REF = "hwchase17/react"
+REACT_PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "react_prompt.json")
 
-# Initialize Tavily client
-tavily_api_key = os.getenv("TAVILY_API_KEY")
-tavily_client = TavilyClient(api_key=tavily_api_key)
 
+@functools.lru_cache(maxsize=None)
+def react_prompt(path=REACT_PROMPT_PATH):
+    """
+    The pinned copy of the ReAct prompt, read once per process.
+
+    Args:
+        path (str): The JSON file written by refresh_react_prompt
 
+    Returns:
+        dict: The hub ref and commit it was pulled at, its input_variables and template
+    """
+    with open(path, encoding="utf-8") as source:
+        prompt = json.load(source)
+    digest = hashlib.sha256(prompt["template"].encode("utf-8")).hexdigest()
+    if digest != prompt["template_sha256"]:
+        raise ValueError(f"{path} was edited by hand: its template no longer matches template_sha256. "
+                         f"Run `python langchain_agent.py --refresh-react-prompt` to restore it.")
+    return prompt
+
+
+def refresh_react_prompt(ref=REACT_PROMPT_REF, path=REACT_PROMPT_PATH):
+    """
+    Pull the ReAct prompt from the LangChain hub and replace the pinned copy with it.
+
+    Args:
+        ref (str): The hub prompt, optionally with ':commit'
+        path (str): The JSON file to write
+
+    Returns:
+        dict: The new pinned copy
+    """
+    from langchain import hub
+
+    pulled = hub.pull(ref)
+    prompt = {
+        "ref": ref.split(":")[0],
+        "commit": (pulled.metadata or {}).get("lc_hub_commit_hash"),
+        "input_variables": sorted(pulled.input_variables),
+        "template": pulled.template,
+        "template_sha256": hashlib.sha256(pulled.template.encode("utf-8")).hexdigest(),
+    }
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as target:
+        json.dump(prompt, target, indent=2)
+        target.write("\n")
+    os.replace(temporary, path)
+    react_prompt.cache_clear()
+    return prompt
+
+
+@functools.lru_cache(maxsize=None)
+def final_answer_streamer_class():
+    """
+    Define FinalAnswerStreamer on first use, since it derives from a langchain class.
+    """
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class FinalAnswerStreamer(BaseCallbackHandler):
+        """
+        Callback handler that forwards the tokens of the ReAct agent's final answer to a queue.
+        Everything the LLM writes before "Final Answer:" (thoughts, actions) is held back.
+        """
+
+        def __init__(self, tokens):
+            self.tokens = tokens
+            self.buffer = ""
+            self.answering = False
+
+        def on_chat_model_start(self, serialized, messages, **kwargs):
+            self.buffer = ""
+            self.answering = False
+
+        def on_llm_new_token(self, token, **kwargs):
+            if not self.answering:
+                self.buffer += token
+                marker = self.buffer.find("Final Answer:")
+                if marker == -1:
+                    return
+                self.answering = True
+                token = self.buffer[marker + len("Final Answer:"):]
+                self.buffer = ""
+            if not self.buffer:
+                # Drop the whitespace between "Final Answer:" and the answer itself
+                token = token.lstrip()
+            if token:
+                self.buffer += token
+                self.tokens.put(token)
+
+    return FinalAnswerStreamer
 
 
 class Agent:
-    def __init__(self, model="gpt-4o-mini"):
+    def __init__(self, model="gpt-4o-mini", history_tokens=4000):
         """
         Initialize the Langchain agent.
 
         Args:
             model (str): The language model to use
+            history_tokens (int): Token budget for the conversation history pasted into the prompt
+        """
+        self.name = AGENT_NAME
+        self.model = model
+        # Built with the first message, and again when the date or decision stage in its prompt changes,
+        # see agent_executor
+        self._agent_executor = None
+        self._prompt_date = None
+        self._prompt_stage = None
+        self.stage_tracker = StageTracker()
+        self.last_turn_failed = False
+
+        # Conversation history. Older turns are folded into a running summary once it goes over its budget
+        self.history = TokenBudgetHistory(max_tokens=history_tokens)
+
+    @property
+    def agent_executor(self):
+        """
+        The agent executor, built on first use and rebuilt when the date (see prompts.prompt_date) or the
+        decision stage (see prompts.stage_knowledge) changes.
+        """
+        day, stage = prompt_date(), self.stage_tracker.stage
+        if self._agent_executor is None or day != self._prompt_date or stage != self._prompt_stage:
+            self._agent_executor = self._create_agent_executor(day, stage)
+            self._prompt_date = day
+            self._prompt_stage = stage
+        return self._agent_executor
+
+    def _create_agent_executor(self, day=None, stage=None):
         """
-        self.name = "Langchain Agent"
+        Build the tools, prompt, language model and ReAct agent, and wrap them in an executor.
+
+        Args:
+            day (datetime.date): The date to write into the prompt, or None to have the model look it up
+            stage (int): The decision stage whose knowledge goes into the prompt, or None for all of it
+        """
+        from langchain.agents import AgentExecutor, create_react_agent
+        from langchain_openai import ChatOpenAI
+        from langchain.prompts import PromptTemplate
+        from http_clients import get_http_client, get_async_http_client
+
         # Create tools
         self.tools = self._create_tools()
 
-        # Pull the ReAct prompt template
-        base_react_prompt = hub.pull("hwchase17/react")
-        base_input_variables = base_react_prompt.input_variables
+        # The input variables of the pinned ReAct prompt
+        base_input_variables = react_prompt()["input_variables"]
         # Modify the prompt with additional instructions
         new_prompt = PromptTemplate(
             input_variables=base_input_variables,
-            template="\n".join([role, goal, instructions, knowledge, langchain_react_prompt])
+            template="\n".join([dated_role(day), goal, dated_instructions(day), stage_knowledge(stage),
+                                langchain_react_prompt])
         )
         self.prompt = new_prompt
 
         # Initialize the language model
         self.llm = ChatOpenAI(
             api_key=os.getenv("OPENAI_API_KEY"),
-            model=model,
-            temperature=0
+            model=self.model,
+            temperature=0,
+            # Report token usage on streamed responses too (see tracing.py)
+            stream_usage=True,
+            # Use the process-wide OpenAI connection pool
+            http_client=get_http_client("openai"),
+            http_async_client=get_async_http_client("openai")
         )
 
         # Create the agent and executor
@@ -59,16 +200,21 @@ class Agent:
             stop_sequence=True,
         )
 
-        self.agent_executor = AgentExecutor.from_agent_and_tools(
+        return AgentExecutor.from_agent_and_tools(
             agent=self.agent,
             tools=self.tools,
             verbose=False  # Set to True for debugging
         )
 
-        # Conversation history (optional, for consistency with other agents)
-        self.messages = []
+    @property
+    def messages(self):
+        """
+        The turns of the conversation the history budget has kept.
+        """
+        return self.history.messages
 
     @staticmethod
+    @traced_tool("date")
     def date_tool(tool_input={}):  # Accepts anything since some frameworks must pass something.
         """
         Function to get the current date.
@@ -77,16 +223,24 @@ class Agent:
         return today.strftime("%B %d, %Y")
 
     @staticmethod
+    @traced_tool("web_search")
     def web_search(query):
         """
         This function searches the web for the given query and returns the results.
         """
-        # Call Tavily's search and dump the results as a JSON string
-        search_response = tavily_client.search(query)
-        results = json.dumps(search_response.get('results', []))
-        print(f"Web Search Results for '{query}':")
-        print(results)
-        return results
+        from search_compaction import search
+
+        return search(query)
+
+    @staticmethod
+    @traced_tool("web_search")
+    async def aweb_search(query):
+        """
+        Async version of web_search.
+        """
+        from search_compaction import asearch
+
+        return await asearch(query)
 
     def _create_tools(self):
         """
@@ -95,6 +249,8 @@ class Agent:
         Returns:
             List of tools
         """
+        from langchain_core.tools import Tool
+
         return [
             Tool(
                 name="date",
@@ -104,6 +260,7 @@ class Agent:
             Tool(
                 name="web_search",
                 func=self.web_search,
+                coroutine=self.aweb_search,
                 description="Useful for searching the web for information"
             )
         ]
@@ -111,15 +268,19 @@ class Agent:
     def _messages_to_str(self):
         """
         Convert the messages history into a readable string for inclusion in the prompt.
+        The history is first brought within its token budget. The string is maintained incrementally by
+        the history rather than rebuilt from every message on each turn.
 
         Returns:
             A string of the form:
                 user: hello
                 assistant: hello, how may I help you?
         """
-        return "\n".join([f"{msg['role']}: {msg['content']}" for msg in self.messages])
+        self.history.compact()
+        return self.history.as_text()
 
 
+    @traced_turn
     def chat(self, message):
         """
         Send a message and get a response.
@@ -131,6 +292,8 @@ class Agent:
             str: Assistant's response
         """
         try:
+            self.last_turn_failed = False
+            self.stage_tracker.observe(message)
             # Invoke the agent with the message
             response = self.agent_executor.invoke(
                 {"input": message, "chat_history": self._messages_to_str()}
@@ -138,15 +301,107 @@ class Agent:
             # Extract the output
             assistant_response = response.get('output', 'Sorry, I could not process your request.')
             # Optionally, maintain conversation history
-            self.messages.append({"role": "user", "content": message})
-            self.messages.append({"role": "assistant", "content": assistant_response})
+            self.history.add("user", message)
+            self.history.add("assistant", assistant_response)
 
             return assistant_response
 
         except Exception as e:
             print(f"Error in chat: {e}")
+            self.last_turn_failed = True
             return "Sorry, I encountered an error processing your request."
 
+    @traced_turn
+    async def achat(self, message):
+        """
+        Send a message and get a response, without blocking the event loop.
+
+        Args:
+            message (str): User's input message
+
+        Returns:
+            str: Assistant's response
+        """
+        try:
+            self.last_turn_failed = False
+            self.stage_tracker.observe(message)
+            response = await self.agent_executor.ainvoke(
+                {"input": message, "chat_history": self._messages_to_str()}
+            )
+            assistant_response = response.get('output', 'Sorry, I could not process your request.')
+            self.history.add("user", message)
+            self.history.add("assistant", assistant_response)
+
+            return assistant_response
+
+        except Exception as e:
+            print(f"Error in chat: {e}")
+            self.last_turn_failed = True
+            return "Sorry, I encountered an error processing your request."
+
+    @traced_turn
+    def stream_chat(self, message):
+        """
+        Send a message and stream the final answer as it is generated.
+        The agent executor runs on a worker thread; tokens reach this generator through a queue.
+
+        Args:
+            message (str): User's input message
+
+        Yields:
+            str: Chunks of the assistant's response
+        """
+        tokens = queue.Queue()
+        done = object()
+        result = {}
+        FinalAnswerStreamer = final_answer_streamer_class()
+        self.last_turn_failed = False
+        self.stage_tracker.observe(message)
+
+        def run():
+            try:
+                result["response"] = self.agent_executor.invoke(
+                    {"input": message, "chat_history": self._messages_to_str()},
+                    config={"callbacks": [FinalAnswerStreamer(tokens)]}
+                )
+            except Exception as e:
+                result["error"] = e
+            finally:
+                tokens.put(done)
+
+        # The worker runs in a copy of this context, so its trace spans are nested under the turn
+        threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True).start()
+        streamed = False
+        while (token := tokens.get()) is not done:
+            streamed = True
+            yield token
+
+        if "error" in result:
+            print(f"Error in chat: {result['error']}")
+            self.last_turn_failed = True
+            yield "Sorry, I encountered an error processing your request."
+            return
+
+        assistant_response = result["response"].get('output', 'Sorry, I could not process your request.')
+        if not streamed:
+            # The answer did not come through the ReAct format (e.g. a parsing fallback)
+            yield assistant_response
+        self.history.add("user", message)
+        self.history.add("assistant", assistant_response)
+
+    def remember_turn(self, message, response):
+        """
+        Add a turn answered without the model (see response_cache.py) to the conversation, as if chat had
+        answered it.
+
+        Args:
+            message (str): User's input message
+            response (str): Assistant's response
+        """
+        self.stage_tracker.observe(message)
+        self.history.add("user", message)
+        self.history.add("assistant", response)
+
     def clear_chat(self):
         """
         Reset the conversation context.
@@ -155,7 +410,8 @@ class Agent:
             bool: True if reset was successful
         """
         try:
-            self.messages = []
+            self.history.clear()
+            self.stage_tracker.reset()
             return True
         except Exception as e:
             print(f"Error clearing chat: {e}")
@@ -164,8 +420,15 @@ class Agent:
 
 def main():
     """
-    Example usage demonstrating the agent interface.
+    Example usage demonstrating the agent interface, or with --refresh-react-prompt, update the pinned
+    ReAct prompt from the LangChain hub.
     """
+    if "--refresh-react-prompt" in sys.argv[1:]:
+        prompt = refresh_react_prompt()
+        print(f"{REACT_PROMPT_PATH}: {prompt['ref']} at commit {prompt['commit']}, "
+              f"input variables {', '.join(prompt['input_variables'])}")
+        return
+
     agent = Agent()
 
     while True:
@@ -173,8 +436,14 @@ def main():
         if query.lower() == 'exit':
             break
 
-        response = agent.chat(query)
-        print(f"Assistant: {response}")
+        print("Assistant: ", end="", flush=True)
+        start = time.perf_counter()
+        first_token = None
+        for chunk in agent.stream_chat(query):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            print(chunk, end="", flush=True)
+        print(f"\n(time to first token: {first_token or 0:.2f}s, total: {time.perf_counter() - start:.2f}s)")
 
 
 if __name__ == "__main__":
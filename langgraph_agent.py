@@ -1,71 +1,111 @@
 import os
-from dotenv import load_dotenv
+import time
+import uuid
+import asyncio
 from datetime import date
-from tavily import TavilyClient
-import json
-
-# LangGraph and LangChain imports
-from typing import Annotated, TypedDict
-from langgraph.graph.message import add_messages
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.prebuilt import create_react_agent
-from langchain_openai import ChatOpenAI
-from langchain_core.tools import Tool
-from langchain_core.prompts import ChatPromptTemplate
 
 # Prompt components
-from prompts import role, goal, instructions, knowledge
+from prompts import goal, stage_knowledge, StageTracker, prompt_date, dated_role, dated_instructions
+from tracing import traced_turn, traced_tool
 
-# Load environment variables
-load_dotenv()
+# LangGraph, LangChain, the HTTP layer and the search modules are imported on first use, and the graph is
+# built with the first message, so importing this module and creating an Agent stay cheap (see
+# benchmarks/cold_start.py). http_clients loads the .env file when it is first imported, before any API key
+# is read.
+#
+# Conversations are checkpointed in a CheckpointStore (see checkpoint_store.py), which keeps only the latest
+# checkpoints of each thread and deletes a thread on clear_chat. With LANGGRAPH_CHECKPOINT_PATH (or the
+# checkpoint_path argument) they are also written to a SQLite file after every turn, so a conversation
+# survives a restart when the agent is created again with its session_id.
 
-# Initialize Tavily client
-tavily_api_key = os.getenv("TAVILY_API_KEY")
-tavily_client = TavilyClient(api_key=tavily_api_key)
-
-
-# Define the state for the graph
-class State(TypedDict):
-    messages: Annotated[list, add_messages]
+# Display name of this agent. agent-ui.py reads it without importing the module (see agent_discovery.py)
+AGENT_NAME = "LangGraph Agent"
 
 
 class Agent:
-    def __init__(self, model="gpt-4o-mini"):
+    def __init__(self, model="gpt-4o-mini", session_id=None, checkpoint_path=None):
         """
         Initialize the LangGraph agent using create_react_agent.
 
         Args:
             model (str): The language model to use
+            session_id (str): Thread to resume from the checkpoint file, a new thread when None
+            checkpoint_path (str): SQLite file for the checkpoints, defaults to LANGGRAPH_CHECKPOINT_PATH
+        """
+        self.name = AGENT_NAME
+        self.model = model
+        # Memory is checkpointed per thread. A unique id keeps agents sharing a checkpoint file apart
+        self.thread_id = session_id or uuid.uuid4().hex
+        self.checkpoint_path = checkpoint_path
+        # Built with the first message, and again when the date or decision stage in its prompt changes, see
+        # the graph property
+        self._graph = None
+        self._prompt_date = None
+        self._prompt_stage = None
+        self.stage_tracker = StageTracker()
+        self.last_turn_failed = False
+        self.memory = None
+
+    @property
+    def graph(self):
+        """
+        The agent graph, built on first use and rebuilt when the date (see prompts.prompt_date) or the
+        decision stage (see prompts.stage_knowledge) changes. The conversations live in the checkpointer,
+        which the rebuilt graph keeps.
+        """
+        day, stage = prompt_date(), self.stage_tracker.stage
+        if self._graph is None or day != self._prompt_date or stage != self._prompt_stage:
+            self._graph = self._create_graph(day, stage)
+            self._prompt_date = day
+            self._prompt_stage = stage
+        return self._graph
+
+    def _create_graph(self, day=None, stage=None):
+        """
+        Build the tools, memory, prompt and language model, and the ReAct agent graph over them.
+
+        Args:
+            day (datetime.date): The date to write into the prompt, or None to have the model look it up
+            stage (int): The decision stage whose knowledge goes into the prompt, or None for all of it
         """
-        self.name = "LangGraph Agent"
+        from checkpoint_store import new_store, shared_store
+        from langgraph.prebuilt import create_react_agent
+        from langchain_openai import ChatOpenAI
+        from http_clients import get_http_client, get_async_http_client
+
         # Create tools
         self.tools = self._create_tools()
 
-        # Create memory
-        self.memory = MemorySaver()
-        # Memory will be checkpointed per thread. We will start with thread id 1.
-        self.thread_id = 1
+        # Create memory, or keep the conversations of the graph this one replaces. Agents using the same
+        # checkpoint file share its store; without one each agent keeps its own in memory
+        if self.memory is None:
+            self.memory = shared_store(self.checkpoint_path) or new_store()
 
         # Create the prompt
-        self.prompt = self._create_prompt()
+        self.prompt = self._create_prompt(day, stage)
 
         # Initialize the language model
         self.llm = ChatOpenAI(
             api_key=os.getenv("OPENAI_API_KEY"),
-            model=model,
-            temperature=0
+            model=self.model,
+            temperature=0,
+            # Report token usage on streamed responses too (see tracing.py)
+            stream_usage=True,
+            # Use the process-wide OpenAI connection pool
+            http_client=get_http_client("openai"),
+            http_async_client=get_async_http_client("openai")
         )
 
         # Create the agent graph
-        self.graph = create_react_agent(
+        return create_react_agent(
             model=self.llm,
             tools=self.tools,
             prompt=self.prompt,
             checkpointer=self.memory
         )
 
-
     @staticmethod
+    @traced_tool("date")
     def date_tool(tool_input={}):
         """
         Function to get the current date.
@@ -74,16 +114,24 @@ class Agent:
         return today.strftime("%B %d, %Y")
 
     @staticmethod
+    @traced_tool("web_search")
     def web_search(query):
         """
         This function searches the web for the given query and returns the results.
         """
-        # Call Tavily's search and dump the results as a JSON string
-        search_response = tavily_client.search(query)
-        results = json.dumps(search_response.get('results', []))
-        print(f"Web Search Results for '{query}':")
-        print(results)
-        return results
+        from search_compaction import search
+
+        return search(query)
+
+    @staticmethod
+    @traced_tool("web_search")
+    async def aweb_search(query):
+        """
+        Async version of web_search.
+        """
+        from search_compaction import asearch
+
+        return await asearch(query)
 
     def _create_tools(self):
         """
@@ -92,6 +140,8 @@ class Agent:
         Returns:
             List of tools
         """
+        from langchain_core.tools import Tool
+
         return [
             Tool(
                 name="date",
@@ -101,31 +151,41 @@ class Agent:
             Tool(
                 name="web_search",
                 func=self.web_search,
+                coroutine=self.aweb_search,
                 description="Useful for searching the web for information"
             )
         ]
 
-    def _create_prompt(self):
+    def _create_prompt(self, day=None, stage=None):
         """
         Create a comprehensive prompt for the agent.
 
+        Args:
+            day (datetime.date): The date to write into the prompt, or None to have the model look it up
+            stage (int): The decision stage whose knowledge goes into the prompt, or None for all of it
+
         Returns:
             ChatPromptTemplate
         """
+        from langchain_core.prompts import ChatPromptTemplate
+
         return ChatPromptTemplate.from_messages([
-            ("system", "\n".join([role, goal, instructions, knowledge])),
+            ("system", "\n".join([dated_role(day), goal, dated_instructions(day), stage_knowledge(stage)])),
             ("placeholder", "{messages}"),
         ])
 
-    def _inc_thread_id(self):
+    def storage_stats(self):
         """
-        Simply increments the thread id and returns the new id.
+        Size and activity of the checkpoint store, see CheckpointStore.stats.
 
+        Returns:
+            dict: Threads, checkpoints, memory and disk bytes, flushes and pruned checkpoints
         """
-        new_thread_id = self.thread_id + 1
-        self.thread_id = new_thread_id
-        return new_thread_id
+        if self.memory is None:
+            return {}
+        return self.memory.stats()
 
+    @traced_turn
     def chat(self, message):
         """
         Send a message and get a response.
@@ -137,6 +197,8 @@ class Agent:
             str: Assistant's response
         """
         try:
+            self.last_turn_failed = False
+            self.stage_tracker.observe(message)
             # Prepare input
             inputs = {"messages": [("user", message)]}
             config = {"configurable": {"thread_id": str(self.thread_id)}}
@@ -149,12 +211,90 @@ class Agent:
                     if hasattr(last_message, "content"):
                         full_response = last_message.content
 
+            # Write the turn's checkpoints to disk in one batch
+            self.memory.flush()
             return full_response
 
         except Exception as e:
             print(f"Error in chat: {e}")
+            self.last_turn_failed = True
             return "Sorry, I encountered an error processing your request."
 
+    @traced_turn
+    async def achat(self, message):
+        """
+        Send a message and get a response, without blocking the event loop.
+
+        Args:
+            message (str): User's input message
+
+        Returns:
+            str: Assistant's response
+        """
+        try:
+            self.last_turn_failed = False
+            self.stage_tracker.observe(message)
+            inputs = {"messages": [("user", message)]}
+            config = {"configurable": {"thread_id": str(self.thread_id)}}
+
+            result = await self.graph.ainvoke(inputs, config=config)
+            await asyncio.to_thread(self.memory.flush)
+            return result["messages"][-1].content
+
+        except Exception as e:
+            print(f"Error in chat: {e}")
+            self.last_turn_failed = True
+            return "Sorry, I encountered an error processing your request."
+
+    @traced_turn
+    def stream_chat(self, message):
+        """
+        Send a message and stream the response as it is generated.
+
+        Args:
+            message (str): User's input message
+
+        Yields:
+            str: Chunks of the assistant's response
+        """
+        from langchain_core.messages import AIMessageChunk
+
+        try:
+            self.last_turn_failed = False
+            self.stage_tracker.observe(message)
+            inputs = {"messages": [("user", message)]}
+            config = {"configurable": {"thread_id": str(self.thread_id)}}
+
+            # "messages" mode streams the LLM tokens of every node; only the agent's text is shown
+            for chunk, metadata in self.graph.stream(inputs, config=config, stream_mode="messages"):
+                if isinstance(chunk, AIMessageChunk) and chunk.content:
+                    yield chunk.content
+
+            self.memory.flush()
+
+        except Exception as e:
+            print(f"Error in chat: {e}")
+            self.last_turn_failed = True
+            yield "Sorry, I encountered an error processing your request."
+
+    def remember_turn(self, message, response):
+        """
+        Add a turn answered without the model (see response_cache.py) to the conversation, as if chat had
+        answered it.
+
+        Args:
+            message (str): User's input message
+            response (str): Assistant's response
+        """
+        from langchain_core.messages import AIMessage, HumanMessage
+
+        self.stage_tracker.observe(message)
+        config = {"configurable": {"thread_id": str(self.thread_id)}}
+        # Written as the agent node's output, so the graph starts the next turn from the user's message
+        self.graph.update_state(config, {"messages": [HumanMessage(message), AIMessage(response)]},
+                                as_node="agent")
+        self.memory.flush()
+
     def clear_chat(self):
         """
         Reset the conversation context.
@@ -163,7 +303,12 @@ class Agent:
             bool: True if reset was successful
         """
         try:
-            self._inc_thread_id() # Incrementing the thread ID basically resets the memory
+            # Delete the conversation's checkpoints and continue on a new thread
+            if self.memory is not None:
+                self.memory.delete_thread(self.thread_id)
+                self.memory.flush()
+            self.thread_id = uuid.uuid4().hex
+            self.stage_tracker.reset()
             return True
         except Exception as e:
             print(f"Error clearing chat: {e}")
@@ -181,8 +326,14 @@ def main():
         if query.lower() in ['exit', 'quit']:
             break
 
-        response = agent.chat(query)
-        print(f"Assistant: {response}")
+        print("Assistant: ", end="", flush=True)
+        start = time.perf_counter()
+        first_token = None
+        for chunk in agent.stream_chat(query):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            print(chunk, end="", flush=True)
+        print(f"\n(time to first token: {first_token or 0:.2f}s, total: {time.perf_counter() - start:.2f}s)")
 
 
 if __name__ == "__main__":
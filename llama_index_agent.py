@@ -1,52 +1,89 @@
 import os
-from dotenv import load_dotenv
+import time
 from datetime import date
-from tavily import TavilyClient
-import json
 
-# Llama-Index imports
-from llama_index.llms.openai import OpenAI
-from llama_index.core.agent import ReActAgent
-from llama_index.core.tools import FunctionTool
-from llama_index.core.memory import ChatMemoryBuffer
-from llama_index.core import PromptTemplate
+from prompts import goal, stage_knowledge, StageTracker, llama_index_react_prompt, prompt_date, dated_role, dated_instructions
+from tracing import traced_turn, traced_tool
 
+# Llama-Index, the HTTP layer and the search modules are imported on first use, and the ReAct agent is built
+# with the first message, so importing this module and creating an Agent stay cheap (see
+# benchmarks/cold_start.py). http_clients loads the .env file when it is first imported, before any API key
+# is read.
+#
+# By default the conversation is kept in a RetrievalMemory (see vector_memory.py): a short buffer of recent
+# messages, plus a local vector index of the older turns, of which the most relevant are recalled each turn.
+# LLAMA_INDEX_MEMORY=buffer keeps only the recent buffer, dropping older turns, as before.
+#   LLAMA_INDEX_MEMORY          'retrieval' (default) or 'buffer'
+#   MEMORY_RECENT_TOKENS        Token limit of the recent buffer (default 2000; 4096 in 'buffer' mode)
+#   MEMORY_TOP_K                Older turns recalled per turn at most (default 3)
 
-from prompts import role, goal, instructions, knowledge, llama_index_react_prompt
-
-# Load environment variables
-load_dotenv()
-
-# Initialize Tavily client
-tavily_api_key = os.getenv("TAVILY_API_KEY")
-tavily_client = TavilyClient(api_key=tavily_api_key)
+# Display name of this agent. agent-ui.py reads it without importing the module (see agent_discovery.py)
+AGENT_NAME = "Llama-Index Agent"
 
 
 class Agent:
-    def __init__(self, model="gpt-4o-mini"):
+    def __init__(self, model="gpt-4o-mini", memory_mode=None):
         """
         Initialize the Llama-Index agent.
 
         Args:
             model (str): The language model to use
+            memory_mode (str): 'retrieval' or 'buffer', defaults to LLAMA_INDEX_MEMORY
+        """
+        self.name = AGENT_NAME
+        self.model = model
+        self.memory_mode = memory_mode or os.getenv("LLAMA_INDEX_MEMORY", "retrieval")
+        # Built with the first message, see the agent property
+        self._agent = None
+        self._prompt_date = None
+        self._prompt_stage = None
+        self.stage_tracker = StageTracker()
+        self.last_turn_failed = False
+
+    @property
+    def agent(self):
+        """
+        The Llama-Index ReAct agent, built on first use. Its system prompt is updated when the date (see
+        prompts.prompt_date) or the decision stage (see prompts.stage_knowledge) changes.
+        """
+        day, stage = prompt_date(), self.stage_tracker.stage
+        if self._agent is None:
+            self._agent = self._create_agent(day, stage)
+        elif day != self._prompt_date or stage != self._prompt_stage:
+            self._set_system_prompt(self._agent, day, stage)
+        self._prompt_date = day
+        self._prompt_stage = stage
+        return self._agent
+
+    def _create_agent(self, day=None, stage=None):
+        """
+        Build the language model, tools and memory, and the ReAct agent over them with our system prompt.
+
+        Args:
+            day (datetime.date): The date to write into the prompt, or None to have the model look it up
+            stage (int): The decision stage whose knowledge goes into the prompt, or None for all of it
         """
-        self.name = "Llama-Index Agent"
+        from llama_index.llms.openai import OpenAI
+        from llama_index.core.agent import ReActAgent
+        from http_clients import get_http_client, get_async_http_client
+
         # Initialize the language model
         self.llm = OpenAI(
             api_key=os.getenv("OPENAI_API_KEY"),
-            model=model
+            model=self.model,
+            # Use the process-wide OpenAI connection pool
+            http_client=get_http_client("openai"),
+            async_http_client=get_async_http_client("openai")
         )
 
         # Create tools
         self.tools = self._create_tools()
 
         # Initialize the memory
-        chat_memory = ChatMemoryBuffer.from_defaults(
-            token_limit=4096
-        )
+        chat_memory = self._create_memory()
 
         # Create the agent
-        self.agent = ReActAgent.from_tools(
+        agent = ReActAgent.from_tools(
             tools=self.tools,
             llm=self.llm,
             verbose=False,
@@ -54,12 +91,53 @@ class Agent:
         )
 
         # Customize the system prompt with our own instructions.
-        updated_system_prompt = PromptTemplate("\n".join([role, goal, instructions, knowledge, llama_index_react_prompt]))
-        self.agent.update_prompts({"agent_worker:system_prompt": updated_system_prompt})
-        self.agent.reset()
+        self._set_system_prompt(agent, day, stage)
+        agent.reset()
+        return agent
+
+    def _create_memory(self):
+        """
+        Create the chat memory for the configured memory mode.
 
+        Returns:
+            RetrievalMemory, or a plain ChatMemoryBuffer in 'buffer' mode
+        """
+        if self.memory_mode == "buffer":
+            from llama_index.core.memory import ChatMemoryBuffer
+
+            return ChatMemoryBuffer.from_defaults(
+                token_limit=int(os.getenv("MEMORY_RECENT_TOKENS", "4096"))
+            )
+
+        from vector_memory import RetrievalMemory
+
+        memory = RetrievalMemory.from_defaults(token_limit=int(os.getenv("MEMORY_RECENT_TOKENS", "2000")))
+        memory.top_k = int(os.getenv("MEMORY_TOP_K", "3"))
+        return memory
+
+    @property
+    def memory_metrics(self):
+        """
+        Per-turn retrieval time, recalled turns and injected tokens of the memory (see vector_memory.py),
+        empty in 'buffer' mode or before the first message.
+        """
+        if self._agent is None:
+            return []
+        return getattr(self._agent.memory, "turn_metrics", [])
 
     @staticmethod
+    def _set_system_prompt(agent, day, stage=None):
+        """
+        Replace the ReAct agent's system prompt with ours, for the given date and decision stage. The chat
+        memory is kept.
+        """
+        from llama_index.core import PromptTemplate
+
+        updated_system_prompt = PromptTemplate("\n".join([dated_role(day), goal, dated_instructions(day), stage_knowledge(stage), llama_index_react_prompt]))
+        agent.update_prompts({"agent_worker:system_prompt": updated_system_prompt})
+
+    @staticmethod
+    @traced_tool("date")
     def date_tool():
         """
         Function to get the current date.
@@ -68,16 +146,24 @@ class Agent:
         return today.strftime("%B %d, %Y")
 
     @staticmethod
+    @traced_tool("web_search")
     def web_search(query):
         """
         This function searches the web for the given query and returns the results.
         """
-        # Call Tavily's search and dump the results as a JSON string
-        search_response = tavily_client.search(query)
-        results = json.dumps(search_response.get('results', []))
-        print(f"Web Search Results for '{query}':")
-        print(results)
-        return results
+        from search_compaction import search
+
+        return search(query)
+
+    @staticmethod
+    @traced_tool("web_search")
+    async def aweb_search(query):
+        """
+        Async version of web_search.
+        """
+        from search_compaction import asearch
+
+        return await asearch(query)
 
     def _create_tools(self):
         """
@@ -86,6 +172,8 @@ class Agent:
         Returns:
             List of tools
         """
+        from llama_index.core.tools import FunctionTool
+
         return [
             FunctionTool.from_defaults(
                 fn=self.date_tool,
@@ -94,11 +182,13 @@ class Agent:
             ),
             FunctionTool.from_defaults(
                 fn=self.web_search,
+                async_fn=self.aweb_search,
                 name="web_search",
                 description="Useful for searching the web for information"
             )
         ]
 
+    @traced_turn
     def chat(self, message):
         """
         Send a message and get a response.
@@ -110,6 +200,8 @@ class Agent:
             str: Assistant's response
         """
         try:
+            self.last_turn_failed = False
+            self.stage_tracker.observe(message)
             # Send message to the agent
             response = self.agent.chat(message)
 
@@ -117,8 +209,70 @@ class Agent:
 
         except Exception as e:
             print(f"Error in chat: {e}")
+            self.last_turn_failed = True
             return "Sorry, I encountered an error processing your request."
 
+    @traced_turn
+    async def achat(self, message):
+        """
+        Send a message and get a response, without blocking the event loop.
+
+        Args:
+            message (str): User's input message
+
+        Returns:
+            str: Assistant's response
+        """
+        try:
+            self.last_turn_failed = False
+            self.stage_tracker.observe(message)
+            response = await self.agent.achat(message)
+
+            return str(response)
+
+        except Exception as e:
+            print(f"Error in chat: {e}")
+            self.last_turn_failed = True
+            return "Sorry, I encountered an error processing your request."
+
+    @traced_turn
+    def stream_chat(self, message):
+        """
+        Send a message and stream the response as it is generated.
+
+        Args:
+            message (str): User's input message
+
+        Yields:
+            str: Chunks of the assistant's response
+        """
+        try:
+            self.last_turn_failed = False
+            self.stage_tracker.observe(message)
+            response = self.agent.stream_chat(message)
+            for token in response.response_gen:
+                yield token
+
+        except Exception as e:
+            print(f"Error in chat: {e}")
+            self.last_turn_failed = True
+            yield "Sorry, I encountered an error processing your request."
+
+    def remember_turn(self, message, response):
+        """
+        Add a turn answered without the model (see response_cache.py) to the conversation, as if chat had
+        answered it.
+
+        Args:
+            message (str): User's input message
+            response (str): Assistant's response
+        """
+        from llama_index.core.base.llms.types import ChatMessage, MessageRole
+
+        self.stage_tracker.observe(message)
+        self.agent.memory.put(ChatMessage(role=MessageRole.USER, content=message))
+        self.agent.memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=response))
+
     def clear_chat(self):
         """
         Reset the conversation context.
@@ -127,8 +281,10 @@ class Agent:
             bool: True if reset was successful
         """
         try:
-            # Reset the agent's chat history
-            self.agent.reset()
+            # Reset the agent's chat history, if it has been built yet
+            if self._agent is not None:
+                self._agent.reset()
+            self.stage_tracker.reset()
             return True
         except Exception as e:
             print(f"Error clearing chat: {e}")
@@ -146,8 +302,14 @@ def main():
         if query.lower() in ['exit', 'quit']:
             break
 
-        response = agent.chat(query)
-        print(f"Assistant: {response}")
+        print("Assistant: ", end="", flush=True)
+        start = time.perf_counter()
+        first_token = None
+        for chunk in agent.stream_chat(query):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            print(chunk, end="", flush=True)
+        print(f"\n(time to first token: {first_token or 0:.2f}s, total: {time.perf_counter() - start:.2f}s)")
 
 
 if __name__ == "__main__":
@@ -1,32 +1,103 @@
 import os
-import openai
 import time
 import json
-from tavily import TavilyClient
-from dotenv import load_dotenv
+import asyncio
 from datetime import date
-from prompts import role, goal, instructions, knowledge
+from prompts import goal, stage_knowledge, StageTracker, prompt_date, dated_role, dated_instructions
+from tracing import traced_turn, traced_tool, annotate
 
-# Load environment variables
-load_dotenv()
+# The OpenAI SDK, the HTTP layer and the search modules are imported on first use, and the assistant and its
+# thread are created with the first message, so importing this module and creating an Agent stay cheap (see
+# benchmarks/cold_start.py). http_clients loads the .env file when it is first imported, before any API key
+# is read.
 
-tavily_api_key = os.getenv("TAVILY_API_KEY")
-openai_api_key = os.getenv("OPENAI_API_KEY")
-tavily_client = TavilyClient(api_key=tavily_api_key)
+# Display name of this agent. agent-ui.py reads it without importing the module (see agent_discovery.py)
+AGENT_NAME = "OpenAI Agent"
 
 
 class Agent:
-    def __init__(self, model="gpt-4o-mini", max_polling_attempts=60, polling_interval=1):
-        self.name = "OpenAI Agent"
+    def __init__(self, model="gpt-4o-mini", max_polling_attempts=60, polling_interval=1,
+                 min_polling_interval=0.02, polling_backoff=1.5, use_streaming=True):
+        """
+        Initialize the OpenAI Assistants agent.
+
+        Args:
+            model (str): The model the assistant runs on
+            max_polling_attempts (int): Give up on a run after this many status checks
+            polling_interval (float): Longest wait in seconds between two status checks
+            min_polling_interval (float): First wait in seconds after a run starts or changes state
+            polling_backoff (float): Factor by which the wait grows while the run's state is unchanged
+            use_streaming (bool): Follow runs through their event stream instead of polling their status
+        """
+        self.name = AGENT_NAME
         self.model = model
-        self.client = openai.OpenAI(api_key=openai_api_key)
+        # Created on first use, see the client, assistant and thread properties
+        self._client = None
+        self._async_client = None
+        self._assistant = None
+        self._thread = None
+        # The date and decision stage written into the assistant's instructions, see the assistant property
+        self._prompt_date = None
+        self._prompt_stage = None
+        self.stage_tracker = StageTracker()
+        self.last_turn_failed = False
         self.max_polling_attempts = max_polling_attempts
         self.polling_interval = polling_interval
-        self.assistant = self._create_assistant()
-        self.thread = self._create_thread()
+        self.min_polling_interval = min_polling_interval
+        self.polling_backoff = polling_backoff
+        self.use_streaming = use_streaming
+        # Latency breakdown of every turn, see _start_timing
+        self.turn_timings = []
+
+    ### Lazily created clients and resources ###
+    @property
+    def client(self):
+        """
+        The OpenAI client, created on first use on the process-wide OpenAI connection pool.
+        """
+        if self._client is None:
+            from http_clients import openai_client
+            self._client = openai_client(api_key=os.getenv("OPENAI_API_KEY"))
+        return self._client
+
+    @property
+    def async_client(self):
+        """
+        The async OpenAI client, created on first use on the same connection pool.
+        """
+        if self._async_client is None:
+            from http_clients import async_openai_client
+            self._async_client = async_openai_client(api_key=os.getenv("OPENAI_API_KEY"))
+        return self._async_client
+
+    @property
+    def assistant(self):
+        """
+        The assistant, created with the first message. Its instructions are updated when the date (see
+        prompts.prompt_date) or the decision stage (see prompts.stage_knowledge) changes.
+        """
+        day, stage = prompt_date(), self.stage_tracker.stage
+        if self._assistant is None:
+            self._assistant = self._create_assistant(day=day, stage=stage)
+        elif day != self._prompt_date or stage != self._prompt_stage:
+            self._assistant = self.client.beta.assistants.update(self._assistant.id,
+                                                                 instructions=self._instructions(day, stage))
+        self._prompt_date = day
+        self._prompt_stage = stage
+        return self._assistant
+
+    @property
+    def thread(self):
+        """
+        The current thread, created with the first message after the agent is built or cleared.
+        """
+        if self._thread is None:
+            self._thread = self._create_thread()
+        return self._thread
 
     ### Tools ###
     @staticmethod
+    @traced_tool("date")
     def date_tool():
         """
         Function to get the current date.
@@ -35,23 +106,41 @@ class Agent:
         return today.strftime("%B %d, %Y")
 
     @staticmethod
+    @traced_tool("web_search")
     def web_search(query):
         """
         This function searches the web for the given query and returns the results.
         """
-        search_response = tavily_client.search(query)
-        results = json.dumps(search_response.get('results', []))
-        print(results)
-        return results
+        from search_compaction import search
+
+        return search(query)
+
+    @staticmethod
+    @traced_tool("web_search")
+    async def aweb_search(query):
+        """
+        Async version of web_search.
+        """
+        from search_compaction import asearch
+
+        return await asearch(query)
 
     ### Create Assistant with tools ###
-    def _create_assistant(self, name="Web Search Assistant"):
+    @staticmethod
+    def _instructions(day, stage=None):
+        """
+        The assistant's instructions for a date, or for looking the date up when day is None, with the
+        knowledge for a decision stage, or all of it when stage is None.
+        """
+        return "\n".join([dated_role(day), goal, dated_instructions(day), stage_knowledge(stage)])
+
+    def _create_assistant(self, name="Web Search Assistant", day=None, stage=None):
         """
         Create an assistant with instructions and tool definitions for both the date and web_search functions.
         """
         assistant = self.client.beta.assistants.create(
             name=name,
-            instructions="\n".join([role, goal, instructions, knowledge]),
+            instructions=self._instructions(day, stage),
             tools=[
                 {"type": "function", "function": {
                     "name": "date",
@@ -107,16 +196,25 @@ class Agent:
         run = self.client.beta.threads.runs.create(thread_id=thread_id, **run_kwargs)
         return run
 
-    def _get_response(self, thread_id, run_id):
+    def _get_response(self, thread_id, run_id, timing):
         """
         Poll for the run status until it completes.
+        The wait between polls starts at min_polling_interval and grows by polling_backoff up to
+        polling_interval while the status stays the same, so short runs are not held back by a fixed interval.
         If the run status is 'requires_action', we handle the tool call based on the tool's name.
         Returns the assistant response or None on failure.
         """
         attempts = 0
+        interval = self.min_polling_interval
+        last_status = None
         while attempts < self.max_polling_attempts:
             run = self.client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
             status = run.status
+            timing["polls"] += 1
+            self._observe(timing, status)
+            if status != last_status:
+                interval = self.min_polling_interval
+                last_status = status
 
             if status == "completed":
                 messages = self.client.beta.threads.messages.list(thread_id=thread_id)
@@ -132,6 +230,7 @@ class Agent:
                         run.required_action.submit_tool_outputs and
                         run.required_action.submit_tool_outputs.tool_calls):
 
+                    self._observe(timing, "tools")
                     tool_outputs = self._handle_tool_calls(run)
 
                     self.client.beta.threads.runs.submit_tool_outputs(
@@ -139,17 +238,167 @@ class Agent:
                         run_id=run_id,
                         tool_outputs=tool_outputs
                     )
+                    self._observe(timing, "in_progress")
+                    # The run is moving again, so check on it soon
+                    interval = self.min_polling_interval
+                    last_status = None
 
             elif status in ["failed", "cancelled", "expired"]:
                 print(f"Run ended with status: {status}")
+                self.last_turn_failed = True
                 return None
 
-            time.sleep(self.polling_interval)
+            time.sleep(interval)
+            timing["sleeping"] += interval
+            interval = min(interval * self.polling_backoff, self.polling_interval)
             attempts += 1
 
         print("Polling exceeded maximum attempts.")
+        self.last_turn_failed = True
         return None
 
+    def _stream_run(self, stream, timing):
+        """
+        Consume a streamed run, handling tool calls inline instead of polling for the run status.
+        When the run requires action, the tool outputs are submitted on a new stream which is consumed
+        in turn, until the run finishes.
+
+        Args:
+            stream: The event stream returned by runs.create(..., stream=True)
+            timing (dict): The turn's latency breakdown, see _start_timing
+
+        Yields:
+            str: Text deltas of the assistant's message
+        """
+        while stream is not None:
+            run_requiring_action = None
+            with stream:
+                for event in stream:
+                    if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step."):
+                        self._observe(timing, event.data.status)
+                    if event.event == "thread.message.delta":
+                        for part in event.data.delta.content or []:
+                            if part.type == "text" and part.text and part.text.value:
+                                yield part.text.value
+                    elif event.event == "thread.run.requires_action":
+                        run_requiring_action = event.data
+                    elif event.event in ["thread.run.failed", "thread.run.cancelled", "thread.run.expired"]:
+                        print(f"Run ended with status: {event.data.status}")
+                        self.last_turn_failed = True
+
+            stream = None
+            if run_requiring_action is not None:
+                self._observe(timing, "tools")
+                tool_outputs = self._handle_tool_calls(run_requiring_action)
+                stream = self.client.beta.threads.runs.submit_tool_outputs(
+                    thread_id=run_requiring_action.thread_id,
+                    run_id=run_requiring_action.id,
+                    tool_outputs=tool_outputs,
+                    stream=True
+                )
+                self._observe(timing, "in_progress")
+
+    ### Latency breakdown ###
+    def _start_timing(self, mode):
+        """
+        Start the latency breakdown of a turn. Every observed change of the run's status (a polled status
+        or a streamed run event) charges the time since the previous observation to the state the run was
+        in: 'queued', 'tools' (running our tools and submitting their outputs) or 'in_progress'. When polling,
+        'sleeping' is the part of that time spent waiting between status checks.
+
+        Args:
+            mode (str): 'stream' or 'poll'
+
+        Returns:
+            dict: The running breakdown, passed to _observe and _finish_timing
+        """
+        now = time.perf_counter()
+        return {"mode": mode, "queued": 0.0, "in_progress": 0.0, "tools": 0.0, "polls": 0, "sleeping": 0.0,
+                "_status": "queued", "_mark": now, "_start": now}
+
+    @staticmethod
+    def _observe(timing, status):
+        """
+        Charge the time since the last observation to the run's previous state and record its new one.
+        """
+        now = time.perf_counter()
+        previous = timing["_status"]
+        bucket = previous if previous in ("queued", "tools") else "in_progress"
+        timing[bucket] += now - timing["_mark"]
+        timing["_status"], timing["_mark"] = status, now
+
+    def _finish_timing(self, timing):
+        """
+        Close a turn's latency breakdown and add it to turn_timings and the turn's trace span.
+        """
+        self._observe(timing, "done")
+        result = {key: value for key, value in timing.items() if not key.startswith("_")}
+        result["total"] = timing["_mark"] - timing["_start"]
+        self.turn_timings.append(result)
+        annotate(run_timing=result)
+        return result
+
+    @property
+    def last_timing(self):
+        """
+        Latency breakdown of the most recent turn, in seconds.
+        """
+        return self.turn_timings[-1] if self.turn_timings else None
+
+    def _create_streaming_run(self, thread_id):
+        """
+        Start a run on its event stream.
+
+        Returns:
+            The event stream, or None if streaming is unavailable, in which case the agent switches to polling
+        """
+        import openai
+
+        if not self.use_streaming:
+            return None
+        try:
+            return self.client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=self.assistant.id,
+                stream=True
+            )
+        except (openai.BadRequestError, openai.NotFoundError, openai.UnprocessableEntityError) as e:
+            print(f"Streaming runs unavailable, falling back to polling: {e}")
+            self.use_streaming = False
+            return None
+
+    async def _astream_run(self, stream, timing):
+        """
+        Async version of _stream_run.
+        """
+        while stream is not None:
+            run_requiring_action = None
+            async with stream:
+                async for event in stream:
+                    if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step."):
+                        self._observe(timing, event.data.status)
+                    if event.event == "thread.message.delta":
+                        for part in event.data.delta.content or []:
+                            if part.type == "text" and part.text and part.text.value:
+                                yield part.text.value
+                    elif event.event == "thread.run.requires_action":
+                        run_requiring_action = event.data
+                    elif event.event in ["thread.run.failed", "thread.run.cancelled", "thread.run.expired"]:
+                        print(f"Run ended with status: {event.data.status}")
+                        self.last_turn_failed = True
+
+            stream = None
+            if run_requiring_action is not None:
+                self._observe(timing, "tools")
+                tool_outputs = await self._ahandle_tool_calls(run_requiring_action)
+                stream = await self.async_client.beta.threads.runs.submit_tool_outputs(
+                    thread_id=run_requiring_action.thread_id,
+                    run_id=run_requiring_action.id,
+                    tool_outputs=tool_outputs,
+                    stream=True
+                )
+                self._observe(timing, "in_progress")
+
     def _handle_tool_calls(self, run):
         """
         Handles tool function calls required by the assistant during execution.
@@ -184,17 +433,104 @@ class Agent:
 
         return tool_outputs
 
+    async def _ahandle_tool_calls(self, run):
+        """
+        Async version of _handle_tool_calls. The tool calls of one step run concurrently.
+        """
+        async def call(tool_call):
+            arguments = json.loads(tool_call.function.arguments or "{}")
+            tool_name = tool_call.function.name
+            if tool_name == "web_search":
+                result = await self.aweb_search(arguments.get("query", ""))
+            elif tool_name == "date":
+                result = self.date_tool()
+            else:
+                result = "Unsupported tool."
+            return {"tool_call_id": tool_call.id, "output": result}
+
+        try:
+            return list(await asyncio.gather(
+                *(call(tool_call) for tool_call in run.required_action.submit_tool_outputs.tool_calls)
+            ))
+        except Exception as e:
+            print(f"Error processing function calls: {e}")
+            return None
+
     ### API to the frontend ###
     ### These two methods must be implemented for all agents ###
     def chat(self, message):
+        return "".join(self.stream_chat(message)) or None
+
+    @traced_turn
+    def stream_chat(self, message):
+        self.last_turn_failed = False
+        self.stage_tracker.observe(message)
         self._add_message(thread_id=self.thread.id, role="user", content=message)
-        run = self._run_assistant(thread_id=self.thread.id, assistant_id=self.assistant.id)
-        response = self._get_response(thread_id=self.thread.id, run_id=run.id)
+        timing = self._start_timing("stream")
+        stream = self._create_streaming_run(self.thread.id)
+        if stream is not None:
+            yield from self._stream_run(stream, timing)
+        else:
+            timing["mode"] = "poll"
+            run = self._run_assistant(thread_id=self.thread.id, assistant_id=self.assistant.id)
+            response = self._get_response(thread_id=self.thread.id, run_id=run.id, timing=timing)
+            if response:
+                yield response
+        self._finish_timing(timing)
+
+    @traced_turn
+    async def achat(self, message):
+        import openai
+
+        self.last_turn_failed = False
+        self.stage_tracker.observe(message)
+        if (self._assistant is None or self._thread is None or self._prompt_date != prompt_date()
+                or self._prompt_stage != self.stage_tracker.stage):
+            # First turn, a new day or a new stage: create or update the assistant and thread without blocking
+            # the event loop
+            await asyncio.to_thread(lambda: (self.assistant, self.thread))
+        await self.async_client.beta.threads.messages.create(thread_id=self.thread.id, role="user", content=message)
+        timing = self._start_timing("stream")
+        stream = None
+        if self.use_streaming:
+            try:
+                stream = await self.async_client.beta.threads.runs.create(
+                    thread_id=self.thread.id,
+                    assistant_id=self.assistant.id,
+                    stream=True
+                )
+            except (openai.BadRequestError, openai.NotFoundError, openai.UnprocessableEntityError) as e:
+                print(f"Streaming runs unavailable, falling back to polling: {e}")
+                self.use_streaming = False
+        if stream is not None:
+            response = "".join([text async for text in self._astream_run(stream, timing)]) or None
+        else:
+            # Polling is the fallback path, so it keeps its blocking implementation, off the event loop
+            timing["mode"] = "poll"
+            run = await asyncio.to_thread(self._run_assistant, self.thread.id, self.assistant.id)
+            response = await asyncio.to_thread(self._get_response, self.thread.id, run.id, timing)
+        self._finish_timing(timing)
         return response
 
+    def remember_turn(self, message, response):
+        """
+        Add a turn answered without the model (see response_cache.py) to the conversation, as if chat had
+        answered it.
+
+        Args:
+            message (str): User's input message
+            response (str): Assistant's response
+        """
+        self.stage_tracker.observe(message)
+        # The thread keeps the conversation on the server, so both messages are added to it
+        self._add_message(thread_id=self.thread.id, role="user", content=message)
+        self._add_message(thread_id=self.thread.id, role="assistant", content=response)
+
     def clear_chat(self):
         try:
-            self.thread = self._create_thread()
+            # The next message starts a new thread
+            self._thread = None
+            self.stage_tracker.reset()
             return True
         except Exception as e:
             print(f"Error clearing chat: {e}")
@@ -207,8 +543,15 @@ def main():
 
     query = input("You: ")
     while query != "exit":
-        response = agent.chat(query)
-        print(f"Assistant: {response}")
+        print("Assistant: ", end="", flush=True)
+        start = time.perf_counter()
+        first_token = None
+        for chunk in agent.stream_chat(query):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            print(chunk, end="", flush=True)
+        print(f"\n(time to first token: {first_token or 0:.2f}s, total: {time.perf_counter() - start:.2f}s)")
+        print(f"Timing: {agent.last_timing}")
         query = input("You: ")
 
 
@@ -0,0 +1,302 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import threading
+import subprocess
+
+from history import count_tokens, tokenizer_name
+
+# Effective prompt size of every agent.
+#
+# What an agent sends is not prompts.py: LangChain builds a ReAct prompt around langchain_react_prompt,
+# Llama-Index appends llama_index_react_prompt and the tool descriptions, CrewAI splits the prompt into role,
+# goal and backstory inside its own template, Atomic renders a SystemPromptGenerator, and most frameworks add
+# tool schemas. This module runs one turn of each agent in a fresh interpreter against fake_servers.py, with
+# request capture on, and takes the first request that carries a prompt as the agent's first-call payload.
+# For the OpenAI Assistants agent that is the assistant (instructions and tools) with the first thread message.
+# The payload is split into:
+#   - system    the system prompt(s) or instructions
+#   - tools     the tool definitions, as the JSON the framework sent (an approximation of what the model sees)
+#   - messages  everything else: the user's message, and the whole prompt for the ReAct frameworks that send it
+#               as a user message
+# and counted with the same tokenizer as the histories (history.count_tokens: tiktoken's cl100k_base, or an
+# estimate offline). Counts are cached in PROMPT_SIZE_CACHE, keyed by a hash of the tokenizer and the text, so
+# only prompts that changed are counted again.
+#
+# Each agent's total is checked against its budget (BUDGETS, PROMPT_TOKEN_BUDGET or --budget), and the
+# command exits with status 1 if any prompt is over, so prompt growth fails CI instead of showing up later
+# as latency and cost. The budgets hold for the estimate as well as for cl100k_base.
+#
+# Configured through environment variables:
+#   PROMPT_TOKEN_BUDGET   Budget for every agent, instead of BUDGETS
+#   PROMPT_SIZE_CACHE     The token count cache (default .prompt_size_cache.json; empty to turn it off)
+#
+# `python prompt_size.py [--agent anthropic_agent ...] [--budget 6000 | --budget langchain_agent=6000]
+# [--render] [--json]`; --render prints the captured payloads.
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+MESSAGE = "Should I rent or buy a home?"
+
+# Input tokens of the first call per agent, about a quarter over their size at the time of writing with the
+# default settings (the date in the prompt, stage knowledge). KNOWLEDGE_MODE=full adds about 500 tokens.
+BUDGETS = {
+    "anthropic_agent": 1250,
+    "atomic_agent": 1700,
+    "crewai_agent": 1600,
+    "langchain_agent": 1550,
+    "langgraph_agent": 1250,
+    "llama_index_agent": 1800,
+    "openai_agent": 1250,
+    "pydantic_agent": 1250,
+}
+
+SECTIONS = ("system", "tools", "messages")
+
+PROBE = """
+import os, sys, importlib
+sys.stdout = open(os.devnull, 'w')  # the agents print their tool calls
+importlib.import_module({module_name!r}).Agent().chat({message!r})
+"""
+
+
+def _text_of(content):
+    """
+    Flatten message content (a string or a list of content parts) into plain text.
+    """
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, dict):
+        return _text_of(content.get("text") or content.get("value") or content.get("content"))
+    return "\n".join(_text_of(part) for part in content)
+
+
+def _dump(value):
+    return json.dumps(value, sort_keys=True, ensure_ascii=False) if value else ""
+
+
+def first_call_payload(captured):
+    """
+    Find an agent's first-call payload among the request bodies captured by the fake server.
+
+    Args:
+        captured (list): {"handler", "body"} dicts, oldest first (see FakeServers.captured)
+
+    Returns:
+        dict: The endpoint and the system, tools and messages sections as text, or None if nothing was sent
+    """
+    # The Assistants agent may add its first message to the thread before it creates the assistant
+    assistant = message = None
+    for request in captured:
+        handler, body = request["handler"], request["body"]
+        if handler == "chat_completions":
+            messages = body.get("messages", [])
+            tools = body.get("tools") or body.get("functions")
+            if body.get("response_format"):
+                tools = [*(tools or []), body["response_format"]]
+            return {
+                "endpoint": "openai.chat",
+                "system": "\n".join(_text_of(m.get("content")) for m in messages
+                                    if m.get("role") in ("system", "developer")),
+                "tools": _dump(tools),
+                "messages": "\n".join(_text_of(m.get("content")) for m in messages
+                                      if m.get("role") not in ("system", "developer")),
+            }
+        if handler == "anthropic_messages":
+            return {
+                "endpoint": "anthropic.messages",
+                "system": _text_of(body.get("system")),
+                "tools": _dump(body.get("tools")),
+                "messages": "\n".join(_text_of(m.get("content")) for m in body.get("messages", [])),
+            }
+        if handler in ("create_assistant", "update_assistant"):
+            assistant = body
+        elif handler == "create_message" and message is None:
+            message = body
+        if assistant is not None and message is not None:
+            return {
+                "endpoint": "openai.assistants",
+                "system": assistant.get("instructions") or "",
+                "tools": _dump(assistant.get("tools")),
+                "messages": _text_of(message.get("content")),
+            }
+    return None
+
+
+class TokenCountCache:
+    def __init__(self, path=None):
+        """
+        Token counts of texts, keyed by a hash of the tokenizer and the text, kept in a JSON file.
+
+        Args:
+            path (str): The JSON file, or None to keep the counts in memory only
+        """
+        self.path = path
+        self.tokenizer = tokenizer_name()
+        self.counts = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as source:
+                    self.counts = json.load(source)
+            except (OSError, ValueError):
+                # A broken cache is only a slower run
+                self.counts = {}
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.tokenizer}\0{text}".encode("utf-8")).hexdigest()
+
+    def count(self, text):
+        """
+        The token count of text, from the cache if it was counted before.
+        """
+        key = self.key(text)
+        with self._lock:
+            if key in self.counts:
+                self.hits += 1
+                return self.counts[key]
+        tokens = count_tokens(text)
+        with self._lock:
+            self.misses += 1
+            self.counts[key] = tokens
+            self._dirty = True
+        return tokens
+
+    def save(self):
+        """
+        Write the cache file, if anything was added to it.
+        """
+        if not self.path or not self._dirty:
+            return
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as target:
+            json.dump(self.counts, target)
+        os.replace(temporary, self.path)
+        self._dirty = False
+
+
+def render(module_name, servers, env, message=MESSAGE):
+    """
+    Run one turn of an agent and return its first-call payload.
+
+    Args:
+        module_name (str): Module name of the agent
+        servers (FakeServers): The fake server the agent talks to, started with capture_requests
+        env (dict): Environment of the child process
+        message (str): The user's message
+
+    Returns:
+        dict: See first_call_payload
+    """
+    servers.clear_captured()
+    code = PROBE.format(module_name=module_name, message=message)
+    subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT, env=env, check=True, capture_output=True,
+                   text=True)
+    return first_call_payload(servers.captured)
+
+
+def measure(payload, cache):
+    """
+    Count the tokens of each section of a payload, and their total.
+
+    Returns:
+        dict: Section name -> tokens, plus 'total' and the 'hash' of the payload
+    """
+    sizes = {section: cache.count(payload[section]) if payload[section] else 0 for section in SECTIONS}
+    sizes["total"] = sum(sizes.values())
+    sizes["hash"] = hashlib.sha256("\0".join(payload[section] for section in SECTIONS).encode("utf-8")).hexdigest()[:12]
+    return sizes
+
+
+def parse_budgets(values, agents):
+    """
+    The budget of every agent: BUDGETS, then PROMPT_TOKEN_BUDGET, then --budget N or --budget agent=N.
+
+    Returns:
+        dict: Module name -> budget in tokens, or None for no budget
+    """
+    budgets = {agent: BUDGETS.get(agent) for agent in agents}
+    if os.getenv("PROMPT_TOKEN_BUDGET"):
+        budgets = dict.fromkeys(agents, int(os.getenv("PROMPT_TOKEN_BUDGET")))
+    for value in values or []:
+        agent, _, tokens = value.rpartition("=")
+        if agent:
+            budgets[agent] = int(tokens)
+        else:
+            budgets = dict.fromkeys(agents, int(tokens))
+    return budgets
+
+
+def main():
+    """
+    Measure the first-call prompt of every agent and check it against its budget.
+    """
+    from agent_discovery import discover_agents
+    from fake_servers import FakeServers
+
+    parser = argparse.ArgumentParser(description="Measure and check the prompt each agent really sends.")
+    parser.add_argument("--agent", action="append", help="Agent module to measure (repeatable, default all)")
+    parser.add_argument("--budget", action="append",
+                        help="Token budget for every agent (N) or for one (agent=N), repeatable")
+    parser.add_argument("--message", default=MESSAGE)
+    parser.add_argument("--render", action="store_true", help="Print the captured payloads")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    agents = args.agent or list(discover_agents(PROJECT_ROOT))
+    budgets = parse_budgets(args.budget, agents)
+    cache = TokenCountCache(os.getenv("PROMPT_SIZE_CACHE", ".prompt_size_cache.json") or None)
+
+    results = {}
+    with FakeServers(config={"capture_requests": 16}) as servers:
+        # Keep the search cache and checkpoints of the child processes out of the project
+        env = dict(os.environ, **servers.env(), SEARCH_CACHE_PATH="", LANGGRAPH_CHECKPOINT_PATH="")
+        for module_name in agents:
+            try:
+                payload = render(module_name, servers, env, args.message)
+            except subprocess.CalledProcessError as e:
+                print(f"{module_name} failed:\n{e.stderr}", file=sys.stderr)
+                results[module_name] = None
+                continue
+            if payload is None:
+                print(f"{module_name} sent no prompt", file=sys.stderr)
+                results[module_name] = None
+                continue
+            results[module_name] = dict(measure(payload, cache), endpoint=payload["endpoint"],
+                                        budget=budgets.get(module_name))
+            if args.render:
+                print(f"===== {module_name} ({payload['endpoint']}) =====")
+                for section in SECTIONS:
+                    print(f"----- {section} -----\n{payload[section]}")
+    cache.save()
+
+    over = [name for name, result in results.items()
+            if result is None or (result["budget"] is not None and result["total"] > result["budget"])]
+    if args.json:
+        print(json.dumps({"tokenizer": cache.tokenizer, "agents": results, "over_budget": over}, indent=2))
+    else:
+        print(f"tokens counted with {cache.tokenizer}, {cache.hits} cached and {cache.misses} new counts")
+        print(f"{'agent':<20}{'endpoint':<20}{'system':>8}{'tools':>8}{'messages':>10}{'total':>8}{'budget':>8}"
+              f"  {'hash':<14}")
+        for name, result in results.items():
+            if result is None:
+                print(f"{name:<20}{'failed':<20}")
+                continue
+            budget = result["budget"] if result["budget"] is not None else "-"
+            flag = "  OVER BUDGET" if name in over else ""
+            print(f"{name:<20}{result['endpoint']:<20}{result['system']:>8}{result['tools']:>8}"
+                  f"{result['messages']:>10}{result['total']:>8}{budget:>8}  {result['hash']:<14}{flag}")
+    if over:
+        print(f"{len(over)} prompt(s) over budget or not measured: {', '.join(over)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
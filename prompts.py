@@ -1,3 +1,8 @@
+import os
+import re
+import functools
+from datetime import date
+
 knowledge = """
 # Background Knowledge: Comprehensive Decision-Making Process Guide for AI-Assisted Navigation
 
@@ -121,10 +126,20 @@ knowledge = """
 
 """
 
+### Date lookup ###
+# The lines of role and instructions that make the model call the `date` tool first. dated_role and
+# dated_instructions (at the end of this module) replace them with the date itself.
+role_date_line = "You are also very concerned with providing relevant information and therefore you always start by checking the date."
+
+date_directive = """*** CRITICALLY IMPORTANT *** : ALWAYS begin by checking the current date using the `date` function. You do not need to 
+tell the user that you have done this."""
+
+date_principle = "Always verify the current date using the `date` function before proceeding"
+
 role = f"""
 # Role:
 You are a helpful AI Decision Support Agent and these are your core directives.
-You are also very concerned with providing relevant information and therefore you always start by checking the date.
+{role_date_line}
 
 """
 
@@ -140,8 +155,7 @@ Provide expert, comprehensive guidance through the decision-making process by:
 
 instructions = f"""
 
-*** CRITICALLY IMPORTANT *** : ALWAYS begin by checking the current date using the `date` function. You do not need to 
-tell the user that you have done this.
+{date_directive}
 
 ## Key Operational Principles
 1. Do not advance to the next process stage until the current stage is FULLY and THOROUGHLY explored
@@ -150,7 +164,7 @@ tell the user that you have done this.
    - Fill knowledge gaps
    - Generate probing questions
    - Validate and expand user insights
-4. Always verify the current date using the `date` function before proceeding
+4. {date_principle}
 5. Use any language you want for research, but always respond to the user in their chosen language.
 
 ## Critical Assessment Criteria for Stage Completion
@@ -267,4 +281,190 @@ Answer: [your answer here (In the same language as the user's question)]
 It is considered an error for an Action not to be preceded by a Thought.
 It is considered an error for an Action not to be followed by an Action Input.
 
-"""
\ No newline at end of file
+"""
+
+
+### Current date ###
+# By default the date is written into the system prompt, so the model no longer spends a call on the `date`
+# tool at the start of every turn. The tool stays available in case the model wants to check. Agents ask
+# prompt_date() for the date at the start of each turn and rebuild their system prompt only when it has
+# changed, i.e. at most once a day. Set DATE_IN_PROMPT=0 for the original prompts, which make the model
+# look the date up first (see benchmarks/llm_calls.py for what that costs).
+
+
+def prompt_date():
+    """
+    The date to write into the system prompt.
+
+    Returns:
+        datetime.date: Today's date, or None when DATE_IN_PROMPT=0 and the model is to use the date tool
+    """
+    if os.getenv("DATE_IN_PROMPT", "1") == "0":
+        return None
+    return date.today()
+
+
+@functools.lru_cache(maxsize=4)
+def dated_role(day):
+    """
+    The role with the date written in.
+
+    Args:
+        day (datetime.date): The date from prompt_date(), or None for the original role
+
+    Returns:
+        str: The role prompt
+    """
+    if day is None:
+        return role
+    return role.replace(role_date_line, "You are also very concerned with providing relevant information and "
+                                        "therefore you always take the current date into account.")
+
+
+@functools.lru_cache(maxsize=4)
+def dated_instructions(day):
+    """
+    The instructions with the date written in, instead of the order to look it up with the date tool.
+
+    Args:
+        day (datetime.date): The date from prompt_date(), or None for the original instructions
+
+    Returns:
+        str: The instructions prompt
+    """
+    if day is None:
+        return instructions
+    today = day.strftime("%B %d, %Y")
+    return (instructions
+            .replace(date_directive, f"*** CURRENT DATE *** : Today's date is {today}. Take it into account in "
+                                     f"your research and advice. You do not need to look it up with the `date` "
+                                     f"function or tell the user that you know it.")
+            .replace(date_principle, "Base your research on the current date given above; the `date` function "
+                                     "is there if you need to check it again"))
+
+
+### Decision stages ###
+# `knowledge` walks through nine stages, but most turns of a session are about one of them. By default the
+# agents send only part of it: the list of all stages, the current stage and its neighbours in full, and
+# the closing considerations (stage_knowledge). A StageTracker per session estimates the current stage from
+# the user's messages, by counting cue words of each stage with older turns counting less and less. Agents
+# rebuild their system prompt when the stage changes, like they do when the date changes.
+# Set KNOWLEDGE_MODE=full to send the whole guide on every call (see benchmarks/knowledge_tokens.py for the
+# difference in input tokens).
+
+STAGE_CUES = {
+    1: r"decid\w*|decision|should i|whether|dilemma|torn between|thinking about|considering",
+    2: r"goals?|objectives?|priorit\w*|want|hope|important to me|success|outcome",
+    3: r"budget|afford|constraints?|limits?|deadline|must|can't|cannot|requirements?|non-negotiable|"
+       r"income|salary|earn\w*|savings",
+    4: r"options?|alternatives?|possibilit\w*|what else|other ways|brainstorm|ideas",
+    5: r"research|data|facts?|evidence|statistics|prices?|costs?|rates?|market|find out|how much|numbers",
+    6: r"compar\w*|pros|cons|trade-?offs?|evaluat\w*|risks?|scenarios?|versus|vs\.?|better|worse",
+    7: r"recommend\w*|which one|final decision|choose|pick|go with|summari[sz]e the decision|verdict",
+    8: r"plan\w*|steps?|timeline|implement\w*|schedule|roadmap|how do i start|get started|next",
+    9: r"monitor\w*|track\w*|review\w*|adjust\w*|revisit|feedback|progress|looking back",
+}
+
+
+@functools.lru_cache(maxsize=1)
+def knowledge_sections():
+    """
+    Split `knowledge` by its markdown headings.
+
+    Returns:
+        tuple: (title, stages, closing), where stages maps each stage number to its '### N. Title' section,
+            and closing holds the general sections after the last stage
+    """
+    title, stages, closing = [], {}, []
+    current = title
+    for line in knowledge.strip().split("\n"):
+        heading = re.match(r"### (\d+)\. ", line)
+        if heading:
+            current = stages.setdefault(int(heading.group(1)), [])
+        elif line.startswith("## ") and stages and not re.match(r"## [IVX]+\. ", line):
+            current = closing
+        elif line.startswith("## "):
+            # Part headings (I., II., III.) are dropped; the stage list gives the structure
+            continue
+        current.append(line)
+    return ("\n".join(title).strip(), {number: "\n".join(lines).strip() for number, lines in stages.items()},
+            "\n".join(closing).strip())
+
+
+def knowledge_mode():
+    """
+    'stage' (default) to send the current stage's part of `knowledge`, or 'full' for all of it.
+    """
+    return os.getenv("KNOWLEDGE_MODE", "stage")
+
+
+@functools.lru_cache(maxsize=16)
+def stage_knowledge(stage):
+    """
+    The part of `knowledge` for a stage of the decision process.
+
+    Args:
+        stage (int): The current stage (1-9), or None for the whole guide
+
+    Returns:
+        str: The title, the list of all stages, the current and neighbouring stages in full and the closing
+            considerations
+    """
+    if stage is None:
+        return knowledge
+    title, stages, closing = knowledge_sections()
+    stage_list = "\n".join(f"{number}. {section.split(chr(10))[0][len(f'### {number}. '):]}"
+                           for number, section in stages.items())
+    shown = [number for number in (stage - 1, stage, stage + 1) if number in stages]
+    return "\n\n".join([
+        title,
+        f"## The Stages\n{stage_list}",
+        f"## Current Stage\nThe conversation appears to be at stage {stage}. Stages {shown[0]} to {shown[-1]} "
+        f"in detail (move on to the next stage when it is FULLY explored):",
+        *(stages[number] for number in shown),
+        closing,
+    ]) + "\n"
+
+
+class StageTracker:
+    def __init__(self, decay=0.4):
+        """
+        Track the decision stage of one session.
+
+        Args:
+            decay (float): Weight of the previous scores at each new message; lower forgets faster
+        """
+        self.decay = decay
+        self._cues = {stage: re.compile(rf"\b(?:{cues})\b", re.IGNORECASE) for stage, cues in STAGE_CUES.items()}
+        self.reset()
+
+    def reset(self):
+        """
+        Start a new session, at the first stage.
+        """
+        self.scores = dict.fromkeys(STAGE_CUES, 0.0)
+        self.current = 1
+        self.changes = 0
+
+    def observe(self, text):
+        """
+        Update the stage from a message. Without any cue words the stage stays where it is.
+
+        Args:
+            text (str): The user's message
+        """
+        for stage, cues in self._cues.items():
+            self.scores[stage] = self.scores[stage] * self.decay + len(cues.findall(str(text)))
+        best = max(self.scores, key=lambda stage: (self.scores[stage], stage == self.current))
+        if self.scores[best] > self.scores[self.current]:
+            self.current = best
+            self.changes += 1
+
+    @property
+    def stage(self):
+        """
+        The stage to send the knowledge of, or None in KNOWLEDGE_MODE=full.
+        """
+        if knowledge_mode() == "full":
+            return None
+        return self.current
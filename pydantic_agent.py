@@ -1,24 +1,33 @@
-import os
-from dotenv import load_dotenv
+import time
+import functools
 from datetime import date
-from tavily import TavilyClient
-import json
-import asyncio
-import nest_asyncio
 
-# Pydantic AI imports
-from pydantic_ai import Agent as PydanticAgent, RunContext
-from prompts import role, goal, instructions, knowledge
+from prompts import goal, stage_knowledge, StageTracker, prompt_date, dated_role, dated_instructions
+from tracing import traced_turn, traced_tool
 
-# Apply nest_asyncio to allow running async code in Jupyter-like environments
-nest_asyncio.apply()
+# Pydantic AI, the HTTP layer, the background event loop and the search modules are imported on first use,
+# and the Pydantic AI agent is built with the first message, so importing this module and creating an Agent
+# stay cheap (see benchmarks/cold_start.py). http_clients loads the .env file when it is first imported,
+# before any API key is read.
 
-# Load environment variables
-load_dotenv()
+# Display name of this agent. agent-ui.py reads it without importing the module (see agent_discovery.py)
+AGENT_NAME = "Pydantic Agent"
+
+
+@functools.lru_cache(maxsize=16)
+def system_prompt(day, stage=None):
+    """
+    The system prompt for a date (see prompts.prompt_date) and decision stage (see prompts.stage_knowledge),
+    built once per day and stage.
+    """
+    return "\n".join([
+        dated_role(day),
+        goal,
+        dated_instructions(day),
+        "You have access to two primary tools: date and web_search.",
+        stage_knowledge(stage)
+    ])
 
-# Initialize Tavily client
-tavily_api_key = os.getenv("TAVILY_API_KEY")
-tavily_client = TavilyClient(api_key=tavily_api_key)
 
 class Agent:
     def __init__(self, model="gpt-4o-mini"):
@@ -28,50 +37,81 @@ class Agent:
         Args:
             model (str): The language model to use
         """
-        self.name = "Pydantic Agent"
-        # Create the agent with a comprehensive system prompt
-        self.agent = PydanticAgent(
-            f'openai:{model}',
-            system_prompt="\n".join([
-                role,
-                goal,
-                instructions,
-                "You have access to two primary tools: date and web_search.",
-                knowledge
-            ]),
+        self.name = AGENT_NAME
+        self.model = model
+        # Built with the first message, see the agent property
+        self._agent = None
+        # Follows the decision stage of the conversation, for the knowledge in the system prompt
+        self.stage_tracker = StageTracker()
+        self.last_turn_failed = False
+
+        # Conversation history
+        self.messages = []
+
+    @property
+    def agent(self):
+        """
+        The Pydantic AI agent, built on first use.
+        """
+        if self._agent is None:
+            self._agent = self._create_agent()
+        return self._agent
+
+    def _create_agent(self):
+        """
+        Create the Pydantic AI agent with a comprehensive system prompt and register its tools.
+        """
+        from pydantic_ai import Agent as PydanticAgent
+        from pydantic_ai.models.openai import OpenAIModel
+        from http_clients import get_async_http_client
+
+        agent = PydanticAgent(
+            # The model talks to OpenAI over the process-wide connection pool
+            OpenAIModel(self.model, http_client=get_async_http_client("openai")),
             deps_type=str,
             result_type=str
         )
 
+        # Dynamic, so that the system prompt kept in the message history is replaced when the date or the
+        # decision stage changes
+        agent.system_prompt(dynamic=True)(self._dated_system_prompt)
+
         # Create tools
-        self._create_tools()
+        self._create_tools(agent)
+        return agent
 
-        # Conversation history
-        self.messages = []
+    def _dated_system_prompt(self) -> str:
+        """
+        The system prompt for today and the current decision stage.
+        """
+        return system_prompt(prompt_date(), self.stage_tracker.stage)
 
-    def _create_tools(self):
+    @staticmethod
+    def _create_tools(agent):
         """
         Create and register tools for the agent.
         """
-        @self.agent.tool
+        from pydantic_ai import RunContext
+
+        @agent.tool
+        @traced_tool("date")
         async def date_tool(ctx: RunContext[str]) -> str:
             """Get the current date"""
             today = date.today()
             return today.strftime("%B %d, %Y")
 
-        @self.agent.tool
+        @agent.tool
+        @traced_tool("web_search")
         async def web_search(ctx: RunContext[str], query: str) -> str:
             """Search the web for information"""
-            # Call Tavily's search and dump the results as a JSON string
-            search_response = tavily_client.search(query)
-            results = json.dumps(search_response.get('results', []))
-            print(f"Web Search Results for '{query}':")
-            print(results)
-            return results
+            from search_compaction import asearch
+
+            return await asearch(query)
 
     def chat(self, message):
         """
         Send a message and get a response.
+        The agent runs on the shared background event loop (see async_runtime.py).
 
         Args:
             message (str): User's input message
@@ -79,18 +119,25 @@ class Agent:
         Returns:
             str: Assistant's response
         """
-        try:
-            # Create new event loop
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+        from async_runtime import run_sync
+
+        return run_sync(self.achat(message))
+
+    @traced_turn
+    async def achat(self, message):
+        """
+        Send a message and get a response, without blocking the event loop.
 
-            # Run the async function in the loop
-            result = loop.run_until_complete(
-                self.agent.run(message, deps=message, message_history=self.messages)
-            )
+        Args:
+            message (str): User's input message
 
-            # Close the loop
-            loop.close()
+        Returns:
+            str: Assistant's response
+        """
+        try:
+            self.last_turn_failed = False
+            self.stage_tracker.observe(message)
+            result = await self.agent.run(message, deps=message, message_history=self.messages)
 
             # Maintain conversation history
             self.messages.extend(result.new_messages())
@@ -99,8 +146,62 @@ class Agent:
 
         except Exception as e:
             print(f"Error in chat: {e}")
+            self.last_turn_failed = True
             return "Sorry, I encountered an error processing your request."
 
+    async def _astream(self, message):
+        """
+        Run the agent in streaming mode, yielding text deltas and recording the new messages at the end.
+        """
+        async with self.agent.run_stream(message, deps=message, message_history=self.messages) as result:
+            async for text in result.stream_text(delta=True, debounce_by=None):
+                yield text
+            self.messages.extend(result.new_messages())
+
+    @traced_turn
+    def stream_chat(self, message):
+        """
+        Send a message and stream the response as it is generated.
+
+        Args:
+            message (str): User's input message
+
+        Yields:
+            str: Chunks of the assistant's response
+        """
+        from async_runtime import iterate_sync
+
+        try:
+            self.last_turn_failed = False
+            self.stage_tracker.observe(message)
+            # The async stream is driven on the shared background event loop, one chunk at a time
+            yield from iterate_sync(self._astream(message))
+
+        except Exception as e:
+            print(f"Error in chat: {e}")
+            self.last_turn_failed = True
+            yield "Sorry, I encountered an error processing your request."
+
+    def remember_turn(self, message, response):
+        """
+        Add a turn answered without the model (see response_cache.py) to the conversation, as if chat had
+        answered it.
+
+        Args:
+            message (str): User's input message
+            response (str): Assistant's response
+        """
+        from pydantic_ai.messages import ModelRequest, ModelResponse, SystemPromptPart, TextPart, UserPromptPart
+
+        self.stage_tracker.observe(message)
+        parts = [UserPromptPart(message)]
+        if not self.messages:
+            # The agent only writes its system prompt into a new conversation, marked as dynamic so that
+            # it is kept up to date (see _create_agent)
+            parts.insert(0, SystemPromptPart(self._dated_system_prompt(),
+                                             dynamic_ref=self._dated_system_prompt.__qualname__))
+        self.messages.extend([ModelRequest(parts), ModelResponse([TextPart(response)])])
+
     def clear_chat(self):
         """
         Reset the conversation context.
@@ -110,6 +211,7 @@ class Agent:
         """
         try:
             self.messages = []
+            self.stage_tracker.reset()
             return True
         except Exception as e:
             print(f"Error clearing chat: {e}")
@@ -127,8 +229,14 @@ def main():
         if query.lower() in ['exit', 'quit']:
             break
 
-        response = agent.chat(query)
-        print(f"Assistant: {response}")
+        print("Assistant: ", end="", flush=True)
+        start = time.perf_counter()
+        first_token = None
+        for chunk in agent.stream_chat(query):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            print(chunk, end="", flush=True)
+        print(f"\n(time to first token: {first_token or 0:.2f}s, total: {time.perf_counter() - start:.2f}s)")
 
 
 if __name__ == "__main__":
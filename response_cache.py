@@ -0,0 +1,429 @@
+import os
+import json
+import time
+import zlib
+import asyncio
+import sqlite3
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+from search_cache import normalize_query
+
+# Opt-in cache of whole responses, keyed on the conversation so far.
+#
+# Demos and regression runs replay the same opening turns over and over, and with a deterministic model
+# (temperature=0, or the scripted fake_servers.py) the same conversation gets the same answers. With
+# RESPONSE_CACHE=1, agent_discovery.load_agent wraps every agent in a CachedAgent, which answers a message
+# from this cache when the same agent type, model and prompts have seen the same conversation followed by the
+# same message, without any LLM or tool call. The key of a response is a hash of:
+#   - the context: agent type, model, prompt hash (prompts.py's texts, the date in the prompt and the
+#     KNOWLEDGE_MODE) and the conversation since the last clear_chat, normalized like search queries
+#   - the user's message, normalized the same way
+# Below RESPONSE_CACHE_THRESHOLD, a message that is not in the cache can still be answered by a cached
+# message of the same context whose words overlap it that much (Jaccard similarity of their word sets).
+# The earlier conversation always has to match exactly.
+#
+# Like the search cache, entries live in an in-process LRU with a time to live, and optionally in a SQLite
+# file shared between processes and runs. Failed turns are never stored, nor made part of the conversation
+# the next keys are built from (see CachedAgent._failed).
+#
+# On a hit the agent still has to know the turn happened, or its next answer would miss it: every agent
+# implements remember_turn(message, response), which adds the turn to its own history (messages, thread,
+# checkpoint or memory) and decision stage tracker as if chat had answered it.
+#
+# The cache is configured through environment variables:
+#   RESPONSE_CACHE             Set to 1 to turn it on (off by default)
+#   RESPONSE_CACHE_SIZE        Maximum number of responses kept in memory (default 512)
+#   RESPONSE_CACHE_TTL         Seconds before a response expires (default 86400)
+#   RESPONSE_CACHE_PATH        Path of the SQLite file for the disk tier (disabled when unset)
+#   RESPONSE_CACHE_THRESHOLD   Similarity from which a different message counts as the same (default 1.0:
+#                              exact matches only)
+
+ERROR_REPLY = "Sorry, I encountered an error"
+
+
+@functools.lru_cache(maxsize=4)
+def _prompt_hash(day, mode):
+    import prompts
+
+    texts = [prompts.dated_role(day), prompts.goal, prompts.dated_instructions(day), prompts.knowledge, mode,
+             prompts.langchain_react_prompt, prompts.llama_index_react_prompt]
+    return hashlib.sha256("\0".join(texts).encode("utf-8")).hexdigest()
+
+
+def prompt_hash():
+    """
+    A hash of the prompts the agents are built from, with today's date and the knowledge mode.
+    """
+    from prompts import prompt_date, knowledge_mode
+
+    return _prompt_hash(prompt_date(), knowledge_mode())
+
+
+def similarity(first, second):
+    """
+    Jaccard similarity of the word sets of two normalized messages.
+    """
+    first, second = set(first.split()), set(second.split())
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+def context_key(agent_type, model, turns):
+    """
+    The key of a conversation so far.
+
+    Args:
+        agent_type (str): Module name of the agent
+        model (str): The agent's model
+        turns (list): (message, response) pairs since the last clear_chat
+
+    Returns:
+        str: A hash of the agent type, model, prompt hash and normalized conversation
+    """
+    conversation = [[normalize_query(message), normalize_query(response)] for message, response in turns]
+    key = json.dumps([agent_type, model, prompt_hash(), conversation])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=512, ttl=86400, disk_path=None, threshold=1.0):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries (int): Maximum number of responses kept in memory
+            ttl (float): Default number of seconds before a response expires
+            disk_path (str): Path of the SQLite database used as the second tier, or None for memory only
+            threshold (float): Similarity from which a different message of the same context is a hit; 1.0
+                for exact matches only
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self.threshold = threshold
+        self._memory = OrderedDict()  # key -> (expires_at, context, message, response)
+        self._contexts = {}  # context -> keys in memory, for near-duplicate lookups
+        self._lock = threading.Lock()
+        self._db = None
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "near_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "writes": 0,
+        }
+
+    @staticmethod
+    def key(context, message):
+        return hashlib.sha256(f"{context}\0{message}".encode("utf-8")).hexdigest()
+
+    ### Disk tier ###
+    def _connect(self):
+        """
+        Open the SQLite database on first use.
+        """
+        if self._db is None and self.disk_path:
+            self._db = sqlite3.connect(self.disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, context TEXT NOT NULL, message TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "response BLOB NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS response_cache_context ON response_cache (context)")
+            self._db.commit()
+        return self._db
+
+    def _disk_get(self, key, now):
+        db = self._connect()
+        if db is None:
+            return None
+        row = db.execute("SELECT expires_at, context, message, response FROM response_cache WHERE key = ?",
+                         (key,)).fetchone()
+        if row is None:
+            return None
+        if row[0] <= now:
+            db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            db.commit()
+            self.counters["expirations"] += 1
+            return None
+        return row[0], row[1], row[2], zlib.decompress(row[3]).decode("utf-8")
+
+    def _disk_messages(self, context, now):
+        db = self._connect()
+        if db is None:
+            return []
+        return db.execute("SELECT key, message FROM response_cache WHERE context = ? AND expires_at > ?",
+                          (context, now)).fetchall()
+
+    def _disk_put(self, key, entry):
+        db = self._connect()
+        if db is None:
+            return
+        expires_at, context, message, response = entry
+        db.execute(
+            "INSERT OR REPLACE INTO response_cache (key, context, message, expires_at, response) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, context, message, expires_at, zlib.compress(response.encode("utf-8"))),
+        )
+        db.commit()
+
+    ### Memory tier ###
+    def _memory_drop(self, key):
+        _, context, _, _ = self._memory.pop(key)
+        keys = self._contexts.get(context)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._contexts[context]
+
+    def _memory_put(self, key, entry):
+        if key in self._memory:
+            self._memory_drop(key)
+        self._memory[key] = entry
+        self._contexts.setdefault(entry[1], set()).add(key)
+        # Evict least recently used responses until the bound holds again
+        while len(self._memory) > self.max_entries:
+            self._memory_drop(next(iter(self._memory)))
+            self.counters["evictions"] += 1
+
+    def _memory_get(self, key, now):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            self._memory_drop(key)
+            self.counters["expirations"] += 1
+            return None
+        self._memory.move_to_end(key)
+        return entry
+
+    def _lookup(self, key, now):
+        entry = self._memory_get(key, now)
+        if entry is not None:
+            return entry, "memory_hits"
+        entry = self._disk_get(key, now)
+        if entry is not None:
+            # Promote disk hits into memory so the next lookup is cheap
+            self._memory_put(key, entry)
+            return entry, "disk_hits"
+        return None, None
+
+    def _nearest(self, context, message, now):
+        """
+        The key of the cached message of a context most similar to message, if it reaches the threshold.
+        """
+        candidates = {key: self._memory[key][2] for key in self._contexts.get(context, ())}
+        candidates.update(self._disk_messages(context, now))
+        best, best_score = None, self.threshold
+        for key, cached in candidates.items():
+            score = similarity(message, cached)
+            if score >= best_score:
+                best, best_score = key, score
+        return best
+
+    ### Public interface ###
+    def get(self, context, message):
+        """
+        Look up the response to a message after a conversation.
+
+        Args:
+            context (str): The key of the conversation so far, see context_key
+            message (str): The user's message
+
+        Returns:
+            str: The cached response, or None on a miss
+        """
+        message = normalize_query(message)
+        now = time.time()
+        with self._lock:
+            entry, tier = self._lookup(self.key(context, message), now)
+            if entry is None and self.threshold < 1.0:
+                nearest = self._nearest(context, message, now)
+                if nearest is not None:
+                    entry, tier = self._lookup(nearest, now)
+                    tier = "near_hits" if entry is not None else None
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters[tier] += 1
+            return entry[3]
+
+    def put(self, context, message, response, ttl=None):
+        """
+        Store the response to a message after a conversation. Empty responses, and responses that contain the
+        error reply (possibly after streamed partial text), are skipped.
+
+        Args:
+            context (str): The key of the conversation so far, see context_key
+            message (str): The user's message
+            response (str): The agent's response
+            ttl (float): Seconds before this response expires, defaults to the cache's ttl
+        """
+        if not response or ERROR_REPLY in str(response):
+            return
+        message = normalize_query(message)
+        entry = (time.time() + (self.ttl if ttl is None else ttl), context, message, str(response))
+        key = self.key(context, message)
+        with self._lock:
+            self._memory_put(key, entry)
+            self._disk_put(key, entry)
+            self.counters["writes"] += 1
+
+    def flush(self):
+        """
+        Remove every response from both tiers and reset the counters.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._contexts.clear()
+            db = self._connect()
+            if db is not None:
+                db.execute("DELETE FROM response_cache")
+                db.commit()
+            self._reset_counters()
+
+    def stats(self):
+        """
+        Report the cache counters and current size.
+
+        Returns:
+            dict: Hit, miss, eviction and size figures
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._memory)
+            db = self._connect()
+            if db is not None:
+                stats["disk_entries"] = db.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+        hits = stats["memory_hits"] + stats["disk_hits"] + stats["near_hits"]
+        stats["hit_rate"] = hits / (hits + stats["misses"]) if hits + stats["misses"] else 0.0
+        return stats
+
+
+# The single cache shared by every cached agent
+load_dotenv()
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "86400")),
+    disk_path=os.getenv("RESPONSE_CACHE_PATH") or None,
+    threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", "1.0")),
+)
+
+
+class CachedAgent:
+    def __init__(self, agent, agent_type, cache=None):
+        """
+        Wrap an agent so that repeated conversations are answered from the response cache.
+        Everything but chat, achat, stream_chat and clear_chat is passed through to the agent.
+
+        Args:
+            agent: The agent, which must implement remember_turn(message, response)
+            agent_type (str): Module name of the agent, part of the cache key
+            cache (ResponseCache): The cache, defaults to the shared response_cache
+        """
+        self.agent = agent
+        self.agent_type = agent_type
+        self.cache = cache or response_cache
+        # The conversation since the last clear_chat, as (message, response) pairs
+        self.turns = []
+        # Only offer what the agent offers: callers check for achat and stream_chat with hasattr
+        if hasattr(agent, "achat"):
+            self.achat = self._achat
+        if hasattr(agent, "stream_chat"):
+            self.stream_chat = self._stream_chat
+
+    def __getattr__(self, name):
+        return getattr(self.agent, name)
+
+    def _context(self):
+        return context_key(self.agent_type, getattr(self.agent, "model", None), self.turns)
+
+    def _failed(self, response):
+        """
+        Whether the agent's last turn failed, in which case its response is neither cached nor added to turns.
+        Every agent sets last_turn_failed when a turn fails and clears it when the next one starts. A response
+        that is empty or contains the error reply counts as failed as well: a stream can fail after some text
+        was already sent, and an agent may not set the flag.
+        """
+        return getattr(self.agent, "last_turn_failed", False) or not response or ERROR_REPLY in str(response)
+
+    def _answered(self, context, message, response):
+        if self._failed(response):
+            return
+        self.cache.put(context, message, response)
+        self.turns.append((message, str(response)))
+
+    def chat(self, message):
+        """
+        Answer from the cache, or from the agent on a miss.
+        """
+        context = self._context()
+        response = self.cache.get(context, message)
+        if response is not None:
+            self.agent.remember_turn(message, response)
+            self.turns.append((message, response))
+            return response
+        response = self.agent.chat(message)
+        self._answered(context, message, response)
+        return response
+
+    async def _achat(self, message):
+        """
+        Async version of chat.
+        """
+        context = self._context()
+        response = self.cache.get(context, message)
+        if response is not None:
+            await asyncio.to_thread(self.agent.remember_turn, message, response)
+            self.turns.append((message, response))
+            return response
+        response = await self.agent.achat(message)
+        self._answered(context, message, response)
+        return response
+
+    def _stream_chat(self, message):
+        """
+        Streaming version of chat. A cached response comes as a single chunk.
+        """
+        context = self._context()
+        response = self.cache.get(context, message)
+        if response is not None:
+            self.agent.remember_turn(message, response)
+            self.turns.append((message, response))
+            yield response
+            return
+        chunks = []
+        for chunk in self.agent.stream_chat(message):
+            chunks.append(chunk)
+            yield chunk
+        self._answered(context, message, "".join(chunks))
+
+    def clear_chat(self):
+        self.turns = []
+        return self.agent.clear_chat()
+
+
+def main():
+    """
+    Inspect or flush the shared cache from the command line.
+    """
+    import sys
+
+    if "--flush" in sys.argv[1:]:
+        response_cache.flush()
+        print("Response cache flushed.")
+    print(json.dumps(response_cache.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import os
+import re
+import json
+import time
+import asyncio
+import zlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Shared web search cache.
+#
+# Every agent in this project exposes a web_search tool backed by Tavily. During a decision session the
+# agents tend to repeat the same (or trivially different) queries, so all of them go through the single
+# cache defined here. It has two tiers:
+#   - an in-process LRU, bounded both by number of entries and by total payload size
+#   - an optional on-disk SQLite tier with zlib-compressed payloads, shared between processes and runs
+# Every entry carries its own expiry time.
+#
+# The cache is configured through environment variables:
+#   SEARCH_CACHE_SIZE       Maximum number of entries kept in memory (default 256)
+#   SEARCH_CACHE_MAX_BYTES  Maximum total size of the in-memory payloads (default 8 MB)
+#   SEARCH_CACHE_TTL        Seconds before an entry expires (default 3600)
+#   SEARCH_CACHE_PATH       Path of the SQLite file for the disk tier (disabled when unset)
+#   SEARCH_CACHE_BYPASS     Set to 1 to send every search straight to Tavily
+
+
+def normalize_query(query):
+    """
+    Normalize a search query so that trivially different queries share a cache entry.
+
+    Args:
+        query (str): The raw search query
+
+    Returns:
+        str: The query lower-cased, with punctuation dropped and whitespace collapsed
+    """
+    query = str(query).lower()
+    query = re.sub(r"[^\w\s]", " ", query)
+    return " ".join(query.split())
+
+
+class SearchCache:
+    def __init__(self, max_entries=256, max_bytes=8 * 1024 * 1024, ttl=3600, disk_path=None, bypass=False):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries (int): Maximum number of entries kept in memory
+            max_bytes (int): Maximum total size in bytes of the in-memory payloads
+            ttl (float): Default number of seconds before an entry expires
+            disk_path (str): Path of the SQLite database used as the second tier, or None for memory only
+            bypass (bool): If True, the cache is never read or written
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self.bypass = bypass
+        self._memory = OrderedDict()  # key -> (expires_at, payload)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "writes": 0,
+        }
+
+    ### Disk tier ###
+    def _connect(self):
+        """
+        Open the SQLite database on first use.
+        """
+        if self._db is None and self.disk_path:
+            self._db = sqlite3.connect(self.disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, payload BLOB NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _disk_get(self, key, now):
+        db = self._connect()
+        if db is None:
+            return None
+        row = db.execute("SELECT expires_at, payload FROM search_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        expires_at, blob = row
+        if expires_at <= now:
+            db.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+            db.commit()
+            self.counters["expirations"] += 1
+            return None
+        return expires_at, zlib.decompress(blob).decode("utf-8")
+
+    def _disk_put(self, key, expires_at, payload):
+        db = self._connect()
+        if db is None:
+            return
+        db.execute(
+            "INSERT OR REPLACE INTO search_cache (key, expires_at, payload) VALUES (?, ?, ?)",
+            (key, expires_at, zlib.compress(payload.encode("utf-8"))),
+        )
+        db.commit()
+
+    ### Memory tier ###
+    def _memory_put(self, key, expires_at, payload):
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key)[1])
+        self._memory[key] = (expires_at, payload)
+        self._memory_bytes += len(payload)
+        # Evict least recently used entries until both bounds hold again
+        while self._memory and (len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes):
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.counters["evictions"] += 1
+
+    def _memory_get(self, key, now):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._memory[key]
+            self._memory_bytes -= len(entry[1])
+            self.counters["expirations"] += 1
+            return None
+        self._memory.move_to_end(key)
+        return entry[1]
+
+    ### Public interface ###
+    def get(self, query):
+        """
+        Look up the results for a query.
+
+        Args:
+            query (str): The search query
+
+        Returns:
+            The cached results, or None on a miss
+        """
+        if self.bypass:
+            return None
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            payload = self._memory_get(key, now)
+            if payload is not None:
+                self.counters["memory_hits"] += 1
+                return json.loads(payload)
+            entry = self._disk_get(key, now)
+            if entry is not None:
+                # Promote disk hits into memory so the next lookup is cheap
+                self._memory_put(key, entry[0], entry[1])
+                self.counters["disk_hits"] += 1
+                return json.loads(entry[1])
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, query, results, ttl=None):
+        """
+        Store the results for a query.
+
+        Args:
+            query (str): The search query
+            results: JSON-serializable search results
+            ttl (float): Seconds before this entry expires, defaults to the cache's ttl
+        """
+        if self.bypass:
+            return
+        key = normalize_query(query)
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        payload = json.dumps(results)
+        with self._lock:
+            self._memory_put(key, expires_at, payload)
+            self._disk_put(key, expires_at, payload)
+            self.counters["writes"] += 1
+
+    def flush(self):
+        """
+        Remove every entry from both tiers and reset the counters.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            db = self._connect()
+            if db is not None:
+                db.execute("DELETE FROM search_cache")
+                db.commit()
+            self._reset_counters()
+
+    def stats(self):
+        """
+        Report the cache counters and current size.
+
+        Returns:
+            dict: Hit, miss, eviction and size figures
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._memory)
+            stats["bytes"] = self._memory_bytes
+            db = self._connect()
+            if db is not None:
+                stats["disk_entries"] = db.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+# The single cache shared by every agent module
+load_dotenv()
+search_cache = SearchCache(
+    max_entries=int(os.getenv("SEARCH_CACHE_SIZE", "256")),
+    max_bytes=int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", "3600")),
+    disk_path=os.getenv("SEARCH_CACHE_PATH") or None,
+    bypass=os.getenv("SEARCH_CACHE_BYPASS", "0") == "1",
+)
+
+
+def cached_search(client, query, bypass=False):
+    """
+    Search with Tavily, serving repeated queries from the shared cache.
+
+    Args:
+        client (TavilyClient): The Tavily client used on a cache miss
+        query (str): The search query
+        bypass (bool): If True, always call Tavily and do not touch the cache
+
+    Returns:
+        list: The 'results' list of the Tavily response
+    """
+    if not bypass:
+        results = search_cache.get(query)
+        if results is not None:
+            return results
+    search_response = client.search(query)
+    results = search_response.get('results', [])
+    if not bypass:
+        search_cache.put(query, results)
+    return results
+
+
+async def acached_search(client, query, bypass=False):
+    """
+    Async version of cached_search. Hits are served without leaving the event loop. On a miss, clients with
+    an asearch method (see http_clients.py) are awaited; otherwise the blocking call runs on the loop's
+    default executor.
+
+    Args:
+        client (TavilyClient): The Tavily client used on a cache miss
+        query (str): The search query
+        bypass (bool): If True, always call Tavily and do not touch the cache
+
+    Returns:
+        list: The 'results' list of the Tavily response
+    """
+    if not bypass:
+        results = search_cache.get(query)
+        if results is not None:
+            return results
+    if hasattr(client, "asearch"):
+        search_response = await client.asearch(query)
+    else:
+        search_response = await asyncio.to_thread(client.search, query)
+    results = search_response.get('results', [])
+    if not bypass:
+        search_cache.put(query, results)
+    return results
+
+
+def main():
+    """
+    Inspect or flush the shared cache from the command line.
+    """
+    import sys
+
+    if "--flush" in sys.argv[1:]:
+        search_cache.flush()
+        print("Search cache flushed.")
+    print(json.dumps(search_cache.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
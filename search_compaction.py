@@ -0,0 +1,334 @@
+import os
+import re
+import json
+import time
+import threading
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import numpy as np
+from dotenv import load_dotenv
+
+from history import count_tokens
+from search_cache import cached_search, acached_search
+
+# Compaction of web search results before they reach the model.
+#
+# A Tavily response carries every field of every result. Passed on verbatim, the tool output is often the
+# largest part of a turn's prompt. compact_search_output sits between the search cache and the model:
+#   - results whose URLs differ only in scheme, "www.", trailing slash, fragment or tracking parameters
+#     are dropped as duplicates
+#   - the content of each result is split into passages of a few sentences
+#   - passages are ranked against the query with BM25, scored for all passages at once with numpy
+#   - passages that repeat an already selected one nearly word for word are skipped
+#   - the best passages are kept until the token budget is filled, and regrouped under their result's
+#     title and URL
+# The cache keeps the full results, so the budget can change without searching again. search and asearch are
+# the whole web_search tool of every agent: a search through the shared cache, compacted.
+#
+# Configured through environment variables:
+#   SEARCH_RESULT_TOKENS   Token budget for the output of one search (default 1000)
+#   SEARCH_PASSAGE_WORDS   Target passage length in words (default 60)
+#   SEARCH_COMPACTION      Set to 0 to pass the results on verbatim
+#   SEARCH_VERBOSE         Set to 1 to print the compacted output of every search, not just a summary line
+
+load_dotenv()
+
+# BM25 parameters, the usual defaults
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Word 3-gram Jaccard similarity above which a passage counts as a near-duplicate of a kept one
+DUPLICATE_SIMILARITY = 0.8
+
+# Query parameters that only track the visitor and do not change the page
+TRACKING_PARAMETERS = re.compile(r"^(utm_\w+|gclid|fbclid|mc_cid|mc_eid|ref|ref_src)$")
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have how i in is it its of on or that the this to was were what
+when where which who why will with you your
+""".split())
+
+_stats = {
+    "searches": 0,
+    "results_in": 0,
+    "results_out": 0,
+    "duplicates_dropped": 0,
+    "raw_bytes": 0,
+    "compact_bytes": 0,
+    "raw_tokens": 0,
+    "compact_tokens": 0,
+    "seconds": 0.0,
+}
+_stats_lock = threading.Lock()
+
+
+def normalize_url(url):
+    """
+    Reduce a URL to the part that identifies the page.
+
+    Args:
+        url (str): The URL of a search result
+
+    Returns:
+        str: Host and path lower-cased, without scheme, "www.", fragment, trailing slash or tracking parameters
+    """
+    parts = urlsplit(str(url).strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query) if not TRACKING_PARAMETERS.match(k)))
+    path = parts.path.rstrip("/")
+    return f"{host}{path}?{query}" if query else f"{host}{path}"
+
+
+def tokenize(text):
+    """
+    Split text into lower-case terms for ranking, without stopwords.
+    """
+    return [term for term in re.findall(r"\w+", str(text).lower()) if term not in STOPWORDS]
+
+
+def split_passages(text, passage_words=60):
+    """
+    Split text into passages of whole sentences, each about passage_words long.
+    A sentence longer than that (or text without punctuation) is cut into passage_words-sized pieces.
+
+    Args:
+        text (str): The content of a search result
+        passage_words (int): Target passage length in words
+
+    Returns:
+        list: The passages, in their original order
+    """
+    sentences = []
+    for sentence in re.split(r"(?<=[.!?])\s+", " ".join(str(text).split())):
+        words = sentence.split()
+        sentences += [" ".join(words[i:i + passage_words]) for i in range(0, len(words), passage_words)]
+    passages, current, length = [], [], 0
+    for sentence in sentences:
+        words = len(sentence.split())
+        if current and length + words > passage_words:
+            passages.append(" ".join(current))
+            current, length = [], 0
+        current.append(sentence)
+        length += words
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+def bm25_scores(query, passages, k1=BM25_K1, b=BM25_B):
+    """
+    Score passages against a query with BM25, for all passages at once.
+    The passages are the collection, so a query term found in every passage counts for little.
+
+    Args:
+        query (str): The search query
+        passages (list): The tokenized passages, each a list of terms
+        k1 (float): Term frequency saturation
+        b (float): Length normalization
+
+    Returns:
+        numpy.ndarray: One score per passage
+    """
+    query_terms = list(dict.fromkeys(tokenize(query)))
+    if not passages or not query_terms:
+        return np.zeros(len(passages))
+    term_ids = {term: i for i, term in enumerate(query_terms)}
+    lengths = np.array([len(terms) for terms in passages], dtype=float)
+
+    # Flatten every occurrence of a query term into (passage, term) index pairs and count them in one pass
+    rows, cols = [], []
+    for row, terms in enumerate(passages):
+        for term in terms:
+            col = term_ids.get(term)
+            if col is not None:
+                rows.append(row)
+                cols.append(col)
+    tf = np.zeros((len(passages), len(query_terms)))
+    np.add.at(tf, (np.array(rows, dtype=int), np.array(cols, dtype=int)), 1)
+
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log1p((len(passages) - df + 0.5) / (df + 0.5))
+    average_length = lengths.mean() or 1.0
+    norm = k1 * (1 - b + b * lengths / average_length)
+    return ((tf * (k1 + 1)) / (tf + norm[:, None]) * idf).sum(axis=1)
+
+
+def _shingles(terms, size=3):
+    if len(terms) < size:
+        return {tuple(terms)}
+    return {tuple(terms[i:i + size]) for i in range(len(terms) - size + 1)}
+
+
+def _is_near_duplicate(shingles, kept):
+    for other in kept:
+        overlap = len(shingles & other)
+        if overlap and overlap / len(shingles | other) >= DUPLICATE_SIMILARITY:
+            return True
+    return False
+
+
+def compact_results(query, results, max_tokens=1000, passage_words=60):
+    """
+    Rank, deduplicate and trim search results to a token budget.
+
+    Args:
+        query (str): The search query the results answer
+        results (list): The 'results' list of a Tavily response
+        max_tokens (int): Token budget for the returned JSON
+        passage_words (int): Target passage length in words
+
+    Returns:
+        tuple: (compacted results as a JSON string, metrics dict)
+    """
+    start = time.perf_counter()
+    raw = json.dumps(results)
+
+    # Drop results that point at the same page, keeping Tavily's first (best) one
+    unique, seen = [], set()
+    for result in results:
+        key = normalize_url(result.get("url", ""))
+        if key and key in seen:
+            continue
+        seen.add(key)
+        unique.append(result)
+
+    # Split every result into passages and rank all of them together. A result without content is one empty
+    # passage, so its title and URL can still be kept
+    passages = []  # (result index, position in the result, text, terms)
+    for index, result in enumerate(unique):
+        for position, text in enumerate(split_passages(result.get("content") or "", passage_words) or [""]):
+            passages.append((index, position, text, tokenize(text)))
+    scores = bm25_scores(query, [terms for _, _, _, terms in passages])
+    # Highest score first; ties keep Tavily's order. Terms are not stemmed ("renting" does not match "rent"),
+    # so passages sharing no term with the query come last, in Tavily's order, and the budget decides
+    order = sorted(range(len(passages)), key=lambda i: (-scores[i], passages[i][0], passages[i][1]))
+
+    # Fill the budget with the best passages. A result's title and URL are paid for with its first passage.
+    selected = {}  # result index -> list of (position, text)
+    kept_shingles = []
+    used = 2  # the enclosing brackets
+    for i in order:
+        index, position, text, terms = passages[i]
+        shingles = _shingles(terms) if terms else None
+        if shingles and _is_near_duplicate(shingles, kept_shingles):
+            continue
+        cost = count_tokens(text) + 2
+        if index not in selected:
+            result = unique[index]
+            cost += count_tokens(f"{result.get('title', '')} {result.get('url', '')}") + 12
+        if used + cost > max_tokens and selected:
+            continue
+        selected.setdefault(index, []).append((position, text))
+        if shingles:
+            kept_shingles.append(shingles)
+        used += cost
+
+    # Results appear in the order of their best passage, their passages in reading order
+    compacted = []
+    for index, chosen in selected.items():
+        result = unique[index]
+        compacted.append({
+            "title": result.get("title", ""),
+            "url": result.get("url", ""),
+            "content": " ... ".join(text for _, text in sorted(chosen) if text),
+        })
+    output = json.dumps(compacted)
+
+    raw_tokens = count_tokens(raw)
+    compact_tokens = count_tokens(output)
+    metrics = {
+        "results_in": len(results),
+        "results_out": len(compacted),
+        "duplicates_dropped": len(results) - len(unique),
+        "passages": len(passages),
+        "passages_kept": sum(len(chosen) for chosen in selected.values()),
+        "raw_bytes": len(raw.encode("utf-8")),
+        "compact_bytes": len(output.encode("utf-8")),
+        "raw_tokens": raw_tokens,
+        "compact_tokens": compact_tokens,
+        "seconds": time.perf_counter() - start,
+    }
+    metrics["bytes_saved"] = metrics["raw_bytes"] - metrics["compact_bytes"]
+    metrics["tokens_saved"] = raw_tokens - compact_tokens
+    return output, metrics
+
+
+def _record(metrics):
+    with _stats_lock:
+        _stats["searches"] += 1
+        for key in ("results_in", "results_out", "duplicates_dropped", "raw_bytes", "compact_bytes",
+                    "raw_tokens", "compact_tokens", "seconds"):
+            _stats[key] += metrics[key]
+
+
+def compact_search_output(query, results):
+    """
+    Turn search results into the web_search tool output, compacted unless SEARCH_COMPACTION=0.
+    Prints one summary line per search, or the full output with SEARCH_VERBOSE=1.
+
+    Args:
+        query (str): The search query
+        results (list): The 'results' list of a Tavily response
+
+    Returns:
+        str: The tool output, a JSON list of results
+    """
+    if os.getenv("SEARCH_COMPACTION", "1") == "0":
+        output = json.dumps(results)
+        print(f"Web Search Results for '{query}': {len(results)} results, {len(output)} bytes")
+    else:
+        output, metrics = compact_results(
+            query,
+            results,
+            max_tokens=int(os.getenv("SEARCH_RESULT_TOKENS", "1000")),
+            passage_words=int(os.getenv("SEARCH_PASSAGE_WORDS", "60")),
+        )
+        _record(metrics)
+        print(f"Web Search Results for '{query}': {metrics['results_out']}/{metrics['results_in']} results, "
+              f"{metrics['raw_tokens']} -> {metrics['compact_tokens']} tokens "
+              f"({metrics['bytes_saved']} bytes saved)")
+    if os.getenv("SEARCH_VERBOSE", "0") == "1":
+        print(output)
+    return output
+
+
+def search(query):
+    """
+    Search the web through the shared search cache (see search_cache.py) and compact the results.
+    The Tavily client, and with it the HTTP layer, is imported on the first search.
+
+    Args:
+        query (str): The search query
+
+    Returns:
+        str: The tool output, see compact_search_output
+    """
+    from http_clients import tavily_client
+
+    return compact_search_output(query, cached_search(tavily_client(), query))
+
+
+async def asearch(query):
+    """
+    Async version of search.
+    """
+    from http_clients import tavily_client
+
+    return compact_search_output(query, await acached_search(tavily_client(), query))
+
+
+def compaction_stats():
+    """
+    Report the totals of every compaction in this process.
+
+    Returns:
+        dict: Searches, results, bytes and tokens before and after compaction, and the savings
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["bytes_saved"] = stats["raw_bytes"] - stats["compact_bytes"]
+    stats["tokens_saved"] = stats["raw_tokens"] - stats["compact_tokens"]
+    stats["token_ratio"] = stats["compact_tokens"] / stats["raw_tokens"] if stats["raw_tokens"] else 1.0
+    return stats
@@ -0,0 +1,406 @@
+import os
+import time
+import uuid
+import asyncio
+import threading
+import argparse
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel
+
+from agent_discovery import discover_agents, load_agent
+from http_clients import warm_up, pool_stats
+from search_compaction import compaction_stats
+
+# Multi-session API server for all agent types.
+#
+# Every session owns one agent of the type it was created with and exposes the agents' common contract
+# (chat / clear_chat) over HTTP, plus token streaming over a WebSocket. The server runs on a single asyncio
+# loop:
+#   - agents with an achat coroutine run on the loop itself; blocking work (building an agent, chat and
+#     stream_chat of agents without async support) goes to a bounded worker pool
+#   - each agent type has a semaphore bounding how many of its turns run at once, so a slow framework
+#     cannot take over the worker pool
+#   - a session runs one turn at a time, and sessions idle for longer than idle_timeout are evicted
+#   - connections to the providers are opened at start-up, and all sessions share their pools
+#     (see http_clients.py)
+#
+# Endpoints:
+#   GET    /agents                        Agent types and their display names
+#   POST   /sessions                      {"agent_type": "anthropic_agent"} -> {"session_id": ...}
+#   POST   /sessions/{id}/chat            {"message": ...} -> {"response": ..., "elapsed": ...}
+#   POST   /sessions/{id}/clear           Reset the session's conversation (clear_chat)
+#   DELETE /sessions/{id}                 End the session
+#   WS     /sessions/{id}/stream          Send {"message": ...}, receive {"type": "chunk", "text": ...}
+#                                         messages followed by {"type": "done", ...}
+#   GET    /stats                         Sessions, turns and concurrency per agent type, HTTP pool metrics and
+#                                         search compaction savings
+#
+# Usage: python server.py [--port 8000] [--concurrency 8] [--limit crewai_agent=2] [--idle-timeout 1800]
+
+
+class ChatRequest(BaseModel):
+    message: str
+
+
+class SessionRequest(BaseModel):
+    agent_type: str
+
+
+class Session:
+    def __init__(self, session_id, agent_type, agent):
+        self.id = session_id
+        self.agent_type = agent_type
+        self.agent = agent
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.turns = 0
+        # One turn at a time per conversation
+        self.lock = asyncio.Lock()
+
+
+class SessionManager:
+    def __init__(self, agent_types, concurrency=8, limits=None, workers=32, idle_timeout=1800,
+                 max_sessions=1000, sweep_interval=30):
+        """
+        Initialize the session manager.
+
+        Args:
+            agent_types (dict): Module name -> display name of the agent types that may be served
+            concurrency (int): Default number of turns per agent type that may run at the same time
+            limits (dict): Per agent type overrides of concurrency
+            workers (int): Size of the worker pool for blocking agent calls
+            idle_timeout (float): Seconds without a turn after which a session is evicted
+            max_sessions (int): Maximum number of open sessions
+            sweep_interval (float): Seconds between two idle-session sweeps
+        """
+        self.agent_types = agent_types
+        self.concurrency = concurrency
+        self.limits = dict(limits or {})
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.sweep_interval = sweep_interval
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent-worker")
+        self.sessions = {}
+        self._semaphores = {}
+        self._sweeper = None
+        self.counters = {"sessions_created": 0, "sessions_evicted": 0, "sessions_closed": 0,
+                         "turns": 0, "errors": 0}
+        self.in_flight = {agent_type: 0 for agent_type in agent_types}
+        self.turn_seconds = {agent_type: 0.0 for agent_type in agent_types}
+
+    ### Lifecycle ###
+    def start(self):
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        self.sessions.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _sweep(self):
+        """
+        Periodically evict sessions that have been idle for longer than idle_timeout.
+        """
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.evict_idle()
+
+    def evict_idle(self):
+        """
+        Evict the idle sessions now.
+
+        Returns:
+            int: Number of sessions evicted
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [session_id for session_id, session in self.sessions.items()
+                if session.last_used < cutoff and not session.lock.locked()]
+        for session_id in idle:
+            del self.sessions[session_id]
+        self.counters["sessions_evicted"] += len(idle)
+        return len(idle)
+
+    def _semaphore(self, agent_type):
+        if agent_type not in self._semaphores:
+            self._semaphores[agent_type] = asyncio.Semaphore(self.limits.get(agent_type, self.concurrency))
+        return self._semaphores[agent_type]
+
+    async def run_blocking(self, func, *args):
+        """
+        Run a blocking call on the worker pool.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    ### Sessions ###
+    async def create_session(self, agent_type):
+        """
+        Start a session with a new agent of the given type.
+
+        Returns:
+            Session: The new session
+        """
+        if agent_type not in self.agent_types:
+            raise HTTPException(status_code=404, detail=f"Unknown agent type: {agent_type}")
+        if len(self.sessions) >= self.max_sessions:
+            self.evict_idle()
+            if len(self.sessions) >= self.max_sessions:
+                raise HTTPException(status_code=503, detail="Too many open sessions")
+        # Building an agent can import its framework and call remote APIs, so it runs on the worker pool
+        async with self._semaphore(agent_type):
+            agent = await self.run_blocking(load_agent, agent_type)
+        session = Session(uuid.uuid4().hex, agent_type, agent)
+        self.sessions[session.id] = session
+        self.counters["sessions_created"] += 1
+        return session
+
+    def get_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired session")
+        return session
+
+    def close_session(self, session_id):
+        self.get_session(session_id)
+        del self.sessions[session_id]
+        self.counters["sessions_closed"] += 1
+
+    ### Turns ###
+    async def _turn(self, session, run):
+        """
+        Run one turn of a session under its lock and its agent type's semaphore, and account for it.
+        """
+        async with session.lock:
+            async with self._semaphore(session.agent_type):
+                self.in_flight[session.agent_type] += 1
+                start = time.perf_counter()
+                try:
+                    return await run()
+                except Exception:
+                    self.counters["errors"] += 1
+                    raise
+                finally:
+                    self.in_flight[session.agent_type] -= 1
+                    self.turn_seconds[session.agent_type] += time.perf_counter() - start
+                    self.counters["turns"] += 1
+                    session.turns += 1
+                    session.last_used = time.monotonic()
+
+    async def chat(self, session, message):
+        """
+        Run a turn and return the agent's response.
+        """
+        agent = session.agent
+
+        async def run():
+            if hasattr(agent, "achat"):
+                return await agent.achat(message)
+            return await self.run_blocking(agent.chat, message)
+
+        return await self._turn(session, run)
+
+    async def stream(self, session, message, send):
+        """
+        Run a turn, passing the response to send() chunk by chunk.
+        stream_chat is a blocking generator, so it is consumed on the worker pool and its chunks are handed
+        back to the loop through a queue. Agents without stream_chat send their whole response as one chunk.
+
+        Args:
+            session (Session): The session
+            message (str): User's input message
+            send (coroutine function): Called with each chunk
+
+        Returns:
+            str: The full response
+        """
+        agent = session.agent
+        if not hasattr(agent, "stream_chat"):
+            response = str(await self.chat(session, message))
+            await send(response)
+            return response
+
+        loop = asyncio.get_running_loop()
+
+        async def run():
+            chunks = asyncio.Queue()
+            done = object()
+            stop = threading.Event()
+
+            def produce():
+                stream = agent.stream_chat(message)
+                try:
+                    for chunk in stream:
+                        if stop.is_set():
+                            break
+                        loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+                finally:
+                    stream.close()
+                    loop.call_soon_threadsafe(chunks.put_nowait, done)
+
+            producer = loop.run_in_executor(self.executor, produce)
+            parts = []
+            try:
+                while (chunk := await chunks.get()) is not done:
+                    parts.append(chunk)
+                    await send(chunk)
+            finally:
+                # If send fails, e.g. the client went away, the generator is stopped at its next chunk. The turn,
+                # and with it the session lock, only ends once it has finished, so no other turn uses the agent
+                # in the meantime
+                stop.set()
+                await producer
+            return "".join(parts)
+
+        return await self._turn(session, run)
+
+    def stats(self):
+        """
+        Report sessions, turns and concurrency per agent type.
+        """
+        per_type = {}
+        for agent_type in self.agent_types:
+            per_type[agent_type] = {
+                "sessions": sum(1 for s in self.sessions.values() if s.agent_type == agent_type),
+                "in_flight": self.in_flight[agent_type],
+                "limit": self.limits.get(agent_type, self.concurrency),
+                "turn_seconds": round(self.turn_seconds[agent_type], 3),
+            }
+        return {"sessions": len(self.sessions), **self.counters, "agent_types": per_type}
+
+
+def create_app(manager, warm_up_connections=0):
+    """
+    Build the FastAPI application around a session manager.
+
+    Args:
+        manager (SessionManager): The manager holding the sessions
+        warm_up_connections (int): Connections to open to each provider at start-up
+
+    Returns:
+        FastAPI: The application
+    """
+    @asynccontextmanager
+    async def lifespan(app):
+        manager.start()
+        if warm_up_connections:
+            await manager.run_blocking(warm_up, None, warm_up_connections)
+        yield
+        await manager.stop()
+
+    app = FastAPI(title="Agent Examples API", lifespan=lifespan)
+    app.state.manager = manager
+
+    @app.get("/agents")
+    async def list_agents():
+        return manager.agent_types
+
+    @app.post("/sessions")
+    async def create_session(request: SessionRequest):
+        session = await manager.create_session(request.agent_type)
+        return {"session_id": session.id, "agent_type": session.agent_type, "name": session.agent.name}
+
+    @app.post("/sessions/{session_id}/chat")
+    async def chat(session_id: str, request: ChatRequest):
+        session = manager.get_session(session_id)
+        start = time.perf_counter()
+        try:
+            response = await manager.chat(session, request.message)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error in chat: {e}")
+        return {"response": str(response), "elapsed": time.perf_counter() - start}
+
+    @app.post("/sessions/{session_id}/clear")
+    async def clear_chat(session_id: str):
+        session = manager.get_session(session_id)
+        async with session.lock:
+            cleared = await manager.run_blocking(session.agent.clear_chat)
+        return {"cleared": bool(cleared)}
+
+    @app.delete("/sessions/{session_id}")
+    async def close_session(session_id: str):
+        manager.close_session(session_id)
+        return {"closed": True}
+
+    @app.websocket("/sessions/{session_id}/stream")
+    async def stream(websocket: WebSocket, session_id: str):
+        await websocket.accept()
+        session = manager.sessions.get(session_id)
+        if session is None:
+            await websocket.send_json({"type": "error", "detail": "Unknown or expired session"})
+            await websocket.close()
+            return
+        try:
+            while True:
+                request = await websocket.receive_json()
+                start = time.perf_counter()
+                first_token = None
+
+                async def send(chunk):
+                    nonlocal first_token
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    await websocket.send_json({"type": "chunk", "text": chunk})
+
+                try:
+                    response = await manager.stream(session, request["message"], send)
+                except Exception as e:
+                    await websocket.send_json({"type": "error", "detail": f"Error in chat: {e}"})
+                    continue
+                await websocket.send_json({"type": "done", "response": response, "first_token": first_token,
+                                           "elapsed": time.perf_counter() - start})
+        except WebSocketDisconnect:
+            pass
+
+    @app.get("/stats")
+    async def stats():
+        return {**manager.stats(), "http_pools": pool_stats(), "search_compaction": compaction_stats()}
+
+    return app
+
+
+def parse_limits(items):
+    """
+    Parse per agent type concurrency limits given as AGENT_TYPE=N.
+    """
+    limits = {}
+    for item in items:
+        agent_type, limit = item.split("=", 1)
+        limits[agent_type] = int(limit)
+    return limits
+
+
+def main():
+    """
+    Serve every agent type found next to this module.
+    """
+    parser = argparse.ArgumentParser(description="Serve the agents over HTTP and WebSocket.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("AGENT_CONCURRENCY", "8")),
+                        help="Turns per agent type that may run at the same time")
+    parser.add_argument("--limit", action="append", default=[], metavar="AGENT_TYPE=N",
+                        help="Concurrency override for one agent type, e.g. crewai_agent=2")
+    parser.add_argument("--workers", type=int, default=32, help="Worker threads for blocking agent calls")
+    parser.add_argument("--idle-timeout", type=float, default=1800, help="Seconds before an idle session is evicted")
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--warm-up", type=int, default=4, metavar="N",
+                        help="Connections to open to each provider at start-up (0 to skip)")
+    args = parser.parse_args()
+
+    manager = SessionManager(
+        discover_agents(os.path.dirname(os.path.abspath(__file__))),
+        concurrency=args.concurrency,
+        limits=parse_limits(args.limit),
+        workers=args.workers,
+        idle_timeout=args.idle_timeout,
+        max_sessions=args.max_sessions,
+    )
+    uvicorn.run(create_app(manager, warm_up_connections=args.warm_up), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
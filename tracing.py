@@ -0,0 +1,483 @@
+import os
+import json
+import time
+import atexit
+import inspect
+import functools
+import threading
+import contextvars
+
+# Tracing of turns, LLM requests and tool calls.
+#
+# Every agent module reports through this module, whatever its framework:
+#   - turn   one chat / achat / stream_chat call (traced_turn)
+#   - llm    one HTTP request to OpenAI or Anthropic, with its token usage. These are recorded by the shared
+#            transports in http_clients.py, so they are seen even when a framework makes the call.
+#   - http   any other request on the shared transports (Tavily)
+#   - tool   one tool call, with the size of its input and output (traced_tool)
+# Spans nest through a context variable, so an LLM request or tool call is a child of the turn that caused it.
+#
+# Finished spans are written as JSON lines to the file named by TRACE_PATH. The field names follow
+# OpenTelemetry's span model (trace_id, span_id, parent_span_id, start_time_unix_nano, ...). When TRACE_PATH
+# is unset, tracing is off, and every hook returns after a single check.
+#
+# `python tracing.py trace.jsonl` prints where each traced turn spent its time.
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_span_id", "start_ns", "end_ns", "attributes",
+                 "status", "_start")
+
+    def __init__(self, name, kind, parent, attributes):
+        """
+        Start a span. Use start_span or span rather than creating one directly.
+
+        Args:
+            name (str): What the span measures, e.g. 'turn' or 'web_search'
+            kind (str): 'turn', 'llm', 'http', 'tool' or 'internal'
+            parent (Span): The enclosing span, or None for the root of a new trace
+            attributes (dict): Initial attributes
+        """
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self.end_ns = None
+        self.attributes = attributes
+        self.status = "ok"
+
+    def set(self, **attributes):
+        """
+        Add attributes to the span.
+        """
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        """
+        Finish the span and hand it to the exporter. Later calls do nothing.
+
+        Args:
+            error (BaseException): The exception the measured work ended with, if any
+        """
+        if self.end_ns is not None:
+            return
+        duration = time.perf_counter() - self._start
+        self.end_ns = self.start_ns + int(duration * 1e9)
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{type(error).__name__}: {error}"
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """
+    Stand-in returned while tracing is off.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, error=None):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class JsonlExporter:
+    def __init__(self, path, buffer_size=64):
+        """
+        Append finished spans to a JSON lines file.
+        Spans are buffered and written when the buffer is full, when a root span (a whole trace) ends, and
+        at exit.
+
+        Args:
+            path (str): The file to append to
+            buffer_size (int): Number of spans buffered before a write
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self._buffer.append(json.dumps(span.to_dict(), default=str))
+            if span.parent_span_id is None or len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            with open(self.path, "a", encoding="utf-8") as output:
+                output.write("\n".join(self._buffer) + "\n")
+            self._buffer = []
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+
+_exporter = None
+
+
+def configure(path=None):
+    """
+    Turn tracing on (spans go to path) or off (path is None).
+    TRACE_PATH is read once at import; call this to change it at run time.
+
+    Args:
+        path (str): JSON lines file the spans are appended to, or None to disable tracing
+    """
+    global _exporter
+    if _exporter is not None:
+        _exporter.flush()
+    _exporter = JsonlExporter(path) if path else None
+
+
+def enabled():
+    """
+    Whether spans are being recorded.
+    """
+    return _exporter is not None
+
+
+def flush():
+    """
+    Write out any buffered spans.
+    """
+    if _exporter is not None:
+        _exporter.flush()
+
+
+configure(os.getenv("TRACE_PATH") or None)
+atexit.register(flush)
+
+
+### Recording spans ###
+def start_span(name, kind="internal", **attributes):
+    """
+    Start a span under the current one without making it current. The caller must end() it.
+    Used for work that finishes somewhere else, such as a streamed HTTP response.
+
+    Returns:
+        Span: The span, or a no-op stand-in while tracing is off
+    """
+    if _exporter is None:
+        return _NOOP
+    return Span(name, kind, _current_span.get(), attributes)
+
+
+class _ActiveSpan:
+    """
+    Context manager that makes a span current for the duration of a block.
+    """
+
+    __slots__ = ("span", "_token")
+
+    def __init__(self, span):
+        self.span = span
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Exited in another context than it was entered in (e.g. a generator finished elsewhere)
+            pass
+        if isinstance(exc, GeneratorExit):
+            # A stream the consumer stopped reading is not a failure
+            self.span.set(cancelled=True)
+            exc = None
+        self.span.end(exc)
+        return False
+
+
+def span(name, kind="internal", **attributes):
+    """
+    Record a block of work as a span, nested under the current one:
+
+        with tracing.span("compaction", results=5) as current:
+            ...
+            current.set(tokens=812)
+
+    Returns:
+        A context manager yielding the span, or a no-op stand-in while tracing is off
+    """
+    if _exporter is None:
+        return _NOOP
+    return _ActiveSpan(Span(name, kind, _current_span.get(), attributes))
+
+
+def annotate(**attributes):
+    """
+    Add attributes to the current span, if there is one.
+    """
+    if _exporter is not None:
+        current = _current_span.get()
+        if current is not None:
+            current.attributes.update(attributes)
+
+
+def _size(value):
+    return len(value) if isinstance(value, (str, bytes)) else len(json.dumps(value, default=str))
+
+
+def traced_turn(func):
+    """
+    Decorator for an agent's chat, achat or stream_chat method: the call becomes a 'turn' span, and every
+    LLM request and tool call made during it is nested under it. Works on plain methods, coroutines and
+    generators. Methods that only delegate to another traced method (e.g. a chat that drains stream_chat)
+    should not be decorated, or the turn is recorded twice.
+    """
+    def attributes(agent, args):
+        message = args[0] if args else ""
+        return {"agent": getattr(agent, "name", type(agent).__module__), "method": func.__name__,
+                "input_chars": len(str(message))}
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(self, *args, **kwargs):
+            if _exporter is None:
+                return (yield from func(self, *args, **kwargs))
+            with span("turn", "turn", **attributes(self, args)) as turn:
+                output_chars = 0
+                for chunk in func(self, *args, **kwargs):
+                    if not output_chars:
+                        turn.set(time_to_first_chunk_ms=(time.perf_counter() - turn._start) * 1000)
+                    output_chars += len(str(chunk))
+                    yield chunk
+                turn.set(output_chars=output_chars)
+        return generator_wrapper
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def coroutine_wrapper(self, *args, **kwargs):
+            if _exporter is None:
+                return await func(self, *args, **kwargs)
+            with span("turn", "turn", **attributes(self, args)) as turn:
+                result = await func(self, *args, **kwargs)
+                turn.set(output_chars=len(str(result)))
+                return result
+        return coroutine_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if _exporter is None:
+            return func(self, *args, **kwargs)
+        with span("turn", "turn", **attributes(self, args)) as turn:
+            result = func(self, *args, **kwargs)
+            turn.set(output_chars=len(str(result)))
+            return result
+    return wrapper
+
+
+def traced_tool(name):
+    """
+    Decorator for a tool function (sync or async): each call becomes a 'tool' span with the size in
+    characters of its input and output.
+
+    Args:
+        name (str): The tool's name as the model sees it
+    """
+    def decorator(func):
+        def record(current, args, kwargs, result):
+            current.set(input_chars=_size([args, kwargs]), output_chars=_size(result))
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def coroutine_wrapper(*args, **kwargs):
+                if _exporter is None:
+                    return await func(*args, **kwargs)
+                with span(name, "tool") as current:
+                    result = await func(*args, **kwargs)
+                    record(current, args, kwargs, result)
+                    return result
+            return coroutine_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _exporter is None:
+                return func(*args, **kwargs)
+            with span(name, "tool") as current:
+                result = func(*args, **kwargs)
+                record(current, args, kwargs, result)
+                return result
+        return wrapper
+    return decorator
+
+
+### Token usage of LLM responses ###
+USAGE_KEYS = ("prompt_tokens", "completion_tokens", "total_tokens", "input_tokens", "output_tokens",
+              "cache_creation_input_tokens", "cache_read_input_tokens")
+
+
+def _merge_usage(usage, found):
+    for key in USAGE_KEYS:
+        value = found.get(key)
+        if isinstance(value, int):
+            # Streams repeat usage (Anthropic's message_start and message_delta, an Assistants run and
+            # its steps), with the totals last and largest
+            usage[key] = max(usage.get(key, 0), value)
+    details = found.get("prompt_tokens_details") or {}
+    if isinstance(details.get("cached_tokens"), int):
+        usage["cached_tokens"] = max(usage.get("cached_tokens", 0), details["cached_tokens"])
+
+
+def _find_usage(data, usage):
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key == "usage" and isinstance(value, dict):
+                _merge_usage(usage, value)
+            elif isinstance(value, (dict, list)):
+                _find_usage(value, usage)
+    elif isinstance(data, list):
+        for item in data:
+            _find_usage(item, usage)
+
+
+def parse_usage(body, content_type=""):
+    """
+    Extract token usage from an OpenAI or Anthropic response body, plain JSON or server-sent events.
+
+    Args:
+        body (bytes): The response body
+        content_type (str): The response's Content-Type header
+
+    Returns:
+        dict: Token counts found in the body, empty if there were none
+    """
+    usage = {}
+    if b'"usage"' not in body:
+        return usage
+    text = body.decode("utf-8", errors="replace")
+    if "event-stream" in content_type:
+        documents = [line[5:].strip() for line in text.splitlines() if line.startswith("data:")]
+    else:
+        documents = [text]
+    for document in documents:
+        if '"usage"' not in document:
+            continue
+        try:
+            _find_usage(json.loads(document), usage)
+        except ValueError:
+            continue
+    return usage
+
+
+### Reading traces ###
+def summarize(path):
+    """
+    Break down each traced turn into LLM, tool and remaining (framework) time.
+
+    Args:
+        path (str): A JSON lines file written by this module
+
+    Returns:
+        list: One dict per turn, in the order the turns started
+    """
+    spans = []
+    with open(path, encoding="utf-8") as source:
+        for line in source:
+            if line.strip():
+                spans.append(json.loads(line))
+    children = {}
+    for record in spans:
+        children.setdefault(record["parent_span_id"], []).append(record)
+
+    def descendants(record):
+        for child in children.get(record["span_id"], []):
+            yield child
+            yield from descendants(child)
+
+    def busy_ms(records):
+        # Wall-clock time covered by the records, with overlapping (concurrent) spans counted once
+        intervals = sorted((r["start_time_unix_nano"], r["end_time_unix_nano"]) for r in records)
+        total, current_start, current_end = 0, None, None
+        for start, end in intervals:
+            if current_end is None or start > current_end:
+                if current_end is not None:
+                    total += current_end - current_start
+                current_start, current_end = start, end
+            else:
+                current_end = max(current_end, end)
+        if current_end is not None:
+            total += current_end - current_start
+        return total / 1e6
+
+    turns = []
+    for record in sorted((r for r in spans if r["kind"] == "turn"), key=lambda r: r["start_time_unix_nano"]):
+        below = list(descendants(record))
+        llm = [r for r in below if r["kind"] == "llm"]
+        tools = [r for r in below if r["kind"] == "tool"]
+        llm_ms, tool_ms = busy_ms(llm), busy_ms(tools)
+        turns.append({
+            "agent": record["attributes"].get("agent"),
+            "method": record["attributes"].get("method"),
+            "status": record["status"],
+            "total_ms": record["duration_ms"],
+            "llm_ms": llm_ms,
+            "llm_calls": len(llm),
+            # Anthropic counts cached prompt tokens separately from input_tokens
+            "input_tokens": sum(r["attributes"].get("input_tokens", r["attributes"].get("prompt_tokens", 0))
+                                + r["attributes"].get("cache_creation_input_tokens", 0)
+                                + r["attributes"].get("cache_read_input_tokens", 0) for r in llm),
+            "output_tokens": sum(r["attributes"].get("output_tokens", r["attributes"].get("completion_tokens", 0))
+                                 for r in llm),
+            "tool_ms": tool_ms,
+            "tool_calls": len(tools),
+            "other_ms": max(0.0, record["duration_ms"] - busy_ms(llm + tools)),
+        })
+    return turns
+
+
+def main():
+    """
+    Print the per-turn breakdown of a trace file.
+    """
+    import sys
+
+    if len(sys.argv) != 2:
+        print("Usage: python tracing.py trace.jsonl")
+        return
+    print(f"{'agent':<20}{'method':<13}{'total ms':>10}{'llm ms':>9}{'calls':>7}{'tokens in/out':>15}"
+          f"{'tool ms':>9}{'tools':>7}{'other ms':>10}")
+    for turn in summarize(sys.argv[1]):
+        tokens = f"{turn['input_tokens']}/{turn['output_tokens']}"
+        print(f"{str(turn['agent']):<20}{str(turn['method']):<13}{turn['total_ms']:>10.0f}{turn['llm_ms']:>9.0f}"
+              f"{turn['llm_calls']:>7}{tokens:>15}{turn['tool_ms']:>9.0f}{turn['tool_calls']:>7}"
+              f"{turn['other_ms']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
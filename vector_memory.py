@@ -0,0 +1,232 @@
+import re
+import time
+import zlib
+import functools
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.memory import ChatMemoryBuffer
+
+from history import count_tokens
+from tracing import annotate
+
+# Retrieval-based long-term memory for the Llama-Index agent.
+#
+# ChatMemoryBuffer sends the most recent messages that fit its token limit and silently drops the rest, so a
+# long decision session forgets the goals and constraints the user gave at the start. RetrievalMemory keeps
+# the same short buffer of recent messages, but every turn that falls out of it is archived in a VectorIndex.
+# On each turn, the archived turns most similar to the user's message (at most top_k, and only above
+# min_score) are put in front of the recent messages, as one system message. The agent calls get() once per
+# reasoning step; the retrieval is done once per turn.
+#
+# The index runs on the CPU, with no model and no network: a turn is embedded by hashing its words and word
+# pairs into a fixed-size vector (the "hashing trick"), with sublinear term weights, normalized to unit length.
+# Retrieval is then one matrix-vector product over all archived turns with NumPy. This finds turns that
+# share vocabulary with the question (budget, Berlin, mortgage), which is what a decision session mostly
+# needs to recall, rather than paraphrases.
+#
+# Every turn records its retrieval time, the turns retrieved and the tokens injected (turn_metrics), and adds
+# them to the turn's trace (see tracing.py).
+
+DIMENSIONS = 1024
+
+_WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = frozenset(
+    "a an and are as at be but by can could do does for from had has have how i if in into is it its me my "
+    "of on or our so than that the their them then there these they this to was we were what when where which "
+    "who will with would you your user assistant".split())
+
+RETRIEVED_HEADER = "Relevant earlier turns of this conversation, recalled from long-term memory:"
+
+
+@functools.lru_cache(maxsize=65536)
+def _feature(term, dimensions):
+    # Index and sign of a term in the hashed vector. The sign halves the damage done by hash collisions
+    h = zlib.crc32(term.encode("utf-8"))
+    return h % dimensions, 1.0 if h & 0x80000000 else -1.0
+
+
+def embed(text, dimensions=DIMENSIONS):
+    """
+    Embed text as a unit vector of hashed word and word-pair counts.
+
+    Args:
+        text (str): The text to embed
+        dimensions (int): Size of the vector
+
+    Returns:
+        numpy.ndarray: A float32 vector of unit length, or all zeros for text without any content words
+    """
+    words = [word for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+    vector = np.zeros(dimensions, dtype=np.float32)
+    if not words:
+        return vector
+    # Word pairs count half, so that they sharpen matches without drowning out single shared words
+    features = [(*_feature(word, dimensions), 1.0) for word in words]
+    features += [(*_feature(f"{first} {second}", dimensions), 0.5) for first, second in zip(words, words[1:])]
+    indexes, signs, weights = zip(*features)
+    np.add.at(vector, np.fromiter(indexes, dtype=np.intp),
+              np.fromiter(signs, dtype=np.float32) * np.fromiter(weights, dtype=np.float32))
+    # Sublinear term frequency: a word repeated ten times is not ten times as relevant
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class VectorIndex:
+    def __init__(self, dimensions=DIMENSIONS, capacity=64):
+        """
+        Initialize an empty index.
+
+        Args:
+            dimensions (int): Size of the embeddings
+            capacity (int): Rows allocated up front; the matrix doubles when it is full
+        """
+        self.dimensions = dimensions
+        self._matrix = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.texts = []
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, text):
+        """
+        Embed a text and add it to the index.
+        """
+        if len(self.texts) == len(self._matrix):
+            self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+        self._matrix[len(self.texts)] = embed(text, self.dimensions)
+        self.texts.append(text)
+
+    def search(self, query, k=3, min_score=0.0):
+        """
+        Find the texts most similar to a query.
+
+        Args:
+            query (str): The query text
+            k (int): Maximum number of results
+            min_score (float): Cosine similarity below which results are dropped
+
+        Returns:
+            list: (index, score) pairs, best first
+        """
+        count = len(self.texts)
+        if not count or k <= 0:
+            return []
+        scores = self._matrix[:count] @ embed(query, self.dimensions)
+        if k < count:
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(count)
+        best = best[np.argsort(-scores[best])]
+        return [(int(i), float(scores[i])) for i in best if scores[i] > min_score]
+
+    def clear(self):
+        self._matrix[:] = 0
+        self.texts = []
+
+
+class RetrievalMemory(ChatMemoryBuffer):
+    top_k: int = Field(default=3, description="Archived turns recalled per turn at most.")
+    min_score: float = Field(default=0.05, description="Similarity below which an archived turn is not recalled.")
+
+    _index: VectorIndex = PrivateAttr(default_factory=VectorIndex)
+    _tokens: List[int] = PrivateAttr(default_factory=list)  # token count of each message, in chat store order
+    _archived: int = PrivateAttr(default=0)  # messages before this position are in the index
+    _retrieval_key: Any = PrivateAttr(default=None)
+    _recalled: Optional[ChatMessage] = PrivateAttr(default=None)
+    _turn_metrics: List[dict] = PrivateAttr(default_factory=list)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RetrievalMemory"
+
+    @property
+    def turn_metrics(self):
+        """
+        One dict per turn: retrieval_ms, recalled turns, injected_tokens, archived_turns and recent_messages.
+        """
+        return self._turn_metrics
+
+    @property
+    def index(self):
+        return self._index
+
+    def _recent_start(self, messages, initial_token_count=0):
+        """
+        Position of the first message of the recent buffer: as many of the latest messages as fit the token
+        limit, starting with a user message. Token counts are kept per message, so each is counted once.
+        """
+        if len(self._tokens) > len(messages):
+            self._tokens = []
+        self._tokens.extend(count_tokens(message.content or "") for message in messages[len(self._tokens):])
+        start, total = len(messages), initial_token_count
+        while start > 0 and total + self._tokens[start - 1] <= self.token_limit:
+            start -= 1
+            total += self._tokens[start]
+        while start < len(messages) and messages[start].role in (MessageRole.ASSISTANT, MessageRole.TOOL):
+            start += 1
+        return start
+
+    def _archive(self, messages, end):
+        """
+        Add the turns between the last archived message and end to the index, one entry per turn.
+        """
+        if end <= self._archived:
+            return
+        turn = []
+        for message in messages[self._archived:end]:
+            if message.role == MessageRole.USER and turn:
+                self._index.add("\n".join(turn))
+                turn = []
+            if message.role in (MessageRole.USER, MessageRole.ASSISTANT) and message.content:
+                turn.append(f"{message.role.value}: {message.content}")
+        if turn:
+            self._index.add("\n".join(turn))
+        self._archived = end
+
+    def get(self, input: Optional[str] = None, initial_token_count: int = 0, **kwargs: Any) -> List[ChatMessage]:
+        """
+        The recent messages, preceded by the archived turns most relevant to input, if any.
+        """
+        messages = self.get_all()
+        start = self._recent_start(messages, initial_token_count)
+        self._archive(messages, start)
+        recent = messages[start:]
+        if input is None:
+            return recent
+
+        # The chat store only changes at the end of a turn, so this is a new turn when either has changed
+        key = (input, len(messages))
+        if key != self._retrieval_key:
+            began = time.perf_counter()
+            found = self._index.search(input, self.top_k, self.min_score)
+            # In conversation order, so the recalled turns read as a story
+            texts = [self._index.texts[i] for i, _ in sorted(found)]
+            self._recalled = (ChatMessage(role=MessageRole.SYSTEM, content="\n\n".join([RETRIEVED_HEADER, *texts]))
+                              if texts else None)
+            metrics = {
+                "retrieval_ms": (time.perf_counter() - began) * 1000,
+                "recalled": len(texts),
+                "injected_tokens": count_tokens(self._recalled.content) if texts else 0,
+                "archived_turns": len(self._index),
+                "recent_messages": len(recent),
+            }
+            self._turn_metrics.append(metrics)
+            annotate(**{f"memory_{name}": value for name, value in metrics.items()})
+            self._retrieval_key = key
+        return [self._recalled, *recent] if self._recalled is not None else recent
+
+    def reset(self) -> None:
+        """
+        Forget the whole conversation, including the archived turns and the metrics.
+        """
+        super().reset()
+        self._index.clear()
+        self._tokens = []
+        self._archived = 0
+        self._retrieval_key = None
+        self._recalled = None
+        self._turn_metrics = []